@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ProductPriceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps_shared.product_price'
+
+    def ready(self):
+        from . import signals  # noqa: F401
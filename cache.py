@@ -0,0 +1,707 @@
+import asyncio
+import copy
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Min
+from django.utils import timezone
+from django.utils.translation import get_language, gettext_lazy as _
+from parler.utils.i18n import get_active_language_choices
+
+from apps_shared.product.choices import PRICING_TYPE
+from apps_shared.product.utils import get_create_product
+
+
+DEFAULT_LOOKUP_TIMEOUT = getattr(settings, 'PRODUCT_PRICE_DEFAULT_LOOKUP_TIMEOUT', 300)
+WARM_CACHES = getattr(settings, 'PRODUCT_PRICE_WARM_CACHES', True)
+PRICE_CACHE_ALIAS = getattr(settings, 'PRODUCT_PRICE_CACHE_ALIAS', 'default')
+PRICE_CACHE_TIMEOUT = getattr(settings, 'PRODUCT_PRICE_CACHE_TIMEOUT', 6 * 3600)
+PRICE_CACHE_REFRESH_KEYS = getattr(settings, 'PRODUCT_PRICE_CACHE_REFRESH_KEYS', 1000)
+PRICE_CACHE_STALE = getattr(settings, 'PRODUCT_PRICE_CACHE_STALE', 30)
+PRICE_CACHE_LOCK_TIMEOUT = getattr(settings, 'PRODUCT_PRICE_CACHE_LOCK_TIMEOUT', 10)
+PRICE_CACHE_LOCAL_SIZE = getattr(settings, 'PRODUCT_PRICE_CACHE_LOCAL_SIZE', 10000)
+PRICE_CACHE_POLL_INTERVAL = getattr(settings, 'PRODUCT_PRICE_CACHE_POLL_INTERVAL', 1)
+PRICE_CACHE_PREFIX = 'product_price:price:'
+TRANSLATION_CACHE_TIMEOUT = getattr(settings, 'PRODUCT_PRICE_TRANSLATION_CACHE_TIMEOUT', 3600)
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class DefaultLookupCache:
+    """
+    Process level memo of the `is_default` row per model (Store, PriceGroup, Country, ...).
+
+    get() hands out a copy of the memoized row, so threads and model field defaults never share
+    one instance. Changes bump a generation key in the shared cache (see changed()); every process
+    compares it at most once per PRICE_CACHE_POLL_INTERVAL and drops its entries when it moved.
+    The timeout bounds staleness when the shared cache loses the key.
+    """
+
+    GENERATION_KEY = 'product_price:defaults:generation'
+
+    def __init__(self, timeout=DEFAULT_LOOKUP_TIMEOUT, alias=PRICE_CACHE_ALIAS, poll_interval=PRICE_CACHE_POLL_INTERVAL):
+        self.timeout = timeout
+        self.alias = alias
+        self.poll_interval = poll_interval
+        self._entries = {}
+        self._generation = None
+        self._checked_until = 0
+        self._lock = threading.RLock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _sync(self):
+        now = time.monotonic()
+        if now < self._checked_until:
+            return
+        with self._lock:
+            self._checked_until = now + self.poll_interval
+            generation = self.cache.get(self.GENERATION_KEY)
+            if generation != self._generation:
+                self._entries.clear()
+                self._generation = generation
+
+    def _entry(self, model):
+        self._sync()
+        entry = self._entries.get(model._meta.label)
+        if entry and entry[2] > time.monotonic():
+            return entry
+        with self._lock:
+            entry = self._entries.get(model._meta.label)
+            if entry and entry[2] > time.monotonic():
+                return entry
+            instance = model.get_default()
+            if instance is None:
+                return None
+            entry = (instance.pk, instance, time.monotonic() + self.timeout)
+            self._entries[model._meta.label] = entry
+            return entry
+
+    def get(self, model):
+        entry = self._entry(model)
+        return copy.copy(entry[1]) if entry is not None else None
+
+    def get_pk(self, model):
+        entry = self._entry(model)
+        return entry[0] if entry is not None else None
+
+    def invalidate(self, model=None, instance=None):
+        if model is None:
+            self._entries.clear()
+            return
+        entry = self._entries.get(model._meta.label)
+        if entry is None:
+            return
+        if instance is None or getattr(instance, 'is_default', False) or instance.pk == entry[0]:
+            self._entries.pop(model._meta.label, None)
+
+    def changed(self, model=None, instance=None):
+        """
+        Drop the entry here and make every other process drop its entries. Called by the signal
+        handlers; call it after bulk updates of is_default, which send no signals.
+        """
+        self.invalidate(model, instance)
+        self.cache.set(self.GENERATION_KEY, uuid.uuid4().hex, None)
+
+
+default_lookups = DefaultLookupCache()
+
+
+class CouponProductCache:
+    """
+    Per store memo of the synthetic products coupon discounts are booked on
+    (DISCOUNT_COUPON_ABS / DISCOUNT_COUPON_PERC). Filled lazily by the coupon application path,
+    the only place allowed to create them; get() hands out a copy of the memoized instance, as
+    DefaultLookupCache does. Entries are dropped when such a product is saved or deleted.
+
+    The pks are also kept in the shared cache, so warm() can load the products of every process
+    with one read only query before the first coupon is applied.
+    """
+
+    PRODUCTS = {
+        'DISCOUNT_COUPON_ABS': {'name': _('Discount Coupon'), 'pricing_type': PRICING_TYPE.PRICE, 'default_price': 0},
+        'DISCOUNT_COUPON_PERC': {'name': _('Discount Coupon'), 'pricing_type': PRICING_TYPE.PERCENTAGE_TOTAL, 'default_price': 0},
+    }
+
+    def __init__(self, timeout=DEFAULT_LOOKUP_TIMEOUT, alias=PRICE_CACHE_ALIAS):
+        self.timeout = timeout
+        self.alias = alias
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def make_key(self, code, store_pk):
+        return f'product_price:coupon_product:{code}:{store_pk}'
+
+    def _entry(self, code, store):
+        key = (code, getattr(store, 'pk', store))
+        entry = self._entries.get(key)
+        if entry and entry[2] > time.monotonic():
+            return entry
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[2] > time.monotonic():
+                return entry
+            product = self._get_create(code, store)
+            self.cache.set(self.make_key(*key), product.pk, None)
+            entry = self._entries[key] = (product.pk, product, time.monotonic() + self.timeout)
+            return entry
+
+    def get_pk(self, code, store):
+        return self._entry(code, store)[0]
+
+    def get(self, code, store):
+        return copy.copy(self._entry(code, store)[1])
+
+    def _get_create(self, code, store):
+        try:
+            with transaction.atomic():
+                return get_create_product(code, self.PRODUCTS[code], store)[0]
+        except IntegrityError:
+            # another process created it between our lookup and insert
+            return get_create_product(code, self.PRODUCTS[code], store)[0]
+
+    def warm(self, store_pks):
+        """
+        Memoize the coupon products other processes already resolved for store_pks. Read only:
+        products nobody resolved yet are left to the coupon application path.
+        """
+        from apps_shared.product.models import Product
+        keys = {self.make_key(code, store_pk): (code, store_pk) for store_pk in store_pks for code in self.PRODUCTS}
+        pks = {keys[key]: pk for key, pk in self.cache.get_many(list(keys)).items()}
+        products = Product.objects.in_bulk(set(pks.values()))
+        expires = time.monotonic() + self.timeout
+        with self._lock:
+            for key, pk in pks.items():
+                if pk in products and key not in self._entries:
+                    self._entries[key] = (pk, products[pk], expires)
+
+    def invalidate(self, product_pk=None):
+        if product_pk is None:
+            self._entries.clear()
+            return
+        for key, entry in list(self._entries.items()):
+            if entry[0] == product_pk:
+                self._entries.pop(key, None)
+
+
+coupon_products = CouponProductCache()
+
+
+class TranslationCache:
+    """
+    Shared cache of one parler translated field per object and language (with parler's fallbacks),
+    filled for many objects with one query. Entries are dropped by the translation signals in signals.py.
+    """
+
+    def __init__(self, field, alias=PRICE_CACHE_ALIAS, timeout=TRANSLATION_CACHE_TIMEOUT):
+        self.field = field
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def make_key(self, model, pk, language):
+        return f'product_price:translation:{model._meta.label_lower}:{self.field}:{language}:{pk}'
+
+    def get_many(self, model, pks, language=None):
+        """
+        Returns {pk: value}; objects without any usable translation map to None.
+        """
+        language = language or get_language() or settings.LANGUAGE_CODE
+        keys = {pk: self.make_key(model, pk, language) for pk in pks}
+        found = self.cache.get_many(keys.values())
+        values = {pk: found[key][0] for pk, key in keys.items() if key in found}
+        missing = [pk for pk in keys if pk not in values]
+        if missing:
+            choices = get_active_language_choices(language)
+            translations = {}
+            rows = model._parler_meta.root_model.objects.filter(master_id__in=missing, language_code__in=choices)
+            for master_id, language_code, value in rows.values_list('master_id', 'language_code', self.field):
+                translations.setdefault(master_id, {})[language_code] = value
+            loaded = {}
+            for pk in missing:
+                available = translations.get(pk, {})
+                loaded[pk] = next((available[choice] for choice in choices if choice in available), None)
+            # values are wrapped, so a missing translation is cached as well
+            self.cache.set_many({keys[pk]: (value,) for pk, value in loaded.items()}, self.timeout)
+            values.update(loaded)
+        return values
+
+    def get(self, instance, language=None):
+        return self.get_many(type(instance), [instance.pk], language).get(instance.pk)
+
+    def invalidate(self, model, pk):
+        self.cache.delete_many([self.make_key(model, pk, language) for language, _name in settings.LANGUAGES])
+
+
+discount_labels = TranslationCache('discount_label')
+
+
+def next_validity_boundary(now=None):
+    """
+    The first instant after now at which a ProductPrice, Discount or DiscountCoupon becomes valid or expires.
+    """
+    from .models import ProductPrice, Discount, DiscountCoupon
+    now = now or timezone.now()
+    boundaries = []
+    for queryset in (ProductPrice.objects.filter_live(), Discount.objects.all(), DiscountCoupon.objects.all()):
+        for field in ('valid_from', 'valid_to'):
+            boundary = queryset.filter(**{f'{field}__gt': now}).aggregate(boundary=Min(field))['boundary']
+            if boundary is not None:
+                boundaries.append(boundary)
+    return min(boundaries, default=None)
+
+
+class BoundaryScheduler:
+    """
+    Recomputes the most recently used price cache entries right after the next validity boundary,
+    so hot entries are warm again the moment prices flip instead of on the next miss.
+    """
+
+    def __init__(self, price_cache, max_entries=PRICE_CACHE_REFRESH_KEYS):
+        self.price_cache = price_cache
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._timer = None
+        self._boundary = None
+        self._lock = threading.Lock()
+
+    def register(self, key, compute, scope=None):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (compute, scope)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            scheduled = self._boundary is not None
+        if not scheduled:
+            self.schedule()
+
+    def schedule(self):
+        boundary = self.price_cache.boundary()
+        with self._lock:
+            if self._boundary == boundary:
+                return
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._boundary = boundary
+            # one second of slack so valid_from <= now() holds for the rows at the boundary
+            delay = max((boundary - timezone.now()).total_seconds(), 0) + 1
+            if delay <= self.price_cache.max_timeout:
+                self._timer = threading.Timer(delay, self._run)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _run(self):
+        with self._lock:
+            self._timer = None
+            self._boundary = None
+            entries = list(self._entries.items())
+        try:
+            self.price_cache.reset_boundary()
+            for key, (compute, scope) in entries:
+                self.price_cache.refresh(key, compute, scope)
+        except Exception:
+            logger.exception('Refreshing price cache at validity boundary failed')
+        finally:
+            connections.close_all()
+        self.schedule()
+
+    def reset(self):
+        # the next register() recomputes the boundary; no queries on the write path
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = None
+            self._boundary = None
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs one computation per key at a time in this process; concurrent callers wait for and share its result.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, compute):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+        try:
+            call.value = compute()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+        return call.value
+
+
+class LocalCache:
+    """
+    Bounded in-process LRU tier. Entries are (value, fresh_until, stale_until, scope).
+    """
+
+    def __init__(self, max_entries=PRICE_CACHE_LOCAL_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, fresh_until, stale_until, scope=None):
+        with self._lock:
+            self._entries[key] = (value, fresh_until, stale_until, scope)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def drop_scopes(self, scopes):
+        scopes = set(scopes)
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[3] in scopes]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class PriceCache:
+    """
+    Two level cache of resolved prices: an in-process LRU in front of the shared Django cache
+    PRODUCT_PRICE_CACHE_ALIAS (locmem works as a single process stand-in).
+
+    Entries expire at the next validity boundary (capped by PRODUCT_PRICE_CACHE_TIMEOUT), so a cached
+    resolution is never served past the instant a price, discount or coupon starts or ends.
+
+    Changes are published as events: changed(scopes) bumps the version of the affected products (or the
+    global generation) that is part of every shared key, and appends an event to a log in the shared
+    cache. Every process polls the log at most every PRODUCT_PRICE_CACHE_POLL_INTERVAL seconds and drops
+    the affected local entries; stats() reports hit ratios and the observed invalidation lag.
+
+    Recomputation is coalesced: within a process through SingleFlight, across processes through a lock
+    key in the shared cache. An entry that expires at the PRODUCT_PRICE_CACHE_TIMEOUT cap rather than at
+    a boundary is kept up to PRODUCT_PRICE_CACHE_STALE seconds longer, never past the boundary, and while
+    one worker recomputes it the others keep serving the stale value.
+    """
+    GENERATION_KEY = 'product_price:generation'
+    BOUNDARY_KEY = 'product_price:boundary'
+    SCOPE_VERSION_PREFIX = 'product_price:scope:'
+    EVENT_SEQUENCE_KEY = 'product_price:event_sequence'
+    EVENT_PREFIX = 'product_price:event:'
+    EVENT_TIMEOUT = 3600
+    EVENT_BATCH = 1000
+
+    def __init__(self, alias=PRICE_CACHE_ALIAS, max_timeout=PRICE_CACHE_TIMEOUT):
+        self.alias = alias
+        self.max_timeout = max_timeout
+        self.scheduler = BoundaryScheduler(self)
+        self.flight = SingleFlight()
+        self.local = LocalCache()
+        self._sequence = None
+        self._polled = 0
+        self._poll_lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def boundary(self):
+        boundary = self.cache.get(self.BOUNDARY_KEY)
+        if boundary is None:
+            boundary = next_validity_boundary() or timezone.now() + timezone.timedelta(seconds=self.max_timeout)
+            self.cache.set(self.BOUNDARY_KEY, boundary, self._seconds_until(boundary))
+        return boundary
+
+    def reset_boundary(self):
+        self.cache.delete(self.BOUNDARY_KEY)
+
+    def _seconds_until(self, boundary):
+        return max(1, min(self.max_timeout, int((boundary - timezone.now()).total_seconds())))
+
+    def lifetime(self, boundary):
+        """
+        (timeout, stale) seconds of an entry stored now: fresh until the boundary, capped by max_timeout.
+        Only an entry cut off by the cap gets a stale window, and that window ends at the boundary.
+        """
+        timeout = self._seconds_until(boundary)
+        remaining = int((boundary - timezone.now()).total_seconds()) - timeout
+        return timeout, max(0, min(PRICE_CACHE_STALE, remaining))
+
+    def make_key(self, key, scope=None):
+        scope_key = f'{self.SCOPE_VERSION_PREFIX}{scope}'
+        versions = self.cache.get_many([self.GENERATION_KEY, scope_key])
+        generation = versions.get(self.GENERATION_KEY)
+        if generation is None:
+            generation = self.cache.get_or_set(self.GENERATION_KEY, time.time_ns, None)
+        return f'{PRICE_CACHE_PREFIX}{generation}:{versions.get(scope_key, 0)}:{key}'
+
+    def get_or_compute(self, key, compute, scope=None):
+        self.poll()
+        entry = self.local.get(key)
+        if entry is not None and entry[1] > time.time():
+            self._stats['local_hits'] += 1
+            self.scheduler.register(key, compute, scope)
+            return entry[0]
+        full_key = self.make_key(key, scope)
+        entry = self.cache.get(full_key)
+        if entry is None:
+            self._stats['misses'] += 1
+            value = self.flight.do(full_key, lambda: self._fill(key, full_key, compute, scope))
+        elif entry[1] > time.time():
+            self._stats['shared_hits'] += 1
+            value = entry[0]
+            self.local.set(key, value, entry[1], entry[2], scope)
+        elif self.cache.add(full_key + ':lock', 1, PRICE_CACHE_LOCK_TIMEOUT):
+            self._stats['misses'] += 1
+            try:
+                value = self._store(key, full_key, compute, scope)
+            finally:
+                self.cache.delete(full_key + ':lock')
+        else:
+            self._stats['stale_hits'] += 1
+            value = entry[0]
+        self.scheduler.register(key, compute, scope)
+        return value
+
+    async def aget_or_compute(self, key, acompute, scope=None):
+        """
+        Async counterpart of get_or_compute on the async cache API; acompute is awaited on a miss, under
+        the same lock as get_or_compute. Boundary refreshes are registered by synchronous callers only.
+        """
+        if time.monotonic() - self._polled >= PRICE_CACHE_POLL_INTERVAL:
+            await sync_to_async(self.poll)()
+        entry = self.local.get(key)
+        if entry is not None and entry[1] > time.time():
+            self._stats['local_hits'] += 1
+            return entry[0]
+        scope_key = f'{self.SCOPE_VERSION_PREFIX}{scope}'
+        versions = await self.cache.aget_many([self.GENERATION_KEY, scope_key])
+        generation = versions.get(self.GENERATION_KEY)
+        if generation is None:
+            generation = await self.cache.aget_or_set(self.GENERATION_KEY, time.time_ns, None)
+        full_key = f'{PRICE_CACHE_PREFIX}{generation}:{versions.get(scope_key, 0)}:{key}'
+        entry = await self.cache.aget(full_key)
+        if entry is None:
+            self._stats['misses'] += 1
+            return await self._afill(key, full_key, acompute, scope)
+        if entry[1] > time.time():
+            self._stats['shared_hits'] += 1
+            value = entry[0]
+            self.local.set(key, value, entry[1], entry[2], scope)
+        elif await self.cache.aadd(full_key + ':lock', 1, PRICE_CACHE_LOCK_TIMEOUT):
+            self._stats['misses'] += 1
+            try:
+                value = await self._astore(key, full_key, acompute, scope)
+            finally:
+                await self.cache.adelete(full_key + ':lock')
+        else:
+            self._stats['stale_hits'] += 1
+            value = entry[0]
+        return value
+
+    async def _afill(self, key, full_key, acompute, scope):
+        # the lock and wait protocol of _fill, without blocking the event loop
+        lock_key = full_key + ':lock'
+        deadline = time.monotonic() + PRICE_CACHE_LOCK_TIMEOUT
+        locked = await self.cache.aadd(lock_key, 1, PRICE_CACHE_LOCK_TIMEOUT)
+        while not locked:
+            entry = await self.cache.aget(full_key)
+            if entry is not None:
+                self.local.set(key, entry[0], entry[1], entry[2], scope)
+                return entry[0]
+            if time.monotonic() > deadline:
+                break
+            await asyncio.sleep(0.05)
+            locked = await self.cache.aadd(lock_key, 1, PRICE_CACHE_LOCK_TIMEOUT)
+        try:
+            return await self._astore(key, full_key, acompute, scope)
+        finally:
+            if locked:
+                await self.cache.adelete(lock_key)
+
+    async def _astore(self, key, full_key, acompute, scope):
+        value = await acompute()
+        boundary = await self.cache.aget(self.BOUNDARY_KEY)
+        timeout, stale = self.lifetime(boundary if boundary is not None else await sync_to_async(self.boundary)())
+        fresh_until = time.time() + timeout
+        await self.cache.aset(full_key, (value, fresh_until, fresh_until + stale), timeout + stale)
+        self.local.set(key, value, fresh_until, fresh_until + stale, scope)
+        return value
+
+    def _fill(self, key, full_key, compute, scope):
+        lock_key = full_key + ':lock'
+        deadline = time.monotonic() + PRICE_CACHE_LOCK_TIMEOUT
+        locked = self.cache.add(lock_key, 1, PRICE_CACHE_LOCK_TIMEOUT)
+        while not locked:
+            # another process is computing this key; wait for its result
+            entry = self.cache.get(full_key)
+            if entry is not None:
+                self.local.set(key, entry[0], entry[1], entry[2], scope)
+                return entry[0]
+            if time.monotonic() > deadline:
+                break
+            time.sleep(0.05)
+            locked = self.cache.add(lock_key, 1, PRICE_CACHE_LOCK_TIMEOUT)
+        try:
+            return self._store(key, full_key, compute, scope)
+        finally:
+            if locked:
+                self.cache.delete(lock_key)
+
+    def _store(self, key, full_key, compute, scope):
+        value = compute()
+        timeout, stale = self.lifetime(self.boundary())
+        fresh_until = time.time() + timeout
+        self.cache.set(full_key, (value, fresh_until, fresh_until + stale), timeout + stale)
+        self.local.set(key, value, fresh_until, fresh_until + stale, scope)
+        return value
+
+    def refresh(self, key, compute, scope=None):
+        """
+        Recompute key after a validity boundary. Every process refreshes its hot keys at the same moment,
+        so only the one holding the lock computes; entries already fresh again were refreshed elsewhere.
+        """
+        full_key = self.make_key(key, scope)
+        lock_key = full_key + ':lock'
+        if not self._adopt(key, full_key, scope) and self.cache.add(lock_key, 1, PRICE_CACHE_LOCK_TIMEOUT):
+            try:
+                if not self._adopt(key, full_key, scope):
+                    self._store(key, full_key, compute, scope)
+            finally:
+                self.cache.delete(lock_key)
+
+    def _adopt(self, key, full_key, scope):
+        # entries written before the boundary expire at it; a fresh one was computed for the new prices
+        entry = self.cache.get(full_key)
+        if entry is None or entry[1] <= time.time():
+            return False
+        self.local.set(key, entry[0], entry[1], entry[2], scope)
+        return True
+
+    def changed(self, scopes=None):
+        """
+        Invalidate the entries of the given scopes (product ids), or everything when scopes is None.
+        """
+        if scopes is None:
+            self.cache.set(self.GENERATION_KEY, time.time_ns(), None)
+        else:
+            self.cache.set_many({f'{self.SCOPE_VERSION_PREFIX}{scope}': time.time_ns() for scope in scopes}, None)
+        self.reset_boundary()
+        self.scheduler.reset()
+        self._emit(scopes)
+        self._apply(scopes)
+
+    def _emit(self, scopes):
+        try:
+            sequence = self.cache.incr(self.EVENT_SEQUENCE_KEY)
+        except ValueError:
+            self.cache.add(self.EVENT_SEQUENCE_KEY, 0, None)
+            sequence = self.cache.incr(self.EVENT_SEQUENCE_KEY)
+        self.cache.set(f'{self.EVENT_PREFIX}{sequence}', (time.time(), scopes), self.EVENT_TIMEOUT)
+
+    def _apply(self, scopes):
+        if scopes is None:
+            self.local.clear()
+        else:
+            self.local.drop_scopes(scopes)
+
+    def poll(self):
+        """
+        Apply change events published by other processes since the last poll.
+        """
+        now = time.monotonic()
+        if now - self._polled < PRICE_CACHE_POLL_INTERVAL or not self._poll_lock.acquire(blocking=False):
+            return
+        try:
+            self._polled = now
+            sequence = self.cache.get(self.EVENT_SEQUENCE_KEY) or 0
+            if self._sequence is None or sequence < self._sequence or sequence - self._sequence > self.EVENT_BATCH:
+                # first poll, shared cache flushed, or too far behind: start over
+                if self._sequence is not None:
+                    self.local.clear()
+                self._sequence = sequence
+                return
+            keys = [f'{self.EVENT_PREFIX}{number}' for number in range(self._sequence + 1, sequence + 1)]
+            events = self.cache.get_many(keys)
+            for key in keys:
+                event = events.get(key)
+                if event is None:
+                    # expired or not written yet: we cannot tell what changed
+                    self.local.clear()
+                    continue
+                timestamp, scopes = event
+                self._apply(scopes)
+                lag = max(time.time() - timestamp, 0)
+                self._stats['events'] += 1
+                self._stats['lag_total'] += lag
+                self._stats['lag_max'] = max(self._stats['lag_max'], lag)
+            self._sequence = sequence
+        finally:
+            self._poll_lock.release()
+
+    def reset_stats(self):
+        self._stats = {'local_hits': 0, 'shared_hits': 0, 'stale_hits': 0, 'misses': 0, 'events': 0, 'lag_total': 0.0, 'lag_max': 0.0}
+
+    def stats(self):
+        """
+        Hit counters and invalidation lag of this process.
+        """
+        stats = dict(self._stats)
+        lookups = stats['local_hits'] + stats['shared_hits'] + stats['stale_hits'] + stats['misses']
+        stats['lookups'] = lookups
+        stats['hit_ratio'] = round((lookups - stats['misses']) / lookups, 4) if lookups else None
+        stats['local_entries'] = len(self.local)
+        stats['lag_avg'] = round(stats.pop('lag_total') / stats['events'], 4) if stats['events'] else None
+        return stats
+
+
+price_cache = PriceCache()
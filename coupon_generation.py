@@ -0,0 +1,102 @@
+import secrets
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from .cache import price_cache
+from .coupon_guard import discount_codes
+from .models import DiscountCoupon, DiscountCouponRedemption, PriceChangeEvent, ProductDiscountCoupon
+
+import logging
+logger = logging.getLogger(__name__)
+
+CODE_ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+
+
+def generate_codes(count, length=10, prefix='', exclude=()):
+    """
+    Return count distinct random codes, none of them in exclude.
+    """
+    codes = set()
+    exclude = set(exclude)
+    while len(codes) < count:
+        code = prefix + ''.join(secrets.choice(CODE_ALPHABET) for _ in range(length))
+        if code not in exclude:
+            codes.add(code)
+    return list(codes)
+
+
+def _unused_codes(count, length, prefix):
+    """
+    Generate count codes and replace the ones already present in the database.
+    """
+    codes = generate_codes(count, length, prefix)
+    while True:
+        taken = set(DiscountCoupon.objects.filter(discount_code__in=codes).values_list('discount_code', flat=True))
+        if not taken:
+            return codes
+        codes = [code for code in codes if code not in taken]
+        codes += generate_codes(len(taken), length, prefix, exclude=codes)
+
+
+def bulk_create_coupons(count, label, products=(), emails=None, prefix='', length=10, chunk_size=5000, progress=None, **coupon_fields):
+    """
+    Create count single code coupons sharing label (a string or a {language_code: label} dict),
+    the allowed products and coupon_fields, using chunked bulk inserts.
+
+    emails, when given, is an iterable with exactly one email per coupon: a missing email would leave
+    a coupon usable by anyone, so a count mismatch or a blank email raises ValueError.
+    Each chunk is committed in its own transaction; progress(created, count) is called after every chunk.
+    Returns a dict with the created count, elapsed seconds and coupons per second.
+    """
+    if len(prefix) + length > DiscountCoupon._meta.get_field('discount_code').max_length:
+        raise ValueError('Discount code prefix and length exceed the discount code field length')
+    labels = label if isinstance(label, dict) else {settings.LANGUAGE_CODE: label}
+    product_ids = [getattr(product, 'pk', product) for product in products]
+    if emails is not None:
+        emails = [email.strip() for email in emails]
+        if len(emails) != count:
+            raise ValueError(f'Got {len(emails)} emails for {count} coupons')
+        if not all(emails):
+            raise ValueError('Emails must not be blank')
+    Translation = DiscountCoupon._parler_meta.root_model
+
+    started = time.monotonic()
+    created = 0
+    while created < count:
+        size = min(chunk_size, count - created)
+        chunk_emails = emails[created:created + size] if emails is not None else [None] * size
+        coupons = [
+            DiscountCoupon(discount_code=code, email=email, **coupon_fields)
+            for code, email in zip(_unused_codes(size, length, prefix), chunk_emails)
+        ]
+        with transaction.atomic():
+            DiscountCoupon.objects.bulk_create(coupons, batch_size=chunk_size)
+            Translation.objects.bulk_create([
+                Translation(master_id=coupon.pk, language_code=language_code, discount_label=text)
+                for coupon in coupons
+                for language_code, text in labels.items()
+            ], batch_size=chunk_size)
+            ProductDiscountCoupon.objects.bulk_create([
+                ProductDiscountCoupon(discount_coupon_id=coupon.pk, product_id=product_id)
+                for coupon in coupons
+                for product_id in product_ids
+            ], batch_size=chunk_size)
+            if coupon_fields.get('max_uses'):
+                DiscountCouponRedemption.objects.bulk_create([
+                    slot
+                    for coupon in coupons
+                    for slot in DiscountCouponRedemption.slots(coupon.pk, coupon_fields['max_uses'])
+                ], batch_size=chunk_size)
+            PriceChangeEvent.record(coupons)
+        created += size
+        if progress:
+            progress(created, count)
+
+    discount_codes.changed()
+    price_cache.changed()
+    elapsed = time.monotonic() - started
+    result = {'created': created, 'seconds': round(elapsed, 2), 'per_second': round(created / elapsed, 1) if elapsed else created}
+    logger.info('Generated %(created)s discount coupons in %(seconds)ss (%(per_second)s/s)', result)
+    return result
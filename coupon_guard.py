@@ -0,0 +1,126 @@
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import UserRateThrottle
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+CODE_FILTER_ERROR_RATE = getattr(settings, 'PRODUCT_PRICE_CODE_FILTER_ERROR_RATE', 0.001)
+CODE_FILTER_MIN_REBUILD_INTERVAL = getattr(settings, 'PRODUCT_PRICE_CODE_FILTER_MIN_REBUILD_INTERVAL', 5)
+CODE_FILTER_GENERATION_KEY = 'product_price:discount_code_generation'
+# DRF rate; REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']['discount_code'] takes precedence
+COUPON_RATE = getattr(settings, 'PRODUCT_PRICE_COUPON_RATE', '30/min')
+
+
+class BloomFilter:
+    """
+    Fixed size Bloom filter over strings, using double hashing on one blake2b digest.
+    """
+
+    def __init__(self, capacity, error_rate=CODE_FILTER_ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hash_count = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class DiscountCodeFilter:
+    """
+    Process local Bloom filter of all DiscountCoupon.discount_code values.
+
+    A generation token in the shared cache is bumped whenever coupons change; a process whose
+    filter is older rebuilds it in a background thread, and answers "maybe" (falls through to
+    the database) until the rebuild is done, so a valid code is never rejected and no request
+    waits for the full table scan.
+    """
+
+    def __init__(self):
+        self._filter = None
+        self._generation = None
+        self._built = 0
+        self._lock = threading.Lock()
+
+    def may_exist(self, code):
+        generation = cache.get(CODE_FILTER_GENERATION_KEY)
+        if self._filter is None or generation != self._generation:
+            self._rebuild_in_background(generation)
+            return True
+        return code in self._filter
+
+    def _rebuild_in_background(self, generation):
+        if time.monotonic() - self._built < CODE_FILTER_MIN_REBUILD_INTERVAL or not self._lock.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.rebuild(generation)
+            except Exception:
+                # retried after the rebuild interval
+                self._built = time.monotonic()
+                logger.exception('Rebuilding the discount code filter failed')
+            finally:
+                self._lock.release()
+                connections.close_all()
+
+        threading.Thread(target=run, name='product_price_code_filter', daemon=True).start()
+
+    def rebuild(self, generation=None):
+        from .models import DiscountCoupon
+        coupons = DiscountCoupon.objects.all()
+        bloom = BloomFilter(int(coupons.count() * 1.2) + 1000)
+        for code in coupons.values_list('discount_code', flat=True).iterator(chunk_size=10000):
+            bloom.add(code)
+        self._filter, self._generation, self._built = bloom, generation, time.monotonic()
+
+    def add(self, code):
+        if self._filter is not None:
+            self._filter.add(code)
+
+    def changed(self):
+        cache.set(CODE_FILTER_GENERATION_KEY, time.time_ns(), None)
+
+
+class DiscountCodeThrottle(UserRateThrottle):
+    """
+    Rate limit on discount code lookups per user, or per client address for anonymous requests.
+    The request history lives in the cache, so the limit holds across processes.
+    """
+    scope = 'discount_code'
+
+    def get_rate(self):
+        return self.THROTTLE_RATES.get(self.scope, COUPON_RATE)
+
+
+discount_codes = DiscountCodeFilter()
+
+
+def check_discount_code(code, request=None):
+    """
+    Throttle the client and return False when code is certainly not an existing discount code.
+    """
+    if request is not None:
+        throttle = DiscountCodeThrottle()
+        if not throttle.allow_request(request, None):
+            raise Throttled(wait=throttle.wait())
+    return discount_codes.may_exist(code)
@@ -0,0 +1,87 @@
+import csv
+import datetime
+import json
+
+from django.conf import settings
+from django.utils.duration import duration_string
+
+EXPORT_CHUNK_SIZE = getattr(settings, 'PRODUCT_PRICE_EXPORT_CHUNK_SIZE', 2000)
+
+# header -> lookup; headers match the import_prices columns so an export can be imported again
+PRICE_EXPORT_COLUMNS = {
+    'kind': None,
+    'id': 'id',
+    'product_number': 'product__product_number',
+    'price_group': 'price_group__description',
+    'product_price_group': 'product_price_group__description',
+    'price': 'price',
+    'pricing_type': 'pricing_type',
+    'min_order_quantity': 'min_order_quantity',
+    'max_order_quantity': 'max_order_quantity',
+    'min_duration': 'min_duration',
+    'max_duration': 'max_duration',
+    'valid_from': 'valid_from',
+    'valid_to': 'valid_to',
+}
+DISCOUNT_EXPORT_COLUMNS = {
+    'kind': None,
+    'id': 'id',
+    'product_number': 'product__product_number',
+    'product_discount_group': 'product_discount_group__group_number',
+    'customer_discount_group': 'customer_discount_group__group_number',
+    'customer': 'customer_id',
+    'discount_abs': 'discount_abs',
+    'discount_perc': 'discount_perc',
+    'min_order_quantity': 'min_order_quantity',
+    'max_order_quantity': 'max_order_quantity',
+    'min_duration': 'min_duration',
+    'max_duration': 'max_duration',
+    'valid_from': 'valid_from',
+    'valid_to': 'valid_to',
+}
+
+
+def export_columns(model):
+    """
+    Returns the import kind and the columns of model.
+    """
+    from .models import Discount
+    if model is Discount:
+        return 'discount', DISCOUNT_EXPORT_COLUMNS
+    return 'price', PRICE_EXPORT_COLUMNS
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.timedelta):
+        return duration_string(value)
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class _Echo:
+    # csv.writer target that hands each line back instead of buffering it
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset, format='csv', chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield the rows of a ProductPrice or Discount queryset as csv or jsonl lines.
+    Related names are joined in the query and rows are read through a server-side cursor,
+    so memory stays constant however many rows are exported.
+    """
+    kind, columns = export_columns(queryset.model)
+    headers = list(columns)
+    lookups = [lookup for lookup in columns.values() if lookup]
+    rows = queryset.order_by().prefetch_related(None).values_list(*lookups).iterator(chunk_size=chunk_size)
+    if format == 'jsonl':
+        for row in rows:
+            yield json.dumps(dict(zip(headers, (kind, *(_text(value) for value in row))))) + '\n'
+        return
+    writer = csv.writer(_Echo())
+    yield writer.writerow(headers)
+    for row in rows:
+        yield writer.writerow([kind, *(_text(value) for value in row)])
@@ -0,0 +1,92 @@
+import datetime
+
+from django.db import connection, transaction
+
+from .models import CHANGE_OPERATION, PriceChangeEvent, ProductPrice, ProductPriceHistory, Discount, DiscountHistory
+
+import logging
+logger = logging.getLogger(__name__)
+
+# live model -> (history model, extra condition on rows that may be archived)
+ARCHIVES = {
+    ProductPrice: (ProductPriceHistory, 'price_group_id IS NOT NULL'),  # keep staged/archived version prices for rollback
+    Discount: (DiscountHistory, 'TRUE'),
+}
+
+
+def _columns(history_model):
+    return [field.column for field in history_model._meta.concrete_fields if field.name != 'archived_time']
+
+
+def _partition_name(history_model, year):
+    return f'{history_model._meta.db_table}_y{year}'
+
+
+def ensure_partitions(history_model, years):
+    table = history_model._meta.db_table
+    with connection.cursor() as cursor:
+        for year in years:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {_partition_name(history_model, year)} PARTITION OF {table} '
+                f'FOR VALUES FROM (%s) TO (%s)',
+                [datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)],
+            )
+
+
+def archive_expired(live_model, before, batch_size=10000):
+    """
+    Move rows of live_model that expired before the given datetime into its history table.
+    Each batch is one DELETE ... RETURNING feeding an INSERT, so rows are never in both tables,
+    and records a delete PriceChangeEvent per moved row in the same statement.
+    Returns the number of moved rows.
+    """
+    history_model, condition = ARCHIVES[live_model]
+    live_table = live_model._meta.db_table
+    columns = ', '.join(_columns(history_model))
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT DISTINCT EXTRACT(year FROM valid_to)::int FROM {live_table} WHERE valid_to < %s AND {condition}', [before])
+        ensure_partitions(history_model, [row[0] for row in cursor.fetchall()])
+    moved = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'WITH moved AS ('
+                f'DELETE FROM {live_table} WHERE id IN ('
+                f'SELECT id FROM {live_table} WHERE valid_to < %s AND {condition} LIMIT %s FOR UPDATE SKIP LOCKED'
+                f') RETURNING {columns}), '
+                f'archived AS (INSERT INTO {history_model._meta.db_table} ({columns}, archived_time) SELECT {columns}, now() FROM moved) '
+                f'INSERT INTO {PriceChangeEvent._meta.db_table} (model, object_id, product_id, operation) SELECT %s, id, product_id, %s FROM moved',
+                [before, batch_size, live_model._meta.model_name, CHANGE_OPERATION.DELETE],
+            )
+            count = cursor.rowcount
+        moved += count
+        if count < batch_size:
+            break
+    logger.info('Archived %s %s rows that expired before %s', moved, live_model._meta.label, before)
+    return moved
+
+
+def detach_partitions(history_model, before_year, drop=False):
+    """
+    Detach (and optionally drop) the yearly partitions of history_model for years before before_year.
+    Returns the names of the detached partitions.
+    """
+    table = history_model._meta.db_table
+    detached = []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits '
+            'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+            'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE parent.relname = %s',
+            [table],
+        )
+        for (name,) in cursor.fetchall():
+            year = name.rsplit('_y', 1)[-1]
+            if not name.startswith(f'{table}_y') or not year.isdigit() or int(year) >= before_year:
+                continue
+            cursor.execute(f'ALTER TABLE {table} DETACH PARTITION {name}')
+            if drop:
+                cursor.execute(f'DROP TABLE {name}')
+            detached.append(name)
+    return detached
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from apps_shared.product_price.history import ARCHIVES, archive_expired, detach_partitions
+
+
+class Command(BaseCommand):
+    help = 'Move expired prices and discounts to the partitioned history tables and detach old partitions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help='Archive rows with valid_to before this datetime (default: 30 days ago)')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--detach-before', type=int, help='Detach history partitions of years before this year')
+        parser.add_argument('--drop', action='store_true', help='Drop detached partitions')
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timezone.timedelta(days=30)
+        if options['before']:
+            before = parse_datetime(options['before'])
+            if before is None:
+                raise CommandError('Invalid datetime for --before')
+            if timezone.is_naive(before):
+                before = timezone.make_aware(before)
+        for live_model, (history_model, condition) in ARCHIVES.items():
+            moved = archive_expired(live_model, before, batch_size=options['batch_size'])
+            self.stdout.write(f'{live_model._meta.label}: archived {moved} rows')
+            if options['detach_before']:
+                for name in detach_partitions(history_model, options['detach_before'], drop=options['drop']):
+                    self.stdout.write(f'{"Dropped" if options["drop"] else "Detached"} {name}')
+        self.stdout.write(self.style.SUCCESS('Done'))
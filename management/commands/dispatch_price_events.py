@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps_shared.product_price.outbox import OUTBOX_BATCH_SIZE, OUTBOX_RETENTION_DAYS, dispatch_pending, get_consumers, prune_dispatched
+
+
+class Command(BaseCommand):
+    help = 'Stream pending price change events from the outbox to the configured consumers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=OUTBOX_BATCH_SIZE)
+        parser.add_argument('--consumer', action='append', dest='consumers', help='Dotted path of a consumer (default: PRODUCT_PRICE_OUTBOX_CONSUMERS)')
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new events')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds between polls with --loop')
+        parser.add_argument('--prune-days', type=int, default=OUTBOX_RETENTION_DAYS, help='Delete dispatched events older than this')
+
+    def handle(self, *args, **options):
+        consumers = get_consumers(options['consumers'])
+        pruned = prune_dispatched(options['prune_days'])
+        self.stdout.write(f'Pruned {pruned} dispatched events')
+        while True:
+            dispatched = dispatch_pending(consumers, options['batch_size'])
+            if dispatched:
+                self.stdout.write(f'Dispatched {dispatched} price change events')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Done'))
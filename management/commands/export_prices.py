@@ -0,0 +1,27 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from apps_shared.product_price.export import export_rows
+from apps_shared.product_price.models import Discount, ProductPrice
+
+
+class Command(BaseCommand):
+    help = 'Stream live prices or discounts to a csv or jsonl file in the import_prices format'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=['prices', 'discounts'], default='prices')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+        parser.add_argument('--output', help='File to write (default: stdout)')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        queryset = ProductPrice.objects.filter_live() if options['kind'] == 'prices' else Discount.objects.all()
+        out = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        try:
+            out.writelines(export_rows(queryset, options['format'], options['chunk_size']))
+        finally:
+            if options['output']:
+                out.close()
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f'Exported {options["kind"]} to {options["output"]}'))
@@ -0,0 +1,65 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from apps_shared.product_price.coupon_generation import bulk_create_coupons
+
+
+class Command(BaseCommand):
+    help = 'Generate unique discount coupons in bulk for a campaign'
+
+    def add_arguments(self, parser):
+        parser.add_argument('count', type=int)
+        parser.add_argument('--label', required=True)
+        parser.add_argument('--prefix', default='')
+        parser.add_argument('--length', type=int, default=10)
+        parser.add_argument('--product', action='append', default=[], help='Allowed product id, repeatable')
+        parser.add_argument('--emails', help='File with one email per line, one coupon per email')
+        parser.add_argument('--discount-abs', type=Decimal, default=Decimal(0))
+        parser.add_argument('--discount-perc', type=Decimal, default=Decimal(0))
+        parser.add_argument('--minimal-order-amount', type=Decimal, default=Decimal(0))
+        parser.add_argument('--max-uses', type=int)
+        parser.add_argument('--max-uses-per-customer', type=int)
+        parser.add_argument('--valid-from')
+        parser.add_argument('--valid-to')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        fields = {
+            'discount_abs': options['discount_abs'],
+            'discount_perc': options['discount_perc'],
+            'minimal_order_amount': options['minimal_order_amount'],
+            'max_uses': options['max_uses'],
+            'max_uses_per_customer': options['max_uses_per_customer'],
+        }
+        for name in ['valid_from', 'valid_to']:
+            if options[name]:
+                fields[name] = parse_datetime(options[name])
+                if fields[name] is None:
+                    raise CommandError(f'Invalid datetime for --{name.replace("_", "-")}')
+        emails = None
+        if options['emails']:
+            with open(options['emails']) as f:
+                emails = [line.strip() for line in f if line.strip()]
+
+        def progress(created, count):
+            self.stdout.write(f'{created}/{count}')
+
+        try:
+            result = bulk_create_coupons(
+                options['count'],
+                options['label'],
+                products=options['product'],
+                emails=emails,
+                prefix=options['prefix'],
+                length=options['length'],
+                chunk_size=options['chunk_size'],
+                progress=progress,
+                **fields,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {result['created']} coupons in {result['seconds']}s ({result['per_second']}/s)"
+        ))
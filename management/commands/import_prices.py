@@ -0,0 +1,28 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from apps_shared.product_price.price_import import import_price_list
+
+
+class Command(BaseCommand):
+    help = 'Import product prices and discounts from a csv file using a process pool partitioned by product'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--workers', type=int)
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--version', dest='price_list_version', help='Stage prices in this draft price list version')
+
+    def handle(self, *args, **options):
+        def progress(done, total):
+            self.stdout.write(f'{done}/{total}')
+
+        try:
+            result = import_price_list(options['path'], workers=options['workers'], chunk_size=options['chunk_size'], progress=progress, version=options['price_list_version'])
+        except ValidationError as e:
+            raise CommandError('; '.join(str(message) for message in e.messages))
+        for line, message in result['errors']:
+            self.stderr.write(f'line {line}: {message}')
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result['prices']} prices and {result['discounts']} discounts from {result['rows']} rows in {result['seconds']}s"
+        ))
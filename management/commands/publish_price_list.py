@@ -0,0 +1,36 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from apps_shared.product_price.models import PriceListVersion
+
+
+class Command(BaseCommand):
+    help = 'Validate and publish a staged price list version, or roll back a published one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('version')
+        parser.add_argument('--rollback', action='store_true')
+        parser.add_argument('--validate-only', action='store_true')
+        parser.add_argument('--replace-all', action='store_true', help='Replace every live price of the scope, not only those of the products in the version')
+
+    def handle(self, *args, **options):
+        try:
+            version = PriceListVersion.objects.get(pk=options['version'])
+        except (PriceListVersion.DoesNotExist, ValidationError):
+            raise CommandError(f"Price list version {options['version']} does not exist")
+        try:
+            if options['validate_only']:
+                errors = version.validate()
+                for error in errors:
+                    self.stderr.write(str(error))
+                if errors:
+                    raise CommandError(f'{len(errors)} errors found')
+                self.stdout.write(self.style.SUCCESS(f'{version} is valid'))
+            elif options['rollback']:
+                previous = version.rollback()
+                self.stdout.write(self.style.SUCCESS(f'Rolled back to {previous}'))
+            else:
+                version.publish(replace_all=options['replace_all'])
+                self.stdout.write(self.style.SUCCESS(f'Published {version}'))
+        except ValidationError as e:
+            raise CommandError('; '.join(str(message) for message in e.messages))
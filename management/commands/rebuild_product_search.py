@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from apps_shared.product.models import Product
+from apps_shared.product_price.models import ProductSearchText
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product search texts, e.g. after products were changed with bulk updates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        product_ids = Product.objects.order_by('pk').values_list('pk', flat=True)
+        batch, synced = [], 0
+        for product_id in product_ids.iterator(chunk_size=options['batch_size']):
+            batch.append(product_id)
+            if len(batch) == options['batch_size']:
+                ProductSearchText.sync(batch)
+                synced, batch = synced + len(batch), []
+        if batch:
+            ProductSearchText.sync(batch)
+            synced += len(batch)
+        # search texts of products deleted with bulk deletes
+        orphans, _ = ProductSearchText.objects.exclude(product__in=Product.objects.values('pk')).delete()
+        self.stdout.write(f'Synced {synced} products, removed {orphans} orphaned search texts')
+        self.stdout.write(self.style.SUCCESS('Done'))
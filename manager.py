@@ -3,7 +3,15 @@ from django.db import models
 
 
 class DiscountGroupQuerySet(BaseTranslatableQuerySet):
-    pass
+    def applicable_to(self, group):
+        """
+        Discount groups whose discounts apply to products of group: the group itself
+        and every ancestor with include_children, resolved through the closure table.
+        """
+        return self.filter(
+            models.Q(descendant_paths__depth=0) | models.Q(include_children=True),
+            descendant_paths__descendant=group,
+        )
 
 class DiscountGroupManager(BaseTranslationManager):
 
@@ -14,10 +22,46 @@ class DiscountQuerySet(BaseQuerySet):
     def filter_available_prices(self):
         return self.extra(where=['"validFrom" < NOW() AND "validTo" > NOW()' ])
 
+    def filter_product_discount_group(self, group):
+        discount_groups = self.model._meta.get_field('product_discount_group').related_model.objects.applicable_to(group)
+        return self.filter(product_discount_group__in=discount_groups.values('pk'))
+
+    def applicable(self, product, discount_group=None, customer=None, customer_discount_group=None, option=None):
+        """
+        Discounts that apply to product (member of discount_group) for customer: product discounts,
+        discounts of the group hierarchy (filter_product_discount_group), generic or customer specific ones,
+        and option discounts only for that option.
+        """
+        discounts = self.filter(product=product)
+        if discount_group:
+            discounts = discounts | self.filter_product_discount_group(discount_group)
+        options = models.Q(option__isnull=True)
+        if option:
+            options |= models.Q(option=option)
+        return discounts.for_customer(customer, customer_discount_group).filter(options)
+
+    def for_customer(self, customer=None, customer_discount_group=None):
+        # generic discounts, and those of the customer or the customer's discount group
+        customers = models.Q(customer__isnull=True, customer_discount_group__isnull=True)
+        if customer:
+            customers |= models.Q(customer=customer)
+        if customer_discount_group:
+            customers |= models.Q(customer_discount_group=customer_discount_group)
+        return self.filter(customers)
+
 class DiscountManager(models.Manager):
     def get_queryset(self):
         return DiscountQuerySet(self.model, using=self._db)#.filter(is_active=True)
 
+    def filter_product_discount_group(self, group):
+        return self.get_queryset().filter_product_discount_group(group)
+
+    def applicable(self, *args, **kwargs):
+        return self.get_queryset().applicable(*args, **kwargs)
+
+    def for_customer(self, *args, **kwargs):
+        return self.get_queryset().for_customer(*args, **kwargs)
+
 class DiscountCouponQuerySet(BaseTranslatableQuerySet):
     def filter_available_prices(self):
         return self.extra(where=['"validFrom" < NOW() AND "validTo" > NOW()' ])
@@ -26,3 +70,15 @@ class DiscountCouponManager(BaseTranslationManager):
     def get_queryset(self):
         return DiscountCouponQuerySet(self.model, using=self._db)#.filter()
 
+
+class ProductPriceQuerySet(BaseQuerySet):
+    def filter_live(self):
+        # staged and archived PriceListVersion prices have no price group
+        return self.filter(price_group__isnull=False)
+
+class ProductPriceManager(BaseManager):
+    def get_queryset(self):
+        return ProductPriceQuerySet(self.model, using=self._db)
+
+    def filter_live(self):
+        return self.get_queryset().filter_live()
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.7 on 2026-10-19 09:12
+
+import apps_base._base.model_fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_closure_rows(apps, schema_editor):
+    ProductDiscountGroup = apps.get_model('product_price', 'ProductDiscountGroup')
+    ProductDiscountGroupClosure = apps.get_model('product_price', 'ProductDiscountGroupClosure')
+    ProductDiscountGroupClosure.objects.bulk_create([
+        ProductDiscountGroupClosure(ancestor_id=pk, descendant_id=pk, depth=0)
+        for pk in ProductDiscountGroup.objects.values_list('pk', flat=True)
+    ], batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_price', '0009_alter_productprice_pricing_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productdiscountgroup',
+            name='parent',
+            field=apps_base._base.model_fields.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='children', to='product_price.productdiscountgroup', verbose_name='Parent group'),
+        ),
+        migrations.CreateModel(
+            name='ProductDiscountGroupClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', apps_base._base.model_fields.PositiveIntegerField(default=0, verbose_name='Depth')),
+                ('ancestor', apps_base._base.model_fields.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_paths', to='product_price.productdiscountgroup', verbose_name='Ancestor')),
+                ('descendant', apps_base._base.model_fields.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_paths', to='product_price.productdiscountgroup', verbose_name='Descendant')),
+            ],
+            options={
+                'verbose_name': 'Discount group path',
+                'verbose_name_plural': 'Discount group paths',
+                'indexes': [models.Index(fields=['ancestor', 'depth'], name='discount_group_closure_anc')],
+                'constraints': [models.UniqueConstraint(fields=('descendant', 'ancestor'), name='discount_group_closure_unique')],
+            },
+        ),
+        migrations.RunPython(create_closure_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:03
+
+import apps_base._base.model_fields
+import apps_base._base.models
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_price', '0010_productdiscountgroup_parent_productdiscountgroupclosure'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discountcoupon',
+            name='max_uses',
+            field=apps_base._base.model_fields.PositiveIntegerField(blank=True, help_text='Leave empty for unlimited use', null=True, verbose_name='Maximum uses'),
+        ),
+        migrations.AddField(
+            model_name='discountcoupon',
+            name='max_uses_per_customer',
+            field=apps_base._base.model_fields.PositiveIntegerField(blank=True, help_text='Leave empty for unlimited use', null=True, verbose_name='Maximum uses per customer'),
+        ),
+        migrations.CreateModel(
+            name='DiscountCouponRedemption',
+            fields=[
+                ('id', apps_base._base.model_fields.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_time', apps_base._base.model_fields.DateTimeField(auto_now_add=True, verbose_name='Created time')),
+                ('modified_time', apps_base._base.model_fields.DateTimeField(auto_now=True, verbose_name='Modified time')),
+                ('slot', apps_base._base.model_fields.IntegerField(blank=True, editable=False, null=True, verbose_name='Slot')),
+                ('email', apps_base._base.model_fields.CharField(blank=True, max_length=100, null=True, verbose_name='Email')),
+                ('reference', apps_base._base.model_fields.CharField(blank=True, max_length=100, null=True, verbose_name='Reference')),
+                ('redeemed_time', apps_base._base.model_fields.DateTimeField(blank=True, null=True, verbose_name='Redeemed time')),
+                ('created_by', apps_base._base.model_fields.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='%(app_label)s_%(class)s_created_by', to=settings.AUTH_USER_MODEL, verbose_name='Created by')),
+                ('modified_by', apps_base._base.model_fields.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='%(app_label)s_%(class)s_modified_by', to=settings.AUTH_USER_MODEL, verbose_name='Modified by')),
+                ('discount_coupon', apps_base._base.model_fields.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='redemptions', to='product_price.discountcoupon', verbose_name='Discount Coupon')),
+            ],
+            options={
+                'verbose_name': 'Discount coupon redemption',
+                'verbose_name_plural': 'Discount coupon redemptions',
+                'indexes': [
+                    models.Index(condition=models.Q(('redeemed_time__isnull', True)), fields=['discount_coupon', 'slot'], name='discount_coupon_open_slots'),
+                    models.Index(fields=['discount_coupon', 'email'], name='discount_coupon_redeemed_by'),
+                ],
+                'constraints': [models.UniqueConstraint(fields=('discount_coupon', 'slot'), name='discount_coupon_redemption_slot')],
+            },
+            bases=(apps_base._base.models.ModelMixin, models.Model),
+        ),
+    ]
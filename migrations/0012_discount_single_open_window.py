@@ -0,0 +1,34 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:41
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_price', '0011_discountcoupon_max_uses_and_more'),
+    ]
+
+    operations = [
+        # close duplicate open windows left behind by concurrent imports: each ends where the next one starts
+        migrations.RunSQL(
+            """
+            UPDATE product_price_discount d SET valid_to = n.next_from
+            FROM (
+                SELECT id, LEAD(valid_from) OVER (
+                    PARTITION BY product_discount_group_id, product_id, customer_discount_group_id, customer_id
+                    ORDER BY valid_from, created_time
+                ) AS next_from
+                FROM product_price_discount
+                WHERE valid_to >= '9999-01-01'
+            ) n
+            WHERE d.id = n.id AND n.next_from IS NOT NULL
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddConstraint(
+            model_name='discount',
+            constraint=models.UniqueConstraint(condition=models.Q(('valid_to__gte', datetime.datetime(9999, 1, 1, 0, 0, tzinfo=datetime.timezone.utc))), fields=('product_discount_group', 'product', 'customer_discount_group', 'customer'), name='discount_single_open_window', nulls_distinct=False),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.1.7 on 2026-10-19 11:26
+
+import apps_base._base.model_fields
+import apps_base._base.models
+import apps_shared.product_price.models
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_price', '0012_discount_single_open_window'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceListVersion',
+            fields=[
+                ('id', apps_base._base.model_fields.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_time', apps_base._base.model_fields.DateTimeField(auto_now_add=True, verbose_name='Created time')),
+                ('modified_time', apps_base._base.model_fields.DateTimeField(auto_now=True, verbose_name='Modified time')),
+                ('description', apps_base._base.model_fields.CharField(max_length=100, verbose_name='Description')),
+                ('status', apps_base._base.model_fields.CharField(choices=[('draft', 'Draft'), ('published', 'Published'), ('archived', 'Archived')], default='draft', editable=False, max_length=20, verbose_name='Status')),
+                ('published_time', apps_base._base.model_fields.DateTimeField(blank=True, editable=False, null=True, verbose_name='Published time')),
+                ('created_by', apps_base._base.model_fields.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='%(app_label)s_%(class)s_created_by', to=settings.AUTH_USER_MODEL, verbose_name='Created by')),
+                ('modified_by', apps_base._base.model_fields.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='%(app_label)s_%(class)s_modified_by', to=settings.AUTH_USER_MODEL, verbose_name='Modified by')),
+                ('price_group', apps_base._base.model_fields.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='versions', to='product_price.pricegroup', verbose_name='Price Group')),
+                ('product_price_group', apps_base._base.model_fields.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='versions', to='product_price.productpricegroup', verbose_name='Product Price Group')),
+            ],
+            options={
+                'verbose_name': 'Price list version',
+                'verbose_name_plural': 'Price list versions',
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status', 'published')), fields=('price_group', 'product_price_group'), name='price_list_single_published_version', nulls_distinct=False)],
+            },
+            bases=(apps_base._base.models.ModelMixin, models.Model),
+        ),
+        migrations.AlterField(
+            model_name='productprice',
+            name='price_group',
+            field=apps_base._base.model_fields.ForeignKey(blank=True, default=apps_shared.product_price.models.PriceGroup.get_default_pk, null=True, on_delete=django.db.models.deletion.CASCADE, to='product_price.pricegroup', verbose_name='Price Group'),
+        ),
+        migrations.AddField(
+            model_name='productprice',
+            name='version',
+            field=apps_base._base.model_fields.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='prices', to='product_price.pricelistversion', verbose_name='Price list version'),
+        ),
+    ]
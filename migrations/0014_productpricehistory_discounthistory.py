@@ -0,0 +1,123 @@
+# Generated by Django 5.1.7 on 2026-10-19 12:08
+
+import apps_base._base.model_fields
+import django.db.models.deletion
+from django.db import migrations
+
+
+# History tables are range partitioned by valid_to (one partition per year, created by the
+# archive_price_history command) so old years can be detached without touching current data.
+# The primary key has to include the partition key.
+PRODUCT_PRICE_HISTORY_SQL = """
+CREATE TABLE product_price_productprice_history (
+    id uuid NOT NULL,
+    price_group_id uuid NULL,
+    product_price_group_id uuid NULL,
+    product_id uuid NULL,
+    option_id uuid NULL,
+    price numeric(12, 4) NOT NULL,
+    pricing_type varchar(100) NOT NULL,
+    min_order_quantity integer NOT NULL,
+    max_order_quantity integer NOT NULL,
+    min_duration interval NOT NULL,
+    max_duration interval NOT NULL,
+    valid_from timestamp with time zone NOT NULL,
+    valid_to timestamp with time zone NOT NULL,
+    created_time timestamp with time zone NOT NULL,
+    modified_time timestamp with time zone NOT NULL,
+    archived_time timestamp with time zone NOT NULL DEFAULT now(),
+    PRIMARY KEY (id, valid_to)
+) PARTITION BY RANGE (valid_to);
+CREATE TABLE product_price_productprice_history_default PARTITION OF product_price_productprice_history DEFAULT;
+CREATE INDEX product_price_history_product ON product_price_productprice_history (product_id, valid_from);
+"""
+
+DISCOUNT_HISTORY_SQL = """
+CREATE TABLE product_price_discount_history (
+    id uuid NOT NULL,
+    product_discount_group_id uuid NULL,
+    product_id uuid NULL,
+    option_id uuid NULL,
+    customer_discount_group_id uuid NULL,
+    customer_id uuid NULL,
+    discount_perc numeric(10, 4) NOT NULL,
+    min_order_quantity integer NOT NULL,
+    max_order_quantity integer NOT NULL,
+    min_duration interval NOT NULL,
+    max_duration interval NOT NULL,
+    valid_from timestamp with time zone NOT NULL,
+    valid_to timestamp with time zone NOT NULL,
+    created_time timestamp with time zone NOT NULL,
+    modified_time timestamp with time zone NOT NULL,
+    archived_time timestamp with time zone NOT NULL DEFAULT now(),
+    PRIMARY KEY (id, valid_to)
+) PARTITION BY RANGE (valid_to);
+CREATE TABLE product_price_discount_history_default PARTITION OF product_price_discount_history DEFAULT;
+CREATE INDEX product_price_discount_history_product ON product_price_discount_history (product_id, valid_from);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_price', '0013_pricelistversion_productprice_version_and_more'),
+    ]
+
+    operations = [
+        migrations.RunSQL(PRODUCT_PRICE_HISTORY_SQL, 'DROP TABLE product_price_productprice_history'),
+        migrations.RunSQL(DISCOUNT_HISTORY_SQL, 'DROP TABLE product_price_discount_history'),
+        migrations.CreateModel(
+            name='ProductPriceHistory',
+            fields=[
+                ('id', apps_base._base.model_fields.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('price', apps_base._base.model_fields.DecimalField(decimal_places=4, max_digits=12, verbose_name='Price')),
+                ('pricing_type', apps_base._base.model_fields.CharField(choices=[('price', 'Price per unit'), ('price_per_hour', 'Price per hour'), ('price_per_day', 'Price per day'), ('percentage', 'Percentage of Value'), ('percentage_total', 'Percentage of total value'), ('percentage_parent', 'Percentage of parent value')], max_length=100, verbose_name='Pricing type')),
+                ('min_order_quantity', apps_base._base.model_fields.IntegerField(verbose_name='min quantity order discount')),
+                ('max_order_quantity', apps_base._base.model_fields.IntegerField(verbose_name='max quantity order discount')),
+                ('min_duration', apps_base._base.model_fields.DurationField(verbose_name='Min duration')),
+                ('max_duration', apps_base._base.model_fields.DurationField(verbose_name='Max duration')),
+                ('valid_from', apps_base._base.model_fields.DateTimeField(verbose_name='valid from')),
+                ('valid_to', apps_base._base.model_fields.DateTimeField(verbose_name='valid to')),
+                ('created_time', apps_base._base.model_fields.DateTimeField(verbose_name='Created time')),
+                ('modified_time', apps_base._base.model_fields.DateTimeField(verbose_name='Modified time')),
+                ('archived_time', apps_base._base.model_fields.DateTimeField(verbose_name='Archived time')),
+                ('option', apps_base._base.model_fields.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='product.productoption', verbose_name='Option')),
+                ('price_group', apps_base._base.model_fields.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='product_price.pricegroup', verbose_name='Price Group')),
+                ('product', apps_base._base.model_fields.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='product.product', verbose_name='Product')),
+                ('product_price_group', apps_base._base.model_fields.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='product_price.productpricegroup', verbose_name='Product Price Group')),
+            ],
+            options={
+                'verbose_name': 'Price history',
+                'verbose_name_plural': 'Price history',
+                'db_table': 'product_price_productprice_history',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='DiscountHistory',
+            fields=[
+                ('id', apps_base._base.model_fields.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('discount_perc', apps_base._base.model_fields.DecimalField(decimal_places=4, max_digits=10, verbose_name='Discount percentage')),
+                ('min_order_quantity', apps_base._base.model_fields.IntegerField(verbose_name='Min quantity order discount')),
+                ('max_order_quantity', apps_base._base.model_fields.IntegerField(verbose_name='Max quantity order discount')),
+                ('min_duration', apps_base._base.model_fields.DurationField(verbose_name='Min duration')),
+                ('max_duration', apps_base._base.model_fields.DurationField(verbose_name='Max duration')),
+                ('valid_from', apps_base._base.model_fields.DateTimeField(verbose_name='valid from')),
+                ('valid_to', apps_base._base.model_fields.DateTimeField(verbose_name='valid to')),
+                ('created_time', apps_base._base.model_fields.DateTimeField(verbose_name='Created time')),
+                ('modified_time', apps_base._base.model_fields.DateTimeField(verbose_name='Modified time')),
+                ('archived_time', apps_base._base.model_fields.DateTimeField(verbose_name='Archived time')),
+                ('customer', apps_base._base.model_fields.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='customer.customer', verbose_name='Customer')),
+                ('customer_discount_group', apps_base._base.model_fields.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='product_price.customerdiscountgroup', verbose_name='Customer discount group')),
+                ('option', apps_base._base.model_fields.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='product.productoption', verbose_name='Option')),
+                ('product', apps_base._base.model_fields.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='product.product', verbose_name='Product')),
+                ('product_discount_group', apps_base._base.model_fields.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='product_price.productdiscountgroup', verbose_name='Product discount group')),
+            ],
+            options={
+                'verbose_name': 'Discount history',
+                'verbose_name_plural': 'Discount history',
+                'db_table': 'product_price_discount_history',
+                'managed': False,
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2026-10-19 13:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_price', '0014_productpricehistory_discounthistory'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productprice',
+            index=models.Index(fields=['valid_from'], name='product_price_valid_from'),
+        ),
+        migrations.AddIndex(
+            model_name='productprice',
+            index=models.Index(fields=['valid_to'], name='product_price_valid_to'),
+        ),
+        migrations.AddIndex(
+            model_name='discount',
+            index=models.Index(fields=['valid_from'], name='discount_valid_from'),
+        ),
+        migrations.AddIndex(
+            model_name='discount',
+            index=models.Index(fields=['valid_to'], name='discount_valid_to'),
+        ),
+        migrations.AddIndex(
+            model_name='discountcoupon',
+            index=models.Index(fields=['valid_from'], name='discount_coupon_valid_from'),
+        ),
+        migrations.AddIndex(
+            model_name='discountcoupon',
+            index=models.Index(fields=['valid_to'], name='discount_coupon_valid_to'),
+        ),
+    ]
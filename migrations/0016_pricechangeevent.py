@@ -0,0 +1,34 @@
+# Generated by Django 5.1.7 on 2026-10-19 13:42
+
+import apps_base._base.model_fields
+import django.db.models.deletion
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_price', '0015_validity_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceChangeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_id', apps_base._base.model_fields.BigIntegerField(db_default=models.Func(function='txid_current', output_field=models.BigIntegerField()), editable=False, verbose_name='Transaction')),
+                ('model', apps_base._base.model_fields.CharField(max_length=30, verbose_name='Model')),
+                ('object_id', apps_base._base.model_fields.UUIDField(verbose_name='Object')),
+                ('operation', apps_base._base.model_fields.CharField(choices=[('upsert', 'Upsert'), ('delete', 'Delete')], default='upsert', max_length=10, verbose_name='Operation')),
+                ('created_time', apps_base._base.model_fields.DateTimeField(db_default=django.db.models.functions.datetime.Now(), editable=False, verbose_name='Created time')),
+                ('dispatched_time', apps_base._base.model_fields.DateTimeField(blank=True, editable=False, null=True, verbose_name='Dispatched time')),
+                ('product', apps_base._base.model_fields.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='product.product', verbose_name='Product')),
+            ],
+            options={
+                'verbose_name': 'Price change event',
+                'verbose_name_plural': 'Price change events',
+                'indexes': [models.Index(condition=models.Q(('dispatched_time__isnull', True)), fields=['id'], name='price_change_event_pending'), models.Index(fields=['model', 'transaction_id', 'id'], name='price_change_event_sequence')],
+            },
+        ),
+    ]
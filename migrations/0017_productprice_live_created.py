@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-19 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_price', '0016_pricechangeevent'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productprice',
+            index=models.Index(condition=models.Q(('price_group__isnull', False)), fields=['created_time', 'id'], name='product_price_live_created'),
+        ),
+    ]
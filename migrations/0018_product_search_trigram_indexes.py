@@ -0,0 +1,52 @@
+# Generated by Django 5.1.7 on 2026-10-19 14:31
+
+import apps_base._base.model_fields
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+# Fill the search texts (models.ProductSearchText) from the product app's tables; afterwards the
+# Product signals keep them up to date. Reading those tables leaves their schema alone.
+def populate_search_texts(apps, schema_editor):
+    Product = apps.get_model('product', 'Product')
+    Translation = Product._meta.get_field('translations').related_model
+    SearchText = apps.get_model('product_price', 'ProductSearchText')
+    quote = schema_editor.quote_name
+    schema_editor.execute(
+        f'INSERT INTO {quote(SearchText._meta.db_table)} (product_id, language_code, text) '
+        f'SELECT {quote(Product._meta.pk.column)}, %s, product_number FROM {quote(Product._meta.db_table)} '
+        f'WHERE product_number > %s '
+        f'UNION ALL '
+        f'SELECT master_id, language_code, name FROM {quote(Translation._meta.db_table)} WHERE name > %s',
+        ['', '', ''],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0001_initial'),
+        ('product_price', '0017_productprice_live_created'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.CreateModel(
+            name='ProductSearchText',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('language_code', apps_base._base.model_fields.CharField(blank=True, max_length=15, verbose_name='Language')),
+                ('text', apps_base._base.model_fields.TextField(verbose_name='Text')),
+                ('product', apps_base._base.model_fields.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='product.product', verbose_name='Product')),
+            ],
+            options={
+                'verbose_name': 'Product search text',
+                'verbose_name_plural': 'Product search texts',
+                'indexes': [django.contrib.postgres.indexes.GinIndex(fields=['text'], name='product_search_text_trgm', opclasses=['gin_trgm_ops'])],
+                'constraints': [models.UniqueConstraint(fields=('product', 'language_code'), name='product_search_text_unique')],
+            },
+        ),
+        migrations.RunPython(populate_search_texts, migrations.RunPython.noop),
+    ]
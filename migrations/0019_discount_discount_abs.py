@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2026-10-19 16:02
+
+import apps_base._base.model_fields
+from decimal import Decimal
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_price', '0018_product_search_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discount',
+            name='discount_abs',
+            field=apps_base._base.model_fields.DecimalField(decimal_places=4, default=Decimal('0'), max_digits=10, verbose_name='Absolute discount'),
+        ),
+        # the history table is not managed by Django: add the column to it and its partitions by hand
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    'ALTER TABLE product_price_discount_history ADD COLUMN discount_abs numeric(10, 4) NOT NULL DEFAULT 0',
+                    'ALTER TABLE product_price_discount_history DROP COLUMN discount_abs',
+                ),
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name='discounthistory',
+                    name='discount_abs',
+                    field=apps_base._base.model_fields.DecimalField(decimal_places=4, default=Decimal('0'), max_digits=10, verbose_name='Absolute discount'),
+                    preserve_default=False,
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.7 on 2026-10-19 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_price', '0019_discount_discount_abs'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='productdiscountgroupclosure',
+            name='discount_group_closure_unique',
+        ),
+        migrations.AddConstraint(
+            model_name='productdiscountgroupclosure',
+            constraint=models.UniqueConstraint(fields=('descendant', 'ancestor'), include=('depth',), name='discount_group_closure_unique'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-19 16:34
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_price', '0020_discount_group_closure_covering'),
+    ]
+
+    operations = [
+        # DiscountCoupon.redeem stores emails lower case and used_by() compares them exactly
+        migrations.RunSQL(
+            'UPDATE product_price_discountcouponredemption SET email = lower(email) WHERE email <> lower(email)',
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.1.7 on 2026-10-19 17:12
+
+import apps_base._base.model_fields
+from django.conf import settings
+from django.db import migrations
+
+COUPON_SLOTS = getattr(settings, 'PRODUCT_PRICE_COUPON_SLOTS', 16)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_price', '0021_lowercase_redemption_emails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discountcouponredemption',
+            name='remaining',
+            field=apps_base._base.model_fields.PositiveIntegerField(default=0, editable=False, verbose_name='Remaining uses'),
+        ),
+        # redemptions keep no slot; the open slots (one per remaining use) fold into at most
+        # COUPON_SLOTS slots per coupon carrying a remaining count
+        migrations.RunSQL(
+            [
+                'UPDATE product_price_discountcouponredemption SET slot = NULL WHERE redeemed_time IS NOT NULL',
+                ('''
+                WITH numbered AS (
+                    SELECT id, discount_coupon_id, row_number() OVER (PARTITION BY discount_coupon_id ORDER BY slot) - 1 AS n
+                    FROM product_price_discountcouponredemption
+                    WHERE slot IS NOT NULL
+                ), pooled AS (
+                    SELECT discount_coupon_id, mod(n, %s) AS slot, count(*) AS remaining
+                    FROM numbered
+                    GROUP BY 1, 2
+                )
+                UPDATE product_price_discountcouponredemption AS redemption
+                SET slot = -1 - numbered.n, remaining = pooled.remaining
+                FROM numbered
+                JOIN pooled ON pooled.discount_coupon_id = numbered.discount_coupon_id AND pooled.slot = numbered.n
+                WHERE redemption.id = numbered.id
+                ''', [COUPON_SLOTS]),
+                'DELETE FROM product_price_discountcouponredemption WHERE slot >= 0',
+                # negative while renumbering, so the (discount_coupon, slot) constraint holds per row
+                'UPDATE product_price_discountcouponredemption SET slot = -1 - slot WHERE slot < 0',
+            ],
+            [
+                # back to one open slot per remaining use
+                ('''
+                INSERT INTO product_price_discountcouponredemption (id, created_time, modified_time, discount_coupon_id, slot, remaining)
+                SELECT gen_random_uuid(), now(), now(), discount_coupon_id,
+                    %s + row_number() OVER (PARTITION BY discount_coupon_id ORDER BY slot, copy), 0
+                FROM product_price_discountcouponredemption, generate_series(2, remaining) AS copy
+                WHERE slot IS NOT NULL
+                ''', [COUPON_SLOTS]),
+                'DELETE FROM product_price_discountcouponredemption WHERE slot IS NOT NULL AND slot < %s AND remaining = 0' % COUPON_SLOTS,
+            ],
+        ),
+    ]
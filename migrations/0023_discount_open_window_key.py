@@ -0,0 +1,65 @@
+# Generated by Django 5.1.7 on 2026-10-19 17:40
+
+import datetime
+from django.db import migrations, models
+
+
+# 0012 keyed open windows on the scope only, so it also closed the open windows of other options
+# and quantity/duration tiers of the same scope. The key is scope, option and bands.
+SCOPE_COLUMNS = ['product_discount_group_id', 'product_id', 'customer_discount_group_id', 'customer_id']
+KEY_COLUMNS = SCOPE_COLUMNS + ['option_id', 'min_order_quantity', 'max_order_quantity', 'min_duration', 'max_duration']
+
+
+def same(columns, left, right):
+    return ' AND '.join(f'{left}.{column} IS NOT DISTINCT FROM {right}.{column}' for column in columns)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_price', '0022_discountcouponredemption_remaining'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='discount',
+            name='discount_single_open_window',
+        ),
+        # reopen the windows 0012 closed at the start of another key of their scope, when they are still
+        # the latest window of their own key; reversed by closing per scope again, as 0012 did
+        migrations.RunSQL(
+            f"""
+            UPDATE product_price_discount d SET valid_to = '9999-12-31'
+            WHERE d.valid_to < '9999-01-01'
+            AND EXISTS (
+                SELECT 1 FROM product_price_discount n
+                WHERE {same(SCOPE_COLUMNS, 'n', 'd')} AND n.valid_from = d.valid_to AND NOT ({same(KEY_COLUMNS, 'n', 'd')})
+            )
+            AND NOT EXISTS (
+                SELECT 1 FROM product_price_discount l
+                WHERE {same(KEY_COLUMNS, 'l', 'd')} AND l.id <> d.id AND (l.valid_from >= d.valid_from OR l.valid_to >= '9999-01-01')
+            )
+            """,
+            f"""
+            UPDATE product_price_discount d SET valid_to = n.next_from
+            FROM (
+                SELECT id, LEAD(valid_from) OVER (
+                    PARTITION BY {', '.join(SCOPE_COLUMNS)}
+                    ORDER BY valid_from, created_time
+                ) AS next_from
+                FROM product_price_discount
+                WHERE valid_to >= '9999-01-01'
+            ) n
+            WHERE d.id = n.id AND n.next_from IS NOT NULL
+            """,
+        ),
+        migrations.AddConstraint(
+            model_name='discount',
+            constraint=models.UniqueConstraint(condition=models.Q(('valid_to__gte', datetime.datetime(9999, 1, 1, 0, 0, tzinfo=datetime.timezone.utc))), fields=('product_discount_group', 'product', 'option', 'customer_discount_group', 'customer', 'min_order_quantity', 'max_order_quantity', 'min_duration', 'max_duration'), name='discount_single_open_window', nulls_distinct=False),
+        ),
+        # left behind by an earlier revision of 0012
+        migrations.RunSQL(
+            'DROP TABLE IF EXISTS product_price_discount_open_window_0012',
+            migrations.RunSQL.noop,
+        ),
+    ]
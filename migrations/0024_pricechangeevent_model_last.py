@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-19 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_price', '0023_discount_open_window_key'),
+    ]
+
+    operations = [
+        # last event per model for the scoped ETags (sync.change_marker)
+        migrations.AddIndex(
+            model_name='pricechangeevent',
+            index=models.Index(fields=['model', 'id'], name='price_change_event_model_last'),
+        ),
+    ]
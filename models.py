@@ -10,24 +10,86 @@ from apps_base._base.models import BaseModel, BaseTranslationModel, SequenceMixi
 from apps_base.entity.models import Store
 from apps_base._base import model_fields
 
-from .manager import DiscountGroupManager, DiscountManager, DiscountCouponManager
+from .cache import default_lookups, coupon_products, discount_labels, price_cache
+from .manager import DiscountGroupManager, DiscountManager, DiscountCouponManager, ProductPriceManager
 from apps_base._base.models import DefaultMixin
 from apps_shared.product.choices import PRICING_TYPE
 
 from apps_shared.product.utils import get_create_product
 from apps_shared.product_price.models import PRICING_TYPE
+from django.contrib.postgres.indexes import GinIndex
 from django.db.models import Func, Value
+from django.db.models.lookups import PatternLookup
+from django.db.models.functions import Now
+from django.db import connection, models, transaction
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.conf import settings
 import logging
 logger = logging.getLogger(__name__)
 
 def return_date_time_latest():
     return datetime.datetime(9999, 12, 31)
 
+# valid_to values from this instant on mean "no end date"
+OPEN_ENDED = datetime.datetime(9999, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+# Product field holding the product's ProductDiscountGroup
+PRODUCT_DISCOUNT_GROUP_FIELD = getattr(settings, 'PRODUCT_PRICE_PRODUCT_DISCOUNT_GROUP_FIELD', 'product_discount_group')
+# Product field holding the product's ProductPriceGroup
+PRODUCT_PRICE_GROUP_FIELD = getattr(settings, 'PRODUCT_PRICE_PRODUCT_PRICE_GROUP_FIELD', 'product_price_group')
+# Customer fields holding the customer's PriceGroup and CustomerDiscountGroup, as add_prices reads them
+CUSTOMER_PRICE_GROUP_FIELD = getattr(settings, 'PRODUCT_PRICE_CUSTOMER_PRICE_GROUP_FIELD', 'price_group')
+CUSTOMER_DISCOUNT_GROUP_FIELD = getattr(settings, 'PRODUCT_PRICE_CUSTOMER_DISCOUNT_GROUP_FIELD', 'customer_discount_group')
+# Slot rows per coupon with max_uses; concurrent redemptions of one coupon lock different slots
+COUPON_SLOTS = getattr(settings, 'PRODUCT_PRICE_COUPON_SLOTS', 16)
+
 
 def get_default_store():
-    return Store.get_default()
+    return default_lookups.get(Store)
+
+
+class CHANGE_OPERATION(models.TextChoices):
+    UPSERT = 'upsert', _('Upsert')
+    DELETE = 'delete', _('Delete')
+
+
+class PriceChangeOutboxMixin(models.Model):
+    """
+    Records a PriceChangeEvent in the transaction that saves the row.
+    Deletes, cascades included, are recorded by the post_delete receiver in signals.py.
+    """
+
+    class Meta:
+        abstract = True
+
+    def change_operation(self):
+        return CHANGE_OPERATION.UPSERT
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().save(*args, **kwargs)
+            PriceChangeEvent.record([self])
+        return result
+
+class LoadedScopeMixin:
+    """
+    Remembers the product (and discount group) a row was loaded with, so a save that moves it
+    invalidates the cached prices of the old scope as well (signals.price_change_scopes).
+    """
+    SCOPE_FIELDS = ['product_id']
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_scope()
+        return instance
 
-class PriceGroup(DefaultMixin, BaseModel):
+    def remember_scope(self):
+        # deferred fields are unknown, not empty
+        self._loaded_scope = {field: self.__dict__[field] for field in self.SCOPE_FIELDS if field in self.__dict__}
+
+class PriceGroup(PriceChangeOutboxMixin, DefaultMixin, BaseModel):
     DEFAULTS = {'store': get_default_store, 'description': 'Default'}
     store = model_fields.ForeignKey("entity.Store", verbose_name=_("Store"),  on_delete=model_fields.CASCADE, default=get_default_store)
     description = model_fields.CharField(_("Price group"), unique=True, max_length=50)
@@ -39,6 +101,10 @@ class PriceGroup(DefaultMixin, BaseModel):
     def __str__(self):
         return self.description
 
+    @classmethod
+    def get_default_pk(cls):
+        return default_lookups.get_pk(cls)
+
     class BritgePortal:
         viewset = 'apps_shared.product_price.viewsets.PriceGroupViewSet'
         portal_urls = [
@@ -55,7 +121,7 @@ class PriceGroup(DefaultMixin, BaseModel):
                 }
             }
         ]
-class ProductPriceGroup(BaseModel):
+class ProductPriceGroup(PriceChangeOutboxMixin, BaseModel):
     description = model_fields.CharField(_("Product price group"), unique=True, max_length=50)
 
     class Meta:
@@ -65,6 +131,19 @@ class ProductPriceGroup(BaseModel):
     def __str__(self):
         return self.description
 
+    @classmethod
+    def of_products(cls, product_ids):
+        """
+        {product pk: product price group pk} of the given products that are in a product price group.
+        """
+        try:
+            field = Product._meta.get_field(PRODUCT_PRICE_GROUP_FIELD)
+        except FieldDoesNotExist:
+            return {}
+        return dict(
+            Product.objects.filter(pk__in=product_ids, **{f'{field.name}__isnull': False}).values_list('pk', field.attname)
+        )
+
     class BritgePortal:
         viewset = 'apps_shared.product_price.viewsets.ProductPriceGroupViewSet'
         portal_urls = [
@@ -81,12 +160,14 @@ class ProductPriceGroup(BaseModel):
                 }
             }
         ]
-class ProductPrice(SequenceMixin, BaseModel):
+class ProductPrice(LoadedScopeMixin, PriceChangeOutboxMixin, SequenceMixin, BaseModel):
     SEQUENCE_FIELDS = []
     importable_model = True
 
-    price_group = model_fields.ForeignKey("product_price.PriceGroup", verbose_name=_("Price Group"), style={'wrapper_class': 'col-6'}, default=PriceGroup.get_default_pk, on_delete=model_fields.CASCADE)
+    # empty while the price is staged in or archived with a PriceListVersion
+    price_group = model_fields.ForeignKey("product_price.PriceGroup", verbose_name=_("Price Group"), null=True, blank=True, style={'wrapper_class': 'col-6'}, default=PriceGroup.get_default_pk, on_delete=model_fields.CASCADE)
     product_price_group = model_fields.ForeignKey("product_price.ProductPriceGroup", verbose_name=_("Product Price Group"), null=True, blank=True, style={'wrapper_class': 'col-6'}, on_delete=model_fields.CASCADE)
+    version = model_fields.ForeignKey("product_price.PriceListVersion", verbose_name=_("Price list version"), related_name='prices', null=True, blank=True, editable=False, on_delete=model_fields.CASCADE)
     product = model_fields.ForeignKey("product.Product", verbose_name=_("Product"), null=True, blank=True, style={'wrapper_class': 'col-6'}, on_delete=model_fields.CASCADE)
     option = model_fields.ForeignKey("product.ProductOption", verbose_name=_("Option"), related_name='price_option', null=True, blank=True, style={'wrapper_class': 'col-6'}, on_delete=model_fields.CASCADE)
 
@@ -110,9 +191,145 @@ class ProductPrice(SequenceMixin, BaseModel):
     valid_from = model_fields.DateTimeField(verbose_name=_("valid from"),default= timezone.now, style={'wrapper_class': 'col-6'})  
     valid_to = model_fields.DateTimeField(verbose_name=_("valid to"),default= return_date_time_latest, style={'wrapper_class': 'col-6'})  
 
+    objects = ProductPriceManager()
+
+    def change_operation(self):
+        # staged and archived version prices are not live: consumers should drop them
+        return CHANGE_OPERATION.UPSERT if self.price_group_id else CHANGE_OPERATION.DELETE
+
     class Meta:
         verbose_name = _('Price group price')
         verbose_name_plural = _('Price group prices')
+        indexes = [
+            model_fields.Index(fields=['valid_from'], name='product_price_valid_from'),
+            model_fields.Index(fields=['valid_to'], name='product_price_valid_to'),
+            model_fields.Index(fields=['created_time', 'id'], condition=model_fields.Q(price_group__isnull=False), name='product_price_live_created'),
+        ]
+
+class VERSION_STATUS(models.TextChoices):
+    DRAFT = 'draft', _('Draft')
+    PUBLISHED = 'published', _('Published')
+    ARCHIVED = 'archived', _('Archived')
+
+class PriceListVersion(BaseModel):
+    """
+    A complete set of prices for one price group within one product price group (or outside any).
+
+    Prices are staged with an empty price group, validated, and published in one short transaction
+    that detaches the live prices they replace into the previous version and attaches the staged ones.
+    A version replaces the live prices of the products it contains; publish(replace_all=True) treats
+    it as the complete price list of the scope and replaces every live price. Rollback publishes the
+    previous version over the products of both.
+    """
+    price_group = model_fields.ForeignKey("product_price.PriceGroup", verbose_name=_("Price Group"), related_name='versions', on_delete=model_fields.CASCADE)
+    product_price_group = model_fields.ForeignKey("product_price.ProductPriceGroup", verbose_name=_("Product Price Group"), related_name='versions', null=True, blank=True, on_delete=model_fields.CASCADE)
+    description = model_fields.CharField(verbose_name=_("Description"), max_length=100)
+    status = model_fields.CharField(verbose_name=_("Status"), max_length=20, choices=VERSION_STATUS.choices, default=VERSION_STATUS.DRAFT, editable=False)
+    published_time = model_fields.DateTimeField(verbose_name=_("Published time"), null=True, blank=True, editable=False)
+
+    class Meta:
+        verbose_name = _('Price list version')
+        verbose_name_plural = _('Price list versions')
+        constraints = [
+            model_fields.UniqueConstraint(
+                fields=['price_group', 'product_price_group'],
+                condition=model_fields.Q(status='published'),
+                nulls_distinct=False,
+                name='price_list_single_published_version',
+            ),
+        ]
+
+    def __str__(self):
+        return self.description
+
+    @property
+    def scope(self):
+        return {'price_group_id': self.price_group_id, 'product_price_group_id': self.product_price_group_id}
+
+    def stage(self, prices, batch_size=2000):
+        """
+        Add unsaved ProductPrice instances to this draft version without making them live.
+        """
+        if self.status != VERSION_STATUS.DRAFT:
+            raise ValidationError(_('Only draft price list versions can be changed'))
+        staged = []
+        for price in prices:
+            price.price_group_id = None
+            price.product_price_group_id = None
+            price.version = self
+            staged.append(price)
+        return ProductPrice.objects.bulk_create(staged, batch_size=batch_size)
+
+    def validate(self, max_errors=100):
+        """
+        Return messages for invalid or overlapping prices in this version.
+        """
+        errors = []
+        bands = {}
+        prices = self.prices.order_by('product', 'option', 'min_order_quantity').values_list(
+            'pk', 'product_id', 'option_id', 'price', 'pricing_type', 'min_order_quantity', 'max_order_quantity',
+            'min_duration', 'max_duration', 'valid_from', 'valid_to',
+        )
+        for pk, product_id, option_id, price, pricing_type, min_quantity, max_quantity, min_duration, max_duration, valid_from, valid_to in prices.iterator(chunk_size=5000):
+            if product_id is None:
+                errors.append(_('Price {pk} has no product').format(pk=pk))
+            if price < 0:
+                errors.append(_('Price {pk} is negative').format(pk=pk))
+            if min_quantity > max_quantity or min_duration > max_duration or valid_from >= valid_to:
+                errors.append(_('Price {pk} has a minimum above its maximum').format(pk=pk))
+            key = (product_id, option_id, pricing_type, min_duration, max_duration, valid_from, valid_to)
+            if key in bands and bands[key] >= min_quantity:
+                errors.append(_('Price {pk} overlaps another quantity band of the same product').format(pk=pk))
+            bands[key] = max(bands.get(key, -1), max_quantity)
+            if len(errors) >= max_errors:
+                break
+        return errors
+
+    def publish(self, replace_all=False, products=None):
+        """
+        Make the prices of this version live. Replaces the live prices of products (default: the
+        products in this version), or every live price of the scope with replace_all.
+        """
+        errors = self.validate()
+        if errors:
+            raise ValidationError(errors)
+        with transaction.atomic():
+            # lock the scope so concurrent publications of it queue up
+            list(PriceListVersion.objects.select_for_update().filter(**self.scope))
+            current = PriceListVersion.objects.filter(**self.scope, status=VERSION_STATUS.PUBLISHED).exclude(pk=self.pk).first()
+            # our own prices may still be live after a partial publication replaced others
+            live = ProductPrice.objects.filter(**self.scope).exclude(version=self)
+            if not replace_all:
+                live = live.filter(product_id__in=products if products is not None else self.prices.values('product_id'))
+            if current is None and live.exists():
+                current = PriceListVersion.objects.create(
+                    price_group_id=self.price_group_id,
+                    product_price_group_id=self.product_price_group_id,
+                    description=_('Before {description}').format(description=self.description),
+                    status=VERSION_STATUS.ARCHIVED,
+                )
+            if current is not None:
+                PriceChangeEvent.record_queryset(live, CHANGE_OPERATION.DELETE)
+                live.update(price_group=None, product_price_group=None, version=current)
+                current.status = VERSION_STATUS.ARCHIVED
+                current.save(update_fields=['status', 'modified_time'])
+            self.prices.update(**self.scope)
+            PriceChangeEvent.record_queryset(self.prices.all())
+            self.status = VERSION_STATUS.PUBLISHED
+            self.published_time = timezone.now()
+            self.save(update_fields=['status', 'published_time', 'modified_time'])
+            transaction.on_commit(price_cache.changed)
+
+    def rollback(self):
+        """
+        Publish the version this published version replaced.
+        """
+        previous = PriceListVersion.objects.filter(**self.scope, status=VERSION_STATUS.ARCHIVED).order_by('-modified_time').first()
+        if self.status != VERSION_STATUS.PUBLISHED or previous is None:
+            raise ValidationError(_('There is no previous price list version to roll back to'))
+        # also drop the prices of products this version added
+        previous.publish(products=ProductPrice.objects.filter(version__in=[self, previous]).values('product_id'))
+        return previous
 
 class CustomerDiscountGroup(BaseModel):
     importable_model = True
@@ -137,12 +354,16 @@ class ProductDiscountGroup(BaseTranslationModel):
     )
 
     include_children = model_fields.BooleanField(default=False)
+    parent = model_fields.ForeignKey('self', verbose_name=_("Parent group"), related_name='children', on_delete=model_fields.SET_NULL, null=True, blank=True)
 
     objects = DiscountGroupManager()
 
     def __str__(self):
         return "{description}".format(description = self.group_number)
 
+    def get_discount_label(self, language=None):
+        return discount_labels.get(self, language)
+
     class Meta:
         # default_related_name = 'discountgroups'
         verbose_name = _('Discount group')
@@ -153,23 +374,50 @@ class ProductDiscountGroup(BaseTranslationModel):
             self.discount_label = self.group_number
         if not self.description:
             self.name = self.description
-        return super().save()
+        adding = self._state.adding
+        with transaction.atomic():
+            old_parent_id = None if adding else ProductDiscountGroup.objects.filter(pk=self.pk).values_list('parent_id', flat=True).first()
+            result = super().save()
+            if adding or old_parent_id != self.parent_id:
+                ProductDiscountGroupClosure.move_subtree(self)
+        return result
+
+    def delete(self, *args, **kwargs):
+        # re-attach children to our parent so their closure paths stay complete
+        with transaction.atomic():
+            for child in self.children.all():
+                child.parent_id = self.parent_id
+                child.save()
+            return super().delete(*args, **kwargs)
+
+    @classmethod
+    def of_products(cls, product_ids):
+        """
+        {product pk: discount group pk} of the given products that are in a discount group.
+        """
+        try:
+            field = Product._meta.get_field(PRODUCT_DISCOUNT_GROUP_FIELD)
+        except FieldDoesNotExist:
+            return {}
+        return dict(
+            Product.objects.filter(pk__in=product_ids, **{f'{field.name}__isnull': False}).values_list('pk', field.attname)
+        )
+
     @property
     def max_discount(self):
-        abs_max = 0
-        perc_max = 0
-        for x in self.discountgroupsdiscounts.all():
-            abs_max = max(abs_max, x.discount_abs)
-            perc_max = max(perc_max, x.discount_perc)
-        return (abs_max, perc_max)
+        # discounts of this group and of ancestors that include their children
+        discounts = Discount.objects.filter_product_discount_group(self).aggregate(
+            abs_max=models.Max('discount_abs'),
+            perc_max=models.Max('discount_perc'),
+        )
+        return (discounts['abs_max'] or 0, discounts['perc_max'] or 0)
 
     def discount_obj(self, q):
-        abs_max = 0
-        perc_max = 0
-        for x in self.discountgroupsdiscounts.all():
-            if x.min_order_quantity <= q and x.max_order_quantity >= q:
-                return (x.discount_abs, x.discount_perc)
-        return (abs_max, perc_max)        
+        discount = Discount.objects.filter_product_discount_group(self).filter(
+            min_order_quantity__lte=q,
+            max_order_quantity__gte=q,
+        ).values_list('discount_abs', 'discount_perc').first()
+        return discount or (0, 0)
 
 
     class BritgePortal:
@@ -188,10 +436,82 @@ class ProductDiscountGroup(BaseTranslationModel):
                 }
             }
         ]
+
+class ProductDiscountGroupClosure(models.Model):
+    """
+    Closure table of the ProductDiscountGroup hierarchy: one row per (ancestor, descendant) pair,
+    including the depth 0 row of every group to itself. Maintained by ProductDiscountGroup.save.
+    """
+    ancestor = model_fields.ForeignKey('product_price.ProductDiscountGroup', verbose_name=_("Ancestor"), related_name='descendant_paths', on_delete=model_fields.CASCADE)
+    descendant = model_fields.ForeignKey('product_price.ProductDiscountGroup', verbose_name=_("Descendant"), related_name='ancestor_paths', on_delete=model_fields.CASCADE)
+    depth = model_fields.PositiveIntegerField(verbose_name=_("Depth"), default=0)
+
+    class Meta:
+        verbose_name = _('Discount group path')
+        verbose_name_plural = _('Discount group paths')
+        constraints = [
+            # leads on descendant and carries depth: applicable_to() is an index-only scan
+            model_fields.UniqueConstraint(fields=['descendant', 'ancestor'], include=['depth'], name='discount_group_closure_unique'),
+        ]
+        indexes = [
+            model_fields.Index(fields=['ancestor', 'depth'], name='discount_group_closure_anc'),
+        ]
+
+    @classmethod
+    def move_subtree(cls, group):
+        """
+        (Re)link the subtree rooted at group below group.parent. Call inside a transaction.
+        """
+        cls.objects.get_or_create(ancestor=group, descendant=group, defaults={'depth': 0})
+        subtree = list(cls.objects.filter(ancestor=group).values_list('descendant_id', 'depth'))
+        subtree_ids = [descendant_id for descendant_id, depth in subtree]
+        if group.parent_id in subtree_ids:
+            raise ValidationError(_('A discount group cannot be placed below itself'))
+        cls.objects.filter(descendant_id__in=subtree_ids).exclude(ancestor_id__in=subtree_ids).delete()
+        if group.parent_id:
+            ancestors = cls.objects.filter(descendant_id=group.parent_id).values_list('ancestor_id', 'depth')
+            cls.objects.bulk_create([
+                cls(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=ancestor_depth + descendant_depth + 1)
+                for ancestor_id, ancestor_depth in ancestors
+                for descendant_id, descendant_depth in subtree
+            ])
+
+    @classmethod
+    def applicable_groups(cls, groups):
+        """
+        {group pk: set of discount group pks whose discounts apply to it} for many groups at once,
+        by the rules of ProductDiscountGroup.objects.applicable_to.
+        """
+        applicable = {}
+        paths = cls.objects.filter(
+            models.Q(depth=0) | models.Q(ancestor__include_children=True),
+            descendant__in=groups,
+        ).values_list('descendant_id', 'ancestor_id')
+        for descendant_id, ancestor_id in paths:
+            applicable.setdefault(descendant_id, set()).add(ancestor_id)
+        return applicable
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Rebuild the full table from the parent pointers.
+        """
+        parents = dict(ProductDiscountGroup.objects.values_list('pk', 'parent_id'))
+        rows = []
+        for pk in parents:
+            ancestor_id, depth = pk, 0
+            while ancestor_id and depth <= len(parents):
+                rows.append(cls(ancestor_id=ancestor_id, descendant_id=pk, depth=depth))
+                ancestor_id, depth = parents.get(ancestor_id), depth + 1
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(rows, batch_size=5000)
+
 from django.db.models import CheckConstraint
 
-class Discount(BaseModel):
+class Discount(LoadedScopeMixin, PriceChangeOutboxMixin, BaseModel):
     importable_model = True
+    SCOPE_FIELDS = ['product_id', 'product_discount_group_id']
 
     product_discount_group = model_fields.ForeignKey('product_price.ProductDiscountGroup', verbose_name=_("Product discount group"),on_delete=model_fields.CASCADE, null=True)  
     product = model_fields.ForeignKey(Product, verbose_name=_("Product"),on_delete=model_fields.CASCADE, blank=True, null=True)  
@@ -200,6 +520,7 @@ class Discount(BaseModel):
     customer_discount_group = model_fields.ForeignKey('product_price.CustomerDiscountGroup', verbose_name=_("Customer discount group"),on_delete=model_fields.CASCADE, blank=True, null=True)  
     customer = model_fields.ForeignKey('customer.Customer', verbose_name=_("Customer"),on_delete=model_fields.CASCADE, blank=True, null=True)  
 
+    discount_abs = model_fields.DecimalField(verbose_name=_("Absolute discount"), max_digits=10, decimal_places=4, default = decimal.Decimal(0))
     discount_perc = model_fields.DecimalField(verbose_name=_("Discount percentage"),max_digits=10, decimal_places=4, default = decimal.Decimal(0))
 
     min_order_quantity = model_fields.IntegerField(verbose_name=_('Min quantity order discount'), default=0)
@@ -213,54 +534,209 @@ class Discount(BaseModel):
 
     objects = DiscountManager()
 
+    # one discount per scope, option and quantity/duration tier; tiers of the same product coexist
+    KEY_FIELDS = [
+        'product_discount_group', 'product', 'option', 'customer_discount_group', 'customer',
+        'min_order_quantity', 'max_order_quantity', 'min_duration', 'max_duration',
+    ]
+
     class Meta:
         # default_related_name = 'discounts'
         verbose_name = _('Discount group discount')
         verbose_name_plural = _('Discount group discounts')
         constraints = [
             CheckConstraint(check=model_fields.Q(product__isnull=False) | model_fields.Q(product_discount_group__isnull=False), name="new_product_or_group"),
+            model_fields.UniqueConstraint(
+                fields=[
+                    'product_discount_group', 'product', 'option', 'customer_discount_group', 'customer',
+                    'min_order_quantity', 'max_order_quantity', 'min_duration', 'max_duration',
+                ],
+                condition=model_fields.Q(valid_to__gte=OPEN_ENDED),
+                nulls_distinct=False,
+                name='discount_single_open_window',
+            ),
         ]
         indexes = [
             model_fields.Index(
                 fields=['product','product_discount_group','customer_discount_group','customer','valid_from', 'valid_to'],
                 include=['discount_perc', 'product'],
                 name="product_prices_index"
-            )
+            ),
+            model_fields.Index(fields=['valid_from'], name='discount_valid_from'),
+            model_fields.Index(fields=['valid_to'], name='discount_valid_to'),
         ]
 
 
     def save(self, *args, **kwargs):
         if self.discount_perc > 1:
             self.discount_perc = self.discount_perc / 100
-        #check if discount exists
-        exists = Discount.objects.filter(
-                    product_discount_group = self.product_discount_group,
-                    product = self.product,
-                    customer_discount_group = self.customer_discount_group,
-                    customer = self.customer,
-                    discount_perc = round(self.discount_perc,4),
-                    discount_abs = round(self.discount_abs,4),
-                ).first()
-        if exists:
-            return exists
-        # check other prices
-        olds = Discount.objects.filter(
-            product_discount_group = self.product_discount_group,
-            product = self.product,
-            customer_discount_group = self.customer_discount_group,
-            customer = self.customer,
-            valid_from__lte = self.valid_from, 
-            valid_to__gte = self.valid_to
-        ).update(valid_to = self.valid_from)
-        
-        # if not self.translations.all():
-        # #     self.discount_label = self.group_number
-        # if not self.description:
-        #     self.name = self.description
-        return super().save()
+        key = {field: getattr(self, field) for field in self.KEY_FIELDS}
+        with transaction.atomic():
+            # serialize writers of the same discount key, so parallel importers cannot both insert an open window
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', [self.discount_key])
+            #check if discount exists: same amounts in a window overlapping ours
+            exists = Discount.objects.filter(
+                        **key,
+                        discount_perc = round(self.discount_perc,4),
+                        discount_abs = round(self.discount_abs,4),
+                        valid_from__lt = self.valid_to,
+                        valid_to__gt = self.valid_from,
+                    ).first()
+            if exists:
+                return exists
+            if self.valid_to.year == OPEN_ENDED.year:
+                # an open window scheduled later keeps running; ours ends where it starts
+                later = Discount.objects.filter(**key, valid_to__gte=OPEN_ENDED, valid_from__gt=self.valid_from).order_by('valid_from').first()
+                if later:
+                    self.valid_to = later.valid_from
+            # check other prices
+            overlapping = Discount.objects.filter(
+                **key,
+                valid_from__lte = self.valid_from, 
+                valid_to__gte = self.valid_to
+            )
+            PriceChangeEvent.record_queryset(overlapping)
+            overlapping.update(valid_to = self.valid_from)
+            return super().save()
+
+    @classmethod
+    def bulk_save(cls, discounts):
+        """
+        Save many discounts with the rules of save() and a fixed number of queries: one advisory lock
+        per discount key, one UPDATE closing the overlapped windows, one bulk insert and one batch of
+        outbox events. Discounts are applied in order, so later ones see the windows of earlier ones.
+        Returns the discounts that were inserted; duplicates of an existing window are skipped.
+        """
+        fields = [cls._meta.get_field(field) for field in cls.KEY_FIELDS]
+        attnames = [field.attname for field in fields]
+
+        def key_of(values):
+            # typed like the database values, whatever the caller assigned
+            return tuple(field.to_python(values(field.attname)) for field in fields)
+
+        by_key = {}
+        for discount in discounts:
+            if discount.discount_perc > 1:
+                discount.discount_perc = discount.discount_perc / 100
+            by_key.setdefault(key_of(lambda attname: getattr(discount, attname)), []).append(discount)
+        if not by_key:
+            return []
+        with transaction.atomic():
+            # sorted, so concurrent writers of overlapping keys cannot deadlock
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT pg_advisory_xact_lock(hashtext(k)) FROM unnest(%s::text[]) AS k ORDER BY k',
+                    [sorted({rows[0].discount_key for rows in by_key.values()})],
+                )
+            windows = {key: [] for key in by_key}
+            existing = cls.objects.filter(
+                model_fields.Q(product__in={key[1] for key in by_key} - {None})
+                | model_fields.Q(product_discount_group__in={key[0] for key in by_key} - {None})
+            ).values('pk', 'discount_perc', 'discount_abs', 'valid_from', 'valid_to', *attnames)
+            for row in existing:
+                key = key_of(row.get)
+                if key in windows:
+                    windows[key].append(row)
+            closed, created = {}, []
+            for key, rows in by_key.items():
+                for discount in rows:
+                    if any(
+                        window['discount_perc'] == round(discount.discount_perc, 4) and window['discount_abs'] == round(discount.discount_abs, 4)
+                        and window['valid_from'] < discount.valid_to and window['valid_to'] > discount.valid_from
+                        for window in windows[key]
+                    ):
+                        continue
+                    if discount.valid_to.year == OPEN_ENDED.year:
+                        later = [window['valid_from'] for window in windows[key] if window['valid_to'] >= OPEN_ENDED and window['valid_from'] > discount.valid_from]
+                        if later:
+                            discount.valid_to = min(later)
+                    for window in windows[key]:
+                        if window['valid_from'] <= discount.valid_from and window['valid_to'] >= discount.valid_to:
+                            window['valid_to'] = discount.valid_from
+                            if 'instance' in window:
+                                window['instance'].valid_to = discount.valid_from
+                            else:
+                                closed[window['pk']] = discount.valid_from
+                    windows[key].append({
+                        'instance': discount, 'discount_perc': round(discount.discount_perc, 4), 'discount_abs': round(discount.discount_abs, 4),
+                        'valid_from': discount.valid_from, 'valid_to': discount.valid_to,
+                    })
+                    created.append(discount)
+            if closed:
+                closing = cls.objects.filter(pk__in=closed)
+                PriceChangeEvent.record_queryset(closing)
+                closing.update(valid_to=models.Case(
+                    *[models.When(pk=pk, then=models.Value(valid_to)) for pk, valid_to in closed.items()],
+                    output_field=cls._meta.get_field('valid_to'),
+                ))
+            cls.objects.bulk_create(created, batch_size=2000)
+            PriceChangeEvent.record(created)
+        return created
+
+    @property
+    def discount_key(self):
+        return 'discount:' + ':'.join(str(getattr(self, self._meta.get_field(field).attname) or '') for field in self.KEY_FIELDS)
+
+class ProductPriceHistory(models.Model):
+    """
+    Expired ProductPrice rows, moved out of the live table by the archive_price_history command.
+    The table is partitioned by year of valid_to (see migration 0014) and not managed by Django.
+    """
+    id = model_fields.UUIDField(primary_key=True, editable=False)
+    price_group = model_fields.ForeignKey("product_price.PriceGroup", verbose_name=_("Price Group"), related_name='+', null=True, db_constraint=False, on_delete=model_fields.DO_NOTHING)
+    product_price_group = model_fields.ForeignKey("product_price.ProductPriceGroup", verbose_name=_("Product Price Group"), related_name='+', null=True, db_constraint=False, on_delete=model_fields.DO_NOTHING)
+    product = model_fields.ForeignKey("product.Product", verbose_name=_("Product"), related_name='+', null=True, db_constraint=False, on_delete=model_fields.DO_NOTHING)
+    option = model_fields.ForeignKey("product.ProductOption", verbose_name=_("Option"), related_name='+', null=True, db_constraint=False, on_delete=model_fields.DO_NOTHING)
+    price = model_fields.DecimalField(verbose_name=_('Price'), max_digits=12, decimal_places=4)
+    pricing_type = model_fields.CharField(verbose_name=_('Pricing type'), max_length=100, choices=PRICING_TYPE.choices)
+    min_order_quantity = model_fields.IntegerField(verbose_name=_('min quantity order discount'))
+    max_order_quantity = model_fields.IntegerField(verbose_name=_('max quantity order discount'))
+    min_duration = model_fields.DurationField(verbose_name=_('Min duration'))
+    max_duration = model_fields.DurationField(verbose_name=_('Max duration'))
+    valid_from = model_fields.DateTimeField(verbose_name=_("valid from"))
+    valid_to = model_fields.DateTimeField(verbose_name=_("valid to"))
+    created_time = model_fields.DateTimeField(verbose_name=_("Created time"))
+    modified_time = model_fields.DateTimeField(verbose_name=_("Modified time"))
+    archived_time = model_fields.DateTimeField(verbose_name=_("Archived time"))
+
+    class Meta:
+        managed = False
+        db_table = 'product_price_productprice_history'
+        verbose_name = _('Price history')
+        verbose_name_plural = _('Price history')
+
+class DiscountHistory(models.Model):
+    """
+    Expired Discount rows, moved out of the live table by the archive_price_history command.
+    The table is partitioned by year of valid_to (see migration 0014) and not managed by Django.
+    """
+    id = model_fields.UUIDField(primary_key=True, editable=False)
+    product_discount_group = model_fields.ForeignKey('product_price.ProductDiscountGroup', verbose_name=_("Product discount group"), related_name='+', null=True, db_constraint=False, on_delete=model_fields.DO_NOTHING)
+    product = model_fields.ForeignKey(Product, verbose_name=_("Product"), related_name='+', null=True, db_constraint=False, on_delete=model_fields.DO_NOTHING)
+    option = model_fields.ForeignKey("product.ProductOption", verbose_name=_("Option"), related_name='+', null=True, db_constraint=False, on_delete=model_fields.DO_NOTHING)
+    customer_discount_group = model_fields.ForeignKey('product_price.CustomerDiscountGroup', verbose_name=_("Customer discount group"), related_name='+', null=True, db_constraint=False, on_delete=model_fields.DO_NOTHING)
+    customer = model_fields.ForeignKey('customer.Customer', verbose_name=_("Customer"), related_name='+', null=True, db_constraint=False, on_delete=model_fields.DO_NOTHING)
+    discount_abs = model_fields.DecimalField(verbose_name=_("Absolute discount"), max_digits=10, decimal_places=4)
+    discount_perc = model_fields.DecimalField(verbose_name=_("Discount percentage"), max_digits=10, decimal_places=4)
+    min_order_quantity = model_fields.IntegerField(verbose_name=_('Min quantity order discount'))
+    max_order_quantity = model_fields.IntegerField(verbose_name=_('Max quantity order discount'))
+    min_duration = model_fields.DurationField(verbose_name=_('Min duration'))
+    max_duration = model_fields.DurationField(verbose_name=_('Max duration'))
+    valid_from = model_fields.DateTimeField(verbose_name=_("valid from"))
+    valid_to = model_fields.DateTimeField(verbose_name=_("valid to"))
+    created_time = model_fields.DateTimeField(verbose_name=_("Created time"))
+    modified_time = model_fields.DateTimeField(verbose_name=_("Modified time"))
+    archived_time = model_fields.DateTimeField(verbose_name=_("Archived time"))
+
+    class Meta:
+        managed = False
+        db_table = 'product_price_discount_history'
+        verbose_name = _('Discount history')
+        verbose_name_plural = _('Discount history')
 
 from django.db.models import Sum
-class DiscountCoupon(BaseTranslationModel):
+class DiscountCoupon(PriceChangeOutboxMixin, BaseTranslationModel):
     products = model_fields.ManyToManyField(Product,verbose_name=_("Allowed for Products"), blank = True, help_text=_("Leave empty to make available for all products"), through='product_price.ProductDiscountCoupon')  
     needs_products = model_fields.IntegerField(verbose_name=_("Quantity needed of allowed products"), null=True, blank = True, help_text=_(f"Fill in number of products that for the discount coupon to be valid. Use -quantity to use distinct number of products, leave empty to use all products."))  
     email = model_fields.CharField(_("Email"), max_length=100, null=True, blank = True)
@@ -277,50 +753,163 @@ class DiscountCoupon(BaseTranslationModel):
     
     valid_from = model_fields.DateTimeField(verbose_name=_("Valid from"), default= timezone.now )  
     valid_to = model_fields.DateTimeField(verbose_name=_("Valid to"), default= timezone.datetime(9999, 12, 31)  )  
+
+    max_uses = model_fields.PositiveIntegerField(verbose_name=_("Maximum uses"), null=True, blank=True, help_text=_("Leave empty for unlimited use"))
+    max_uses_per_customer = model_fields.PositiveIntegerField(verbose_name=_("Maximum uses per customer"), null=True, blank=True, help_text=_("Leave empty for unlimited use"))
     
     objects = DiscountCouponManager()
 
     def __str__(self):
         return str(self.discount_code)
+
+    def get_discount_label(self, language=None):
+        return discount_labels.get(self, language)
         
     def save(self, *args, **kwargs):
         if self.email == '':
             self.email = None
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.sync_redemption_slots()
+
+    def sync_redemption_slots(self):
+        """
+        Spread the remaining uses over at most COUPON_SLOTS slot rows, so concurrent redemptions
+        each lock a different row however large max_uses is.
+        """
+        slots = self.redemptions.filter(slot__isnull=False)
+        # waits for redemptions in flight, so the used count below includes them
+        list(slots.select_for_update().values_list('pk', flat=True))
+        slots.delete()
+        if self.max_uses is None:
+            return
+        DiscountCouponRedemption.create_slots(self, self.max_uses - self.redemptions.filter(redeemed_time__isnull=False).count())
+
+    def redeem(self, email=None, reference=None):
+        """
+        Record one use of the coupon. Returns an error message, or False when redeemed.
+        Call inside the transaction that applies the coupon, so a failure releases the use again.
+        """
+        email = email.lower() if email else None
+        with transaction.atomic():
+            if self.max_uses_per_customer is not None and email:
+                # serializes concurrent redemptions of the same customer only
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', [f'discount_coupon:{self.pk}:{email}'])
+                if self.used_by([email]) >= self.max_uses_per_customer:
+                    return _('You already used this discount code')
+            if self.max_uses is not None:
+                slots = self.redemptions.filter(slot__isnull=False, remaining__gt=0).order_by('slot')
+                slot = slots.select_for_update(skip_locked=True).first()
+                while slot is None and slots.exists():
+                    # every slot with uses left is held by a concurrent redemption: wait for one
+                    slot = slots.select_for_update().first()
+                if slot is None:
+                    return _('This discount code has been fully redeemed')
+                slots.filter(pk=slot.pk).update(remaining=model_fields.F('remaining') - 1)
+            DiscountCouponRedemption.objects.create(discount_coupon=self, email=email, reference=reference, redeemed_time=timezone.now())
+        return False
+
+    def used_by(self, emails):
+        """
+        Number of redemptions by any of emails. Redemption emails are stored lower case,
+        so the (discount_coupon, email) index serves the lookup.
+        """
+        emails = [email.lower() for email in emails or [] if email]
+        if not emails:
+            return 0
+        return self.redemptions.filter(email__in=emails, redeemed_time__isnull=False).count()
 
     def get_product(self, store):
         if self.discount_abs:
-            product = get_create_product('DISCOUNT_COUPON_ABS', {'name':_('Discount Coupon'), 'pricing_type': PRICING_TYPE.PRICE, 'default_price': 0}, store)
+            return coupon_products.get('DISCOUNT_COUPON_ABS', store)
         elif self.discount_perc:
-            product = get_create_product('DISCOUNT_COUPON_PERC', {'name':_('Discount Coupon'), 'pricing_type': PRICING_TYPE.PERCENTAGE_TOTAL, 'default_price': 0}, store)
-        product = product[0]
-        return product
+            return coupon_products.get('DISCOUNT_COUPON_PERC', store)
 
-    def validate_coupon(self, emails, order_amount, lines):
-        if emails: 
-            valid = False
-            for email in emails:
-                if email == self.email:
-                    valid = True
-            if not valid:
-                return _('This is not a valid code for you')
+    def validate_order(self, emails, order_amount, quantities, now=None):
+        """
+        The coupon rules shared by coupon application (validate_coupon) and price quotes (pricing.quote).
+        quantities maps the ordered product pks to their quantities. Returns an error message, or False when valid.
+        """
+        now = now or timezone.now()
+        emails = [email.lower() for email in emails or [] if email]
+        if self.email and self.email.lower() not in emails:
+            return _('This is not a valid code for you')
+        if self.valid_from > now or self.valid_to < now:
+            return _('This discount code is not valid at this moment')
+        if self.max_uses is not None and not self.redemptions.filter(slot__isnull=False, remaining__gt=0).exists():
+            return _('This discount code has been fully redeemed')
+        if self.max_uses_per_customer is not None:
+            if self.used_by(emails) >= self.max_uses_per_customer:
+                return _('You already used this discount code')
         if order_amount < self.minimal_order_amount:
             return _('Order amount has to be a minimum of €{min} ').format(min=self.minimal_order_amount)
-        product_list = self.products.all()
-        if product_list:
+        product_ids = {str(pk) for pk in self.products.values_list('pk', flat=True)}
+        if product_ids:
+            ordered = {str(product): quantity for product, quantity in quantities.items() if str(product) in product_ids}
             if self.needs_products is None or self.needs_products < 0:
-                needed = self.needs_products or len(product_list)
-                if lines.filter(product__in=product_list).values('product').distinct().count() < needed:
+                # -n: n distinct allowed products, empty: all of them
+                needed = -self.needs_products if self.needs_products else len(product_ids)
+                if len(ordered) < needed:
                     return _('This discount coupon is not valid for this order')
             elif self.needs_products > 0:
-                if lines.filter(product__in=product_list).aggregate(Sum('quantity')) < self.needs_products:
+                if sum(ordered.values()) < self.needs_products:
                     return _('This discount coupon is not valid for this order')
         return False
 
+    def validate_coupon(self, emails, order_amount, lines):
+        quantities = {}
+        for product_id, quantity in lines.values_list('product_id', 'quantity'):
+            quantities[product_id] = quantities.get(product_id, 0) + (quantity or 0)
+        return self.validate_order(emails, order_amount, quantities)
+
     class Meta:
         verbose_name = _('Discount coupon')
         verbose_name_plural = _('Discount coupons')
+        indexes = [
+            model_fields.Index(fields=['valid_from'], name='discount_coupon_valid_from'),
+            model_fields.Index(fields=['valid_to'], name='discount_coupon_valid_to'),
+        ]
         
+class DiscountCouponRedemption(BaseModel):
+    """
+    One use of a DiscountCoupon (redeemed_time set), or one of the slot rows of a coupon with max_uses
+    (slot set): the remaining uses are spread over at most COUPON_SLOTS slots, and a redemption
+    decrements one it claimed with SELECT ... FOR UPDATE SKIP LOCKED.
+    """
+    discount_coupon = model_fields.ForeignKey(DiscountCoupon, verbose_name=_("Discount Coupon"), related_name='redemptions', on_delete=model_fields.CASCADE)
+    slot = model_fields.IntegerField(verbose_name=_("Slot"), null=True, blank=True, editable=False)
+    remaining = model_fields.PositiveIntegerField(verbose_name=_("Remaining uses"), default=0, editable=False)
+    email = model_fields.CharField(_("Email"), max_length=100, null=True, blank=True)
+    reference = model_fields.CharField(_("Reference"), max_length=100, null=True, blank=True)
+    redeemed_time = model_fields.DateTimeField(verbose_name=_("Redeemed time"), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _('Discount coupon redemption')
+        verbose_name_plural = _('Discount coupon redemptions')
+        constraints = [
+            model_fields.UniqueConstraint(fields=['discount_coupon', 'slot'], name='discount_coupon_redemption_slot'),
+        ]
+        indexes = [
+            model_fields.Index(fields=['discount_coupon', 'slot'], condition=model_fields.Q(redeemed_time__isnull=True), name='discount_coupon_open_slots'),
+            model_fields.Index(fields=['discount_coupon', 'email'], name='discount_coupon_redeemed_by'),
+        ]
+
+    @classmethod
+    def slots(cls, coupon_id, uses):
+        """
+        Unsaved slot rows sharing uses, the first ones taking the rest of the division.
+        """
+        count = min(COUPON_SLOTS, uses)
+        return [
+            cls(discount_coupon_id=coupon_id, slot=slot, remaining=uses // count + (slot < uses % count))
+            for slot in range(count)
+        ]
+
+    @classmethod
+    def create_slots(cls, coupon, uses):
+        cls.objects.bulk_create(cls.slots(coupon.pk, uses))
+
 class ProductDiscountCoupon(BaseModel):
     discount_coupon = model_fields.ForeignKey(DiscountCoupon, verbose_name=_("Discount Coupon"),on_delete=model_fields.CASCADE)  
     product = model_fields.ForeignKey(Product, verbose_name=_("product"),on_delete=model_fields.CASCADE)  
@@ -329,9 +918,139 @@ class ProductDiscountCoupon(BaseModel):
         verbose_name = _('Product discount coupon')
         verbose_name_plural = _('Product discount coupons')
 
+class PriceChangeEvent(models.Model):
+    """
+    Transactional outbox of ProductPrice, Discount and DiscountCoupon changes, and of the price groups and
+    products nested in price responses (for their ETags, see viewsets.ConditionalGetMixin).
+
+    Events are written in the transaction of the change, bulk paths included, and streamed to the
+    PRODUCT_PRICE_OUTBOX_CONSUMERS by the dispatch_price_events command. transaction_id is the writing
+    transaction, so readers can restrict themselves to transactions that are known to be committed.
+    """
+    transaction_id = model_fields.BigIntegerField(verbose_name=_("Transaction"), db_default=Func(function='txid_current', output_field=model_fields.BigIntegerField()), editable=False)
+    model = model_fields.CharField(verbose_name=_("Model"), max_length=30)
+    object_id = model_fields.UUIDField(verbose_name=_("Object"))
+    product = model_fields.ForeignKey(Product, verbose_name=_("Product"), related_name='+', null=True, blank=True, db_constraint=False, on_delete=model_fields.DO_NOTHING)
+    operation = model_fields.CharField(verbose_name=_("Operation"), max_length=10, choices=CHANGE_OPERATION.choices, default=CHANGE_OPERATION.UPSERT)
+    created_time = model_fields.DateTimeField(verbose_name=_("Created time"), db_default=Now(), editable=False)
+    dispatched_time = model_fields.DateTimeField(verbose_name=_("Dispatched time"), null=True, blank=True, editable=False)
+
+    class Meta:
+        verbose_name = _('Price change event')
+        verbose_name_plural = _('Price change events')
+        indexes = [
+            model_fields.Index(fields=['id'], condition=model_fields.Q(dispatched_time__isnull=True), name='price_change_event_pending'),
+            model_fields.Index(fields=['model', 'transaction_id', 'id'], name='price_change_event_sequence'),
+            model_fields.Index(fields=['model', 'id'], name='price_change_event_model_last'),
+        ]
+
+    def __str__(self):
+        return f'{self.model} {self.object_id} {self.operation}'
+
+    def as_message(self):
+        return {
+            'sequence': self.id,
+            'model': self.model,
+            'id': str(self.object_id),
+            'product': str(self.product_id) if self.product_id else None,
+            'operation': self.operation,
+            'time': self.created_time.isoformat(),
+        }
+
+    @classmethod
+    def record(cls, instances, operation=None):
+        """
+        Record a change of each instance; operation defaults to the instance's change_operation().
+        """
+        return cls.objects.bulk_create([
+            cls(
+                model=instance._meta.model_name,
+                object_id=instance.pk,
+                product_id=getattr(instance, 'product_id', None),
+                operation=operation or instance.change_operation(),
+            )
+            for instance in instances
+        ], batch_size=5000)
+
+    @classmethod
+    def record_queryset(cls, queryset, operation=CHANGE_OPERATION.UPSERT):
+        """
+        Record a change of every row of a ProductPrice or Discount queryset with one INSERT ... SELECT.
+        Call before an update() that moves the rows out of the queryset.
+        """
+        sql, params = queryset.values_list('pk', 'product_id').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {cls._meta.db_table} (model, object_id, product_id, operation) '
+                f'SELECT %s, changed.id, changed.product_id, %s FROM ({sql}) AS changed(id, product_id)',
+                [queryset.model._meta.model_name, operation, *params],
+            )
+            return cursor.rowcount
+
+
+class TrigramIContains(PatternLookup):
+    """
+    Case insensitive containment compiled to column ILIKE '%term%'. icontains compiles to
+    UPPER(column::text) LIKE UPPER(...), which a plain gin_trgm_ops index cannot serve.
+    """
+    lookup_name = 'trigram_icontains'
+    param_pattern = '%%%s%%'
+
+    def get_rhs_op(self, connection, rhs):
+        return f'ILIKE {rhs}'
+
+
+class ProductSearchText(models.Model):
+    """
+    Searchable texts of a product for the price search (search.ProductSearchFilter): its product number
+    (empty language_code) and its name in every language. Kept in this app, so the trigram index does not
+    live on the product app's tables; maintained by the Product signals and the rebuild_product_search command.
+    """
+    product = model_fields.ForeignKey(Product, verbose_name=_("Product"), related_name='+', db_constraint=False, on_delete=model_fields.DO_NOTHING)
+    language_code = model_fields.CharField(verbose_name=_("Language"), max_length=15, blank=True)
+    text = model_fields.TextField(verbose_name=_("Text"))
+
+    class Meta:
+        verbose_name = _('Product search text')
+        verbose_name_plural = _('Product search texts')
+        constraints = [
+            model_fields.UniqueConstraint(fields=['product', 'language_code'], name='product_search_text_unique'),
+        ]
+        indexes = [
+            GinIndex(fields=['text'], opclasses=['gin_trgm_ops'], name='product_search_text_trgm'),
+        ]
+
+    def __str__(self):
+        return self.text
+
+    @classmethod
+    def sync(cls, product_ids):
+        """
+        Replace the search texts of the given products with their current number and names; products that
+        no longer exist lose theirs.
+        """
+        product_ids = list(product_ids)
+        rows = [
+            cls(product_id=pk, language_code='', text=product_number)
+            for pk, product_number in Product.objects.filter(pk__in=product_ids, product_number__gt='').values_list('pk', 'product_number')
+        ]
+        rows += [
+            cls(product_id=master_id, language_code=language_code, text=name)
+            for master_id, language_code, name in Product._parler_meta.root_model.objects.filter(
+                master__in=product_ids, name__gt='',
+            ).values_list('master_id', 'language_code', 'name')
+        ]
+        with transaction.atomic():
+            cls.objects.filter(product__in=product_ids).delete()
+            cls.objects.bulk_create(rows, batch_size=5000)
+
+
+ProductSearchText._meta.get_field('text').register_lookup(TrigramIContains)
+
 
 
 from .price_calculations import calculate_price_expression
+from .pricing import resolve_product_price
 from apps_base._base.model_fields import F, Value, Cast
 from django.db import models
 from apps_shared.product.choices import UNIT_TYPE
@@ -495,17 +1214,18 @@ class PriceFieldsMixin(models.Model):
         print('set_pricing', self.price_ex_discount, self.price_discount, self.unit, self.vat_percentage, self.pricing_type)
         if self.price_ex_discount is None or self.price_discount is None or self.unit is None or self.vat_percentage is None or self.pricing_type is None:
             self.quantity = self.quantity or self.product.default_quantity or 1
-            product = Product.objects.all().add_prices(
+            resolved = resolve_product_price(
+                self.product,
                 customer = self.header.customer,
-                country = self.header.customer.country if self.header.customer else Country.get_default(),
+                country = self.header.customer.country if self.header.customer else default_lookups.get(Country),
                 store = self.header.store,
                 quantity = self.quantity,
-            ).get(pk = self.product.pk)
-            self.price_ex_discount = self.price_ex_discount or product.price
-            self.price_discount = self.price_discount or product.price_discount
-            self.unit = self.unit or product.unit 
-            self.vat_percentage = self.vat_percentage or product.calc_vat_percentage
-            self.pricing_type = self.pricing_type or product.calc_pricing_type
+            )
+            self.price_ex_discount = self.price_ex_discount or resolved['price']
+            self.price_discount = self.price_discount or resolved['price_discount']
+            self.unit = self.unit or resolved['unit']
+            self.vat_percentage = self.vat_percentage or resolved['vat_percentage']
+            self.pricing_type = self.pricing_type or resolved['pricing_type']
         self.is_vat_included = self.header.store.enter_vat
 
     class Meta:
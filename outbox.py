@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import PriceChangeEvent
+
+import logging
+logger = logging.getLogger(__name__)
+
+# dotted paths of callables that receive a list of PriceChangeEvent.as_message() dicts
+OUTBOX_CONSUMERS = getattr(settings, 'PRODUCT_PRICE_OUTBOX_CONSUMERS', [])
+OUTBOX_BATCH_SIZE = getattr(settings, 'PRODUCT_PRICE_OUTBOX_BATCH_SIZE', 1000)
+# dispatched events are kept this long for clients that sync from the outbox
+OUTBOX_RETENTION_DAYS = getattr(settings, 'PRODUCT_PRICE_OUTBOX_RETENTION_DAYS', 30)
+
+
+def get_consumers(paths=None):
+    return [import_string(path) for path in (OUTBOX_CONSUMERS if paths is None else paths)]
+
+
+def coalesce(events):
+    """
+    Keep the last event per object; a row changed many times in one batch is sent once.
+    """
+    latest = {}
+    for event in events:
+        latest.pop((event.model, event.object_id), None)
+        latest[(event.model, event.object_id)] = event
+    return list(latest.values())
+
+
+def dispatch_batch(consumers, batch_size=OUTBOX_BATCH_SIZE):
+    """
+    Send the oldest pending events to every consumer and mark them dispatched.
+    Rows are claimed with SKIP LOCKED so several dispatchers can run side by side. When a consumer
+    raises, the transaction rolls back and the batch is sent again later (at least once delivery).
+    Returns the number of dispatched events.
+    """
+    with transaction.atomic():
+        events = list(
+            PriceChangeEvent.objects.select_for_update(skip_locked=True)
+            .filter(dispatched_time__isnull=True)
+            .order_by('id')[:batch_size]
+        )
+        if not events:
+            return 0
+        messages = [event.as_message() for event in coalesce(events)]
+        for consumer in consumers:
+            consumer(messages)
+        PriceChangeEvent.objects.filter(pk__in=[event.pk for event in events]).update(dispatched_time=timezone.now())
+    return len(events)
+
+
+def dispatch_pending(consumers=None, batch_size=OUTBOX_BATCH_SIZE):
+    consumers = get_consumers() if consumers is None else consumers
+    dispatched = 0
+    while True:
+        count = dispatch_batch(consumers, batch_size)
+        dispatched += count
+        if count < batch_size:
+            return dispatched
+
+
+def prune_dispatched(days=OUTBOX_RETENTION_DAYS):
+    deleted, _ = PriceChangeEvent.objects.filter(
+        dispatched_time__isnull=False,
+        created_time__lt=timezone.now() - timezone.timedelta(days=days),
+    ).delete()
+    if deleted:
+        logger.info('Pruned %s dispatched price change events', deleted)
+    return deleted
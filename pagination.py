@@ -0,0 +1,73 @@
+import json
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination
+
+# below this many (estimated) rows an exact COUNT(*) is cheap enough
+EXACT_COUNT_LIMIT = getattr(settings, 'PRODUCT_PRICE_EXACT_COUNT_LIMIT', 10000)
+KEYSET_PAGE_SIZE = getattr(settings, 'PRODUCT_PRICE_KEYSET_PAGE_SIZE', 100)
+
+
+def estimated_count(queryset, exact_limit=EXACT_COUNT_LIMIT):
+    """
+    Row count of queryset from the planner statistics, exact when the estimate is small.
+    An unfiltered queryset reads pg_class.reltuples, a filtered one the row estimate of its plan.
+    """
+    queryset = queryset.order_by()
+    with connections[queryset.db].cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            estimate = row[0] if row else -1
+        else:
+            sql, params = queryset.query.sql_with_params()
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = plan[0]['Plan']['Plan Rows']
+    if estimate < exact_limit:
+        # never analyzed (-1) or small: count exactly
+        return queryset.count()
+    return int(estimate)
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        return estimated_count(self.object_list)
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination on (created_time, id): every page is an index range scan, however deep.
+    """
+    ordering = ('-created_time', '-id')
+    page_size = KEYSET_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class KeysetPaginationMixin:
+    """
+    Viewsets serve keyset pages when the request has a cursor (or ?pagination=keyset) and otherwise
+    keep their configured pagination, with the total count estimated for large tables.
+    """
+    keyset_pagination_class = KeysetPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params if self.request else {}
+            if self.keyset_pagination_class.cursor_query_param in params or params.get('pagination') == 'keyset':
+                self._paginator = self.keyset_pagination_class()
+            else:
+                self._paginator = super().paginator
+                if hasattr(self._paginator, 'django_paginator_class'):
+                    self._paginator.django_paginator_class = EstimatedCountPaginator
+                elif hasattr(self._paginator, 'get_count'):
+                    self._paginator.get_count = estimated_count
+        return self._paginator
@@ -2,6 +2,7 @@ from django.db.models import F, Value, ExpressionWrapper, Case, When
 from django.db.models.functions import Extract, Ceil
 from apps_base._base.model_fields import CurrencyField
 from typing import Optional
+import math
 
 SECONDS_PER_HOUR = 3600  # 60 * 60
 HOURS_PER_DAY = 24
@@ -49,6 +50,20 @@ def calculate_price_expression(
         )
     return ExpressionWrapper(expression, output_field=output_field)
 
+def calculate_price(base_price, quantity, pricing_type, duration=None):
+    """
+    Python counterpart of calculate_price_expression for a single price.
+    Started hours and days are charged in full, as Ceil does in the expression.
+    """
+    amount = base_price * quantity
+    if duration is not None:
+        hours = math.ceil(duration.total_seconds() / SECONDS_PER_HOUR)
+        if pricing_type == 'price_per_hour':
+            amount *= hours
+        elif pricing_type == 'price_per_day':
+            amount *= math.ceil(duration.total_seconds() / SECONDS_PER_HOUR / HOURS_PER_DAY)
+    return amount
+
 def add_price_annotations(queryset, price_field='price_ex_vat', quantity_field='quantity', 
                         duration_field='duration', people_field='people', 
                         pricing_type_field='pricing_type', prefix=''):
@@ -0,0 +1,162 @@
+import bisect
+import calendar
+import datetime
+import decimal
+import math
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .price_calculations import SECONDS_PER_HOUR, HOURS_PER_DAY, calculate_price
+
+# DurationRounded: below 7.5 hours started hours are charged, from there on started days
+ROUND_TO_DAYS_FROM = datetime.timedelta(hours=7.5)
+DEFAULT_GRID_DURATIONS = [datetime.timedelta(hours=hours) for hours in (1, 2, 4)] + [datetime.timedelta(days=days) for days in range(1, 8)]
+
+
+def round_duration(duration):
+    """
+    Python counterpart of models.DurationRounded.
+    """
+    seconds = duration.total_seconds()
+    if duration < ROUND_TO_DAYS_FROM:
+        return datetime.timedelta(seconds=math.ceil(seconds / SECONDS_PER_HOUR) * SECONDS_PER_HOUR)
+    day = SECONDS_PER_HOUR * HOURS_PER_DAY
+    return datetime.timedelta(seconds=math.ceil(seconds / day) * day)
+
+
+def month_starts(year, month, start_time=datetime.time(0)):
+    days = calendar.monthrange(year, month)[1]
+    return [timezone.make_aware(datetime.datetime.combine(datetime.date(year, month, day), start_time)) for day in range(1, days + 1)]
+
+
+class _Band:
+    """
+    The price rows of one duration band, as validity segments searchable by start time.
+    """
+
+    def __init__(self, rows):
+        self.rows = sorted(rows, key=lambda row: row['valid_from'])
+        self.starts = [row['valid_from'] for row in self.rows]
+
+    def at(self, moment):
+        # latest row that started at or before moment and is still valid then
+        index = bisect.bisect_right(self.starts, moment) - 1
+        while index >= 0:
+            row = self.rows[index]
+            if row['valid_to'] > moment:
+                return row
+            index -= 1
+        return None
+
+
+def in_bands(row, quantity, duration):
+    # quantity and duration bands of a price or discount row
+    return row['min_order_quantity'] <= quantity <= row['max_order_quantity'] and row['min_duration'] <= duration <= row['max_duration']
+
+
+def price_precedence(row):
+    # product prices win over product price group prices, narrower quantity tiers over wider ones
+    return (row['product_id'] is not None, row['min_order_quantity'])
+
+
+def best_discount(discounts, price):
+    # the largest discount on price, percentage or absolute, capped at the price
+    best = decimal.Decimal(0)
+    for discount in discounts:
+        best = max(best, discount['discount_abs'] or 0, price * (discount['discount_perc'] or 0))
+    return min(best, price)
+
+
+def _discount_at(discounts, moment, duration, quantity, price):
+    # the discount on price that applies at moment
+    return best_discount([
+        discount for discount in discounts
+        if discount['valid_from'] <= moment < discount['valid_to'] and in_bands(discount, quantity, duration)
+    ], price)
+
+
+class DurationPrices:
+    """
+    The live hour and day prices of a product and its product price group, with the discounts that apply to
+    the product (Discount.objects.applicable, no option discounts), valid somewhere between first and last.
+    Read once; at() then resolves any start and duration in memory.
+    """
+
+    def __init__(self, product, first, last, quantity=1, price_group=None, customer=None):
+        from .models import Discount, ProductDiscountGroup, ProductPrice, ProductPriceGroup
+        from .pricing import customer_groups
+        from apps_shared.product.choices import PRICING_TYPE
+        self.quantity = quantity
+        product_id = getattr(product, 'pk', product)
+        customer_price_group, customer_discount_group = customer_groups(customer)
+        price_group = getattr(price_group, 'pk', price_group) or customer_price_group
+        # the product's own prices and those of its product price group; options have prices of their own
+        product_price_group = next(iter(ProductPriceGroup.of_products([product_id]).values()), None)
+        scope = Q(product=product_id)
+        if product_price_group:
+            scope |= Q(product__isnull=True, product_price_group=product_price_group)
+        prices = ProductPrice.objects.filter_live().filter(
+            scope,
+            option__isnull=True,
+            price_group=price_group,
+            pricing_type__in=[PRICING_TYPE.PRICE_PER_HOUR, PRICING_TYPE.PRICE_PER_DAY],
+            min_order_quantity__lte=quantity,
+            max_order_quantity__gte=quantity,
+            valid_from__lte=last,
+            valid_to__gt=first,
+        ).values('product_id', 'price', 'pricing_type', 'min_order_quantity', 'min_duration', 'max_duration', 'valid_from', 'valid_to')
+        discount_group = next(iter(ProductDiscountGroup.of_products([product_id]).values()), None)
+        self.discounts = list(
+            Discount.objects.applicable(product_id, discount_group, customer, customer_discount_group)
+            .filter(valid_from__lte=last, valid_to__gt=first)
+            .values('discount_perc', 'discount_abs', 'min_order_quantity', 'max_order_quantity', 'min_duration', 'max_duration', 'valid_from', 'valid_to')
+        )
+        bands = {}
+        for row in prices:
+            bands.setdefault((row['min_duration'], row['max_duration']), []).append(row)
+        self.bands = {key: _Band(rows) for key, rows in bands.items()}
+        self._columns = {}
+
+    def column(self, duration):
+        # the rounded duration and the bands it falls into, once per duration
+        if duration not in self._columns:
+            rounded = round_duration(duration)
+            self._columns[duration] = (rounded, [band for (low, high), band in self.bands.items() if low <= rounded <= high])
+        return self._columns[duration]
+
+    def at(self, start, duration):
+        """
+        (price, price discount, pricing type) of a rental of duration from start, or None when no price applies.
+        The rounded duration picks the band and the discount; the charge is for the duration itself.
+        """
+        rounded, bands = self.column(duration)
+        matches = [price for price in (band.at(start) for band in bands) if price is not None]
+        if not matches:
+            return None
+        price = max(matches, key=lambda match: (price_precedence(match), match['valid_from']))
+        return price['price'], _discount_at(self.discounts, start, rounded, self.quantity, price['price']), price['pricing_type']
+
+    def amount(self, start, duration):
+        resolved = self.at(start, duration)
+        if resolved is None:
+            return None
+        price, discount, pricing_type = resolved
+        return calculate_price(price - discount, self.quantity, pricing_type, duration).quantize(decimal.Decimal('0.01'))
+
+
+def price_grid(product, starts, durations=None, quantity=1, price_group=None, customer=None):
+    """
+    Amounts for renting quantity units of product for every start in starts and every duration.
+
+    Reads the prices and discounts once (DurationPrices), then works along both axes: durations are
+    rounded like DurationRounded and matched to their duration band once per column, each band is
+    searched by start time with bisect. Returns {'durations', 'starts', 'grid'} where grid[start][duration]
+    is the amount, or None when no price applies.
+    """
+    durations = sorted(durations or DEFAULT_GRID_DURATIONS)
+    if not starts:
+        return {'durations': durations, 'starts': [], 'grid': []}
+    prices = DurationPrices(product, min(starts), max(starts) + max(durations), quantity, price_group, customer)
+    grid = [[prices.amount(start, duration) for duration in durations] for start in starts]
+    return {'durations': durations, 'starts': starts, 'grid': grid}
@@ -0,0 +1,271 @@
+import csv
+import decimal
+import os
+import queue
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import Manager
+
+from django.core.exceptions import ValidationError
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_duration
+from django.utils.translation import gettext_lazy as _
+
+from .cache import price_cache
+
+import logging
+logger = logging.getLogger(__name__)
+
+MAX_REPORTED_ERRORS = 100
+
+PRICE_COLUMNS = ['price_group', 'product_price_group', 'price', 'pricing_type', 'min_order_quantity', 'max_order_quantity', 'min_duration', 'max_duration', 'valid_from', 'valid_to']
+DISCOUNT_COLUMNS = ['product_discount_group', 'customer_discount_group', 'customer', 'discount_abs', 'discount_perc', 'min_order_quantity', 'max_order_quantity', 'min_duration', 'max_duration', 'valid_from', 'valid_to']
+
+
+def partition_of(product_number, workers):
+    return zlib.crc32((product_number or '').encode()) % workers
+
+
+def split_by_product(path, workers, directory):
+    """
+    Stream the csv at path into one csv per partition, so all rows of a product land in the same worker.
+    Returns the partition file paths and the total row count.
+    """
+    paths = [os.path.join(directory, f'partition_{i}.csv') for i in range(workers)]
+    files = [open(p, 'w', newline='') for p in paths]
+    rows = 0
+    try:
+        with open(path, newline='') as f:
+            reader = csv.DictReader(f)
+            writers = [csv.DictWriter(out, fieldnames=['line'] + reader.fieldnames) for out in files]
+            for writer in writers:
+                writer.writeheader()
+            for line, row in enumerate(reader, start=2):
+                writers[partition_of(row.get('product_number'), workers)].writerow({'line': line, **row})
+                rows += 1
+    finally:
+        for out in files:
+            out.close()
+    return paths, rows
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def _parse_datetime(value, default=None):
+    if not value:
+        return default
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f'invalid datetime {value!r}')
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+def _parse_duration(value, default=None):
+    if not value:
+        return default
+    parsed = parse_duration(value)
+    if parsed is None:
+        raise ValueError(f'invalid duration {value!r}')
+    return parsed
+
+
+class PartitionImporter:
+    """
+    Validates and writes the rows of one partition file, in the worker process.
+    """
+
+    def __init__(self, progress, version_id=None):
+        from .models import PriceGroup, ProductPriceGroup, ProductDiscountGroup, CustomerDiscountGroup
+        self.progress = progress
+        self.version_id = version_id
+        self.version = draft_version(version_id) if version_id else None
+        self.price_groups = dict(PriceGroup.objects.values_list('description', 'pk'))
+        self.product_price_groups = dict(ProductPriceGroup.objects.values_list('description', 'pk'))
+        self.product_discount_groups = dict(ProductDiscountGroup.objects.values_list('group_number', 'pk'))
+        self.customer_discount_groups = dict(CustomerDiscountGroup.objects.values_list('group_number', 'pk'))
+        self.result = {'rows': 0, 'prices': 0, 'discounts': 0, 'errors': []}
+
+    def run(self, path, chunk_size):
+        with open(path, newline='') as f:
+            chunk = []
+            for row in csv.DictReader(f):
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    self.import_chunk(chunk)
+                    chunk = []
+            if chunk:
+                self.import_chunk(chunk)
+        return self.result
+
+    def error(self, row, message):
+        if len(self.result['errors']) < MAX_REPORTED_ERRORS:
+            self.result['errors'].append((int(row['line']), message))
+
+    def lookup(self, mapping, value, label):
+        if not value:
+            return None
+        if value not in mapping:
+            raise ValueError(f'unknown {label} {value!r}')
+        return mapping[value]
+
+    def import_chunk(self, rows):
+        from apps_shared.product.models import Product
+        from .models import ProductPrice, Discount, PriceGroup, PriceChangeEvent, return_date_time_latest
+        products = dict(Product.objects.filter(product_number__in={row['product_number'] for row in rows if row.get('product_number')}).values_list('product_number', 'pk'))
+        prices, discounts = [], []
+        for row in rows:
+            try:
+                kind = row.get('kind') or 'price'
+                product_id = self.lookup(products, row.get('product_number'), 'product')
+                common = {
+                    'product_id': product_id,
+                    'min_order_quantity': int(row.get('min_order_quantity') or 0),
+                    'max_order_quantity': int(row.get('max_order_quantity') or 9999999),
+                    'min_duration': _parse_duration(row.get('min_duration'), timezone.timedelta(days=0)),
+                    'max_duration': _parse_duration(row.get('max_duration'), timezone.timedelta(days=100)),
+                    'valid_from': _parse_datetime(row.get('valid_from'), timezone.now()),
+                    'valid_to': _parse_datetime(row.get('valid_to'), return_date_time_latest()),
+                }
+                if common['min_order_quantity'] > common['max_order_quantity'] or common['min_duration'] > common['max_duration']:
+                    raise ValueError('minimum exceeds maximum')
+                if kind == 'price':
+                    if product_id is None:
+                        raise ValueError('product_number is required')
+                    price_group_id = self.lookup(self.price_groups, row.get('price_group'), 'price group')
+                    product_price_group_id = self.lookup(self.product_price_groups, row.get('product_price_group'), 'product price group')
+                    if self.version is not None:
+                        # a version holds the prices of one scope; empty columns mean the version's own
+                        scope = self.version.scope
+                        if (row.get('price_group') and price_group_id != scope['price_group_id']) or (row.get('product_price_group') and product_price_group_id != scope['product_price_group_id']):
+                            raise ValueError('price group or product price group differs from the price list version')
+                        price_group_id, product_price_group_id = scope['price_group_id'], scope['product_price_group_id']
+                    price = ProductPrice(
+                        price_group_id=price_group_id or PriceGroup.get_default_pk(),
+                        product_price_group_id=product_price_group_id,
+                        price=decimal.Decimal(row['price']),
+                        pricing_type=row.get('pricing_type') or ProductPrice._meta.get_field('pricing_type').default,
+                        **common,
+                    )
+                    price.clean_fields(exclude=['product', 'price_group', 'product_price_group', 'option'])
+                    if self.version is not None:
+                        # staged without groups: publishing attaches it to the version's scope, which the row matches
+                        price.price_group_id = price.product_price_group_id = None
+                        price.version_id = self.version_id
+                    prices.append(price)
+                elif kind == 'discount':
+                    discount = Discount(
+                        product_discount_group_id=self.lookup(self.product_discount_groups, row.get('product_discount_group'), 'product discount group'),
+                        customer_discount_group_id=self.lookup(self.customer_discount_groups, row.get('customer_discount_group'), 'customer discount group'),
+                        customer_id=row.get('customer') or None,
+                        discount_abs=decimal.Decimal(row.get('discount_abs') or 0),
+                        discount_perc=decimal.Decimal(row.get('discount_perc') or 0),
+                        **common,
+                    )
+                    if discount.product_id is None and discount.product_discount_group_id is None:
+                        raise ValueError('product_number or product_discount_group is required')
+                    discounts.append((row, discount))
+                else:
+                    raise ValueError(f'unknown kind {kind!r}')
+            except (ValueError, KeyError, decimal.InvalidOperation) as e:
+                self.error(row, str(e))
+            except Exception as e:
+                self.error(row, getattr(e, 'messages', None) and '; '.join(e.messages) or str(e))
+        with transaction.atomic():
+            ProductPrice.objects.bulk_create(prices, batch_size=2000)
+            if not self.version_id:
+                PriceChangeEvent.record(prices)
+        saved = self.save_discounts(discounts)
+        self.result['rows'] += len(rows)
+        self.result['prices'] += len(prices)
+        self.result['discounts'] += saved
+        self.progress.put(len(rows))
+
+    def save_discounts(self, discounts):
+        """
+        Write the discounts of a chunk with Discount.bulk_save; rows of one product never reach two workers.
+        When the batch fails, the rows are saved one by one to report the failing ones.
+        """
+        from .models import Discount
+        valid_to = [discount.valid_to for row, discount in discounts]
+        try:
+            return len(Discount.bulk_save([discount for row, discount in discounts]))
+        except Exception:
+            logger.warning('Bulk discount import failed, saving the chunk row by row', exc_info=True)
+        saved = 0
+        for (row, discount), original in zip(discounts, valid_to):
+            # undo what the rolled back batch did to the instance
+            discount.valid_to, discount._state.adding = original, True
+            try:
+                discount.save()
+                saved += 1
+            except Exception as e:
+                self.error(row, str(e))
+        return saved
+
+
+def draft_version(version):
+    from .models import PriceListVersion, VERSION_STATUS
+    if not isinstance(version, PriceListVersion):
+        version = PriceListVersion.objects.get(pk=version)
+    if version.status != VERSION_STATUS.DRAFT:
+        raise ValidationError(_('Only draft price list versions can be changed'))
+    return version
+
+
+def _import_partition(path, chunk_size, progress, version_id=None):
+    try:
+        return PartitionImporter(progress, version_id).run(path, chunk_size)
+    finally:
+        connections.close_all()
+
+
+def import_price_list(path, workers=None, chunk_size=2000, progress=None, version=None):
+    """
+    Import ProductPrice and Discount rows from the csv at path in a process pool.
+    With a draft PriceListVersion, prices are staged in that version instead of going live; their
+    price group columns must be empty or the version's own. Other versions raise ValidationError.
+
+    Rows are partitioned by product_number, each partition is validated and written by one worker
+    on its own database connection. progress(done, total) is called as chunks complete.
+    Returns totals and the first validation errors as (line, message) tuples.
+    """
+    workers = workers or os.cpu_count() or 1
+    started = time.monotonic()
+    if version is not None:
+        version = draft_version(version)
+    with tempfile.TemporaryDirectory() as directory:
+        paths, total = split_by_product(path, workers, directory)
+        # workers must open their own connections, never share the parent's socket
+        connections.close_all()
+        with Manager() as manager, ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            progress_queue = manager.Queue()
+            version_id = getattr(version, 'pk', version)
+            pending = {executor.submit(_import_partition, p, chunk_size, progress_queue, version_id) for p in paths}
+            done_rows = 0
+            results = []
+            while pending:
+                finished, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+                results.extend(future.result() for future in finished)
+                while True:
+                    try:
+                        done_rows += progress_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if progress:
+                        progress(done_rows, total)
+    summary = {'rows': 0, 'prices': 0, 'discounts': 0, 'errors': []}
+    for result in results:
+        for key in ['rows', 'prices', 'discounts']:
+            summary[key] += result[key]
+        summary['errors'] += result['errors']
+    summary['errors'] = sorted(summary['errors'])[:MAX_REPORTED_ERRORS]
+    price_cache.changed()
+    summary['seconds'] = round(time.monotonic() - started, 2)
+    logger.info('Imported %(rows)s price list rows (%(prices)s prices, %(discounts)s discounts) in %(seconds)ss', summary)
+    return summary
@@ -0,0 +1,351 @@
+import datetime
+import decimal
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from .cache import default_lookups, price_cache
+from .price_calculations import calculate_price
+from .price_grid import DurationPrices, best_discount, in_bands, price_precedence, round_duration
+
+MAX_BULK_QUOTE_ITEMS = getattr(settings, 'PRODUCT_PRICE_MAX_BULK_QUOTE_ITEMS', 200)
+
+
+def _price_cache_key(*parts):
+    return ':'.join(str(getattr(part, 'pk', part)) for part in parts)
+
+
+def _priced_products(customer, country, store, quantity):
+    from apps_shared.product.models import Product
+    return Product.objects.all().add_prices(
+        customer = customer,
+        country = country,
+        store = store,
+        quantity = quantity,
+    )
+
+
+def _resolve_product_price(product, customer, country, store, quantity):
+    product = _priced_products(customer, country, store, quantity).get(pk = getattr(product, 'pk', product))
+    return _price_fields(product)
+
+
+async def _aresolve_product_price(product, customer, country, store, quantity):
+    # add_prices may look up defaults while building the queryset; the query itself runs on the async ORM
+    products = await sync_to_async(_priced_products)(customer, country, store, quantity)
+    product = await products.aget(pk = getattr(product, 'pk', product))
+    return _price_fields(product)
+
+
+def _price_fields(product):
+    return {
+        'price': product.price,
+        'price_discount': product.price_discount,
+        'unit': product.unit,
+        'vat_percentage': product.calc_vat_percentage,
+        'pricing_type': product.calc_pricing_type,
+    }
+
+
+def resolve_product_price(product, customer=None, country=None, store=None, quantity=1):
+    """
+    Resolved price, discount, unit, VAT percentage and pricing type of product for a customer/store context.
+    Results are cached until the next validity boundary (see cache.PriceCache).
+    """
+    key = _price_cache_key('product', product, customer, country, store, quantity)
+    return price_cache.get_or_compute(
+        key,
+        lambda: _resolve_product_price(product, customer, country, store, quantity),
+        scope=getattr(product, 'pk', product),
+    )
+
+
+async def aresolve_product_price(product, customer=None, country=None, store=None, quantity=1):
+    """
+    Async counterpart of resolve_product_price, sharing its cache entries.
+    """
+    key = _price_cache_key('product', product, customer, country, store, quantity)
+    return await price_cache.aget_or_compute(
+        key,
+        lambda: _aresolve_product_price(product, customer, country, store, quantity),
+        scope=getattr(product, 'pk', product),
+    )
+
+
+def _duration_price(product, customer, quantity, duration):
+    now = timezone.now()
+    return DurationPrices(product, now, now + duration, quantity, customer=customer).at(now, duration)
+
+
+def resolve_duration_price(product, customer=None, quantity=1, duration=None):
+    """
+    (price, price discount, pricing type) of renting product for duration from now, by the duration bands
+    of its hour and day prices (price_grid.DurationPrices), or None without such a price. add_prices does
+    not know durations, so quotes take this over the product price; cached like resolve_product_price.
+    """
+    key = _price_cache_key('duration', product, customer, quantity, duration.total_seconds())
+    return price_cache.get_or_compute(
+        key,
+        lambda: _duration_price(product, customer, quantity, duration),
+        scope=getattr(product, 'pk', product),
+    )
+
+
+def _with_duration_price(resolved, duration_price):
+    if duration_price is None:
+        return resolved
+    price, price_discount, pricing_type = duration_price
+    return {**resolved, 'price': price, 'price_discount': price_discount, 'pricing_type': pricing_type}
+
+
+def _priced_by_duration(resolved, duration):
+    from apps_shared.product.choices import PRICING_TYPE
+    return duration is not None and resolved['pricing_type'] in (PRICING_TYPE.PRICE_PER_HOUR, PRICING_TYPE.PRICE_PER_DAY)
+
+
+def _coupon(discount_code, emails, amount, quantities):
+    """
+    The coupon of discount_code and the error checking it against the order (DiscountCoupon.validate_order).
+    """
+    from .models import DiscountCoupon
+    coupon = DiscountCoupon.objects.filter(discount_code=discount_code).first()
+    if coupon is None:
+        return None, _('Invalid discount code')
+    return coupon, coupon.validate_order(emails, amount, quantities)
+
+
+def _decimal(value):
+    return decimal.Decimal(str(value or 0))
+
+
+def _quote_amount(resolved, quantity, duration):
+    price = _decimal(resolved['price']) - _decimal(resolved['price_discount'])
+    return calculate_price(price, _decimal(quantity), resolved['pricing_type'], duration)
+
+
+def _build_quote(product, quantity, duration, store, resolved, coupon=None, coupon_error=False, discount_label=None):
+    """
+    Totals of a quote. Prices include VAT when the store enters prices with VAT.
+    """
+    vat = _decimal(resolved['vat_percentage'])
+    amount = _quote_amount(resolved, quantity, duration)
+    coupon_discount = decimal.Decimal(0)
+    if coupon is not None and not coupon_error:
+        coupon_discount = min(amount, coupon.discount_abs) if coupon.discount_abs else amount * coupon.discount_perc
+    total = amount - coupon_discount
+    if getattr(store, 'enter_vat', True):
+        total_ex_vat, total_in_vat = total / (1 + vat), total
+    else:
+        total_ex_vat, total_in_vat = total, total * (1 + vat)
+    cents = decimal.Decimal('0.01')
+    return {
+        'product': str(getattr(product, 'pk', product)),
+        'quantity': quantity,
+        'duration': duration,
+        **resolved,
+        'amount': amount.quantize(cents),
+        'discount_code': coupon.discount_code if coupon is not None else None,
+        'discount_label': discount_label,
+        'coupon_discount': coupon_discount.quantize(cents),
+        'coupon_error': coupon_error or None,
+        'total_ex_vat': total_ex_vat.quantize(cents),
+        'total_in_vat': total_in_vat.quantize(cents),
+    }
+
+
+def quote(product, customer=None, country=None, store=None, quantity=1, duration=None, discount_code=None, emails=None):
+    """
+    Price, discount, coupon and totals of quantity units of product (for duration, when priced per hour or day).
+    emails identify the customer for email bound coupons and per customer limits.
+    """
+    from apps_base.entity.models import Store
+    store = store or default_lookups.get(Store)
+    resolved = resolve_product_price(product, customer=customer, country=country, store=store, quantity=quantity)
+    if _priced_by_duration(resolved, duration):
+        resolved = _with_duration_price(resolved, resolve_duration_price(product, customer, quantity, duration))
+    coupon, coupon_error, label = None, False, None
+    if discount_code:
+        amount = _quote_amount(resolved, quantity, duration)
+        coupon, coupon_error = _coupon(discount_code, emails, amount, {getattr(product, 'pk', product): quantity})
+        # labels come from the shared translation cache (cache.discount_labels)
+        label = coupon.get_discount_label() if coupon is not None else None
+    return _build_quote(product, quantity, duration, store, resolved, coupon, coupon_error, label)
+
+
+async def aquote(product, customer=None, country=None, store=None, quantity=1, duration=None, discount_code=None, emails=None):
+    """
+    Async counterpart of quote on the async ORM and cache API, for views that serve many concurrent quotes.
+    """
+    from apps_base.entity.models import Store
+    store = store or await sync_to_async(default_lookups.get)(Store)
+    resolved = await aresolve_product_price(product, customer=customer, country=country, store=store, quantity=quantity)
+    if _priced_by_duration(resolved, duration):
+        resolved = _with_duration_price(resolved, await sync_to_async(resolve_duration_price)(product, customer, quantity, duration))
+    coupon, coupon_error, label = None, False, None
+    if discount_code:
+        amount = _quote_amount(resolved, quantity, duration)
+        coupon, coupon_error = await sync_to_async(_coupon)(discount_code, emails, amount, {getattr(product, 'pk', product): quantity})
+        label = await sync_to_async(coupon.get_discount_label)() if coupon is not None else None
+    return _build_quote(product, quantity, duration, store, resolved, coupon, coupon_error, label)
+
+
+def customer_groups(customer):
+    """
+    (PriceGroup pk, CustomerDiscountGroup pk) prices are resolved with for customer: the customer's
+    CUSTOMER_PRICE_GROUP_FIELD and CUSTOMER_DISCOUNT_GROUP_FIELD, the fields add_prices reads. Customers
+    without a price group, and quotes without a customer, get the default price group.
+    """
+    from .models import CUSTOMER_DISCOUNT_GROUP_FIELD, CUSTOMER_PRICE_GROUP_FIELD, PriceGroup
+    if customer is None:
+        return PriceGroup.get_default_pk(), None
+    if not isinstance(customer, models.Model):
+        from apps_shared.customer.models import Customer
+        customer = Customer.objects.get(pk=customer)
+    try:
+        price_group, discount_group = (customer._meta.get_field(name).attname for name in (CUSTOMER_PRICE_GROUP_FIELD, CUSTOMER_DISCOUNT_GROUP_FIELD))
+    except FieldDoesNotExist as e:
+        raise ImproperlyConfigured(
+            f'{customer._meta.label}: {e}; set PRODUCT_PRICE_CUSTOMER_PRICE_GROUP_FIELD and PRODUCT_PRICE_CUSTOMER_DISCOUNT_GROUP_FIELD'
+        )
+    return getattr(customer, price_group) or PriceGroup.get_default_pk(), getattr(customer, discount_group)
+
+
+class OptionPrices:
+    """
+    Prices of product options for many lines, read with a fixed number of queries: the live option prices
+    of the products or of their product price groups, and the discounts that apply to them by the rules of
+    Discount.objects.applicable (product and discount group hierarchy, customer, option or no option).
+    Rows are picked with the precedence and discount rules of price_grid.DurationPrices.
+    """
+
+    def __init__(self, pairs, customer=None, now=None):
+        from .models import Discount, ProductDiscountGroup, ProductDiscountGroupClosure, ProductPrice, ProductPriceGroup
+        now = now or timezone.now()
+        product_ids = {product for product, option in pairs}
+        option_ids = {option for product, option in pairs}
+        price_group, customer_discount_group = customer_groups(customer)
+        self.price_groups = {str(product): group for product, group in ProductPriceGroup.of_products(product_ids).items()}
+        self.prices = list(ProductPrice.objects.filter_live().filter(
+            Q(product__in=product_ids) | Q(product__isnull=True, product_price_group__in=set(self.price_groups.values())),
+            option__in=option_ids,
+            price_group=price_group,
+            valid_from__lte=now,
+            valid_to__gt=now,
+        ).values('product_id', 'product_price_group_id', 'option_id', 'price', 'pricing_type', 'min_order_quantity', 'max_order_quantity', 'min_duration', 'max_duration'))
+        discount_groups = ProductDiscountGroup.of_products(product_ids)
+        applicable = ProductDiscountGroupClosure.applicable_groups(set(discount_groups.values())) if discount_groups else {}
+        # product -> discount groups whose discounts apply to it
+        self.discount_groups = {str(product): applicable.get(group, set()) for product, group in discount_groups.items()}
+        groups = set().union(*self.discount_groups.values())
+        self.discounts = list(Discount.objects.for_customer(customer, customer_discount_group).filter(
+            Q(product__in=product_ids) | Q(product_discount_group__in=groups),
+            Q(option__isnull=True) | Q(option__in=option_ids),
+            valid_from__lte=now,
+            valid_to__gt=now,
+        ).values('product_id', 'product_discount_group_id', 'option_id', 'discount_perc', 'discount_abs', 'min_order_quantity', 'max_order_quantity', 'min_duration', 'max_duration'))
+
+    def price(self, product, option, quantity, duration=None):
+        """
+        (price, price discount, pricing type) of quantity units of option of product, or None without an option price.
+        """
+        rounded = round_duration(duration) if duration else datetime.timedelta(0)
+        candidates = [
+            row for row in self.prices
+            if str(row['option_id']) == str(option) and in_bands(row, quantity, rounded) and (
+                str(row['product_id']) == str(product)
+                or (row['product_id'] is None and row['product_price_group_id'] == self.price_groups.get(str(product)))
+            )
+        ]
+        if not candidates:
+            return None
+        row = max(candidates, key=price_precedence)
+        groups = self.discount_groups.get(str(product), set())
+        discounts = [
+            discount for discount in self.discounts
+            if (str(discount['product_id']) == str(product) or discount['product_discount_group_id'] in groups)
+            and discount['option_id'] in (None, row['option_id']) and in_bands(discount, quantity, rounded)
+        ]
+        return row['price'], best_discount(discounts, row['price']), row['pricing_type']
+
+
+def bulk_quote(items, customer=None, country=None, store=None, discount_code=None, emails=None):
+    """
+    Quote many lines in one go. items are dicts with product, option, quantity and duration.
+
+    Products are resolved with one add_prices query per distinct quantity (quantity bands are part
+    of the resolution), options with the fixed number of queries of OptionPrices, and the coupon with
+    a fixed number of queries, however many lines there are. Rentals priced per hour or day take their
+    duration band from the cached resolve_duration_price, like quote. The coupon discount is spread over
+    the lines the coupon is valid for (all lines, unless the coupon is restricted to products).
+    """
+    from apps_base.entity.models import Store
+    store = store or default_lookups.get(Store)
+    by_quantity = defaultdict(set)
+    for item in items:
+        by_quantity[item.get('quantity') or 1].add(str(item['product']))
+    resolved = {}
+    for quantity, product_ids in by_quantity.items():
+        for product in _priced_products(customer, country, store, quantity).filter(pk__in=product_ids):
+            resolved[(str(product.pk), quantity)] = _price_fields(product)
+    option_pairs = {(str(item['product']), item['option']) for item in items if item.get('option')}
+    options = OptionPrices(option_pairs, customer) if option_pairs else None
+
+    lines = []
+    for item in items:
+        quantity = item.get('quantity') or 1
+        product, option = str(item['product']), item.get('option')
+        fields = resolved.get((product, quantity))
+        if fields is not None and not option and _priced_by_duration(fields, item.get('duration')):
+            fields = _with_duration_price(fields, resolve_duration_price(product, customer, quantity, item['duration']))
+        if fields is not None and option:
+            option_price = options.price(product, option, quantity, item.get('duration'))
+            if option_price is None:
+                lines.append({'product': product, 'option': option, 'quantity': quantity, 'error': _('No price for this option')})
+                continue
+            price, price_discount, pricing_type = option_price
+            fields = {**fields, 'price': price, 'price_discount': price_discount, 'pricing_type': pricing_type}
+        if fields is None:
+            lines.append({'product': product, 'option': option, 'quantity': quantity, 'error': _('Not found')})
+            continue
+        line = _build_quote(product, quantity, item.get('duration'), store, fields)
+        line['option'] = option
+        lines.append(line)
+    quoted = [line for line in lines if 'error' not in line]
+    amount = sum((line['amount'] for line in quoted), decimal.Decimal(0))
+
+    coupon, coupon_error, coupon_discount = None, False, decimal.Decimal(0)
+    if discount_code:
+        quantities = defaultdict(int)
+        for line in quoted:
+            quantities[line['product']] += line['quantity']
+        coupon, coupon_error = _coupon(discount_code, emails, amount, quantities)
+        if not coupon_error:
+            allowed = {str(pk) for pk in coupon.products.values_list('pk', flat=True)}
+            eligible = [line for line in quoted if not allowed or line['product'] in allowed]
+            eligible_amount = sum((line['amount'] for line in eligible), decimal.Decimal(0))
+            if eligible_amount:
+                coupon_discount = min(eligible_amount, coupon.discount_abs) if coupon.discount_abs else eligible_amount * coupon.discount_perc
+                factor = (eligible_amount - coupon_discount) / eligible_amount
+                for line in eligible:
+                    line['coupon_discount'] = (line['amount'] * (1 - factor)).quantize(decimal.Decimal('0.01'))
+                    line['total_ex_vat'] = (line['total_ex_vat'] * factor).quantize(decimal.Decimal('0.01'))
+                    line['total_in_vat'] = (line['total_in_vat'] * factor).quantize(decimal.Decimal('0.01'))
+    total_ex_vat = sum((line['total_ex_vat'] for line in quoted), decimal.Decimal(0))
+    total_in_vat = sum((line['total_in_vat'] for line in quoted), decimal.Decimal(0))
+    cents = decimal.Decimal('0.01')
+    return {
+        'lines': lines,
+        'amount': amount.quantize(cents),
+        'discount_code': coupon.discount_code if coupon is not None else None,
+        'discount_label': coupon.get_discount_label() if coupon is not None else None,
+        'coupon_discount': coupon_discount.quantize(cents),
+        'coupon_error': coupon_error or None,
+        'total_ex_vat': total_ex_vat.quantize(cents),
+        'total_in_vat': total_in_vat.quantize(cents),
+    }
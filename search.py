@@ -0,0 +1,28 @@
+from django.db.models import Exists, OuterRef
+from rest_framework.filters import SearchFilter
+
+from .models import ProductSearchText
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    Searches rows with a product foreign key by product name (any language) and product number.
+
+    Every term is matched with EXISTS on ProductSearchText instead of joining the product translations,
+    so rows are not repeated per translation and no DISTINCT is needed. The text ILIKE '%term%' condition
+    is served by the pg_trgm GIN index of migration 0018.
+    """
+    product_field = 'product'
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        for term in terms:
+            texts = ProductSearchText.objects.filter(product=OuterRef(self.product_field), text__trigram_icontains=term)
+            queryset = queryset.filter(Exists(texts))
+        return queryset
+
+
+def with_product_search(filter_backends):
+    return [ProductSearchFilter if issubclass(backend, SearchFilter) else backend for backend in filter_backends]
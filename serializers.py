@@ -1,4 +1,13 @@
+import copy
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.functional import cached_property
+from django.utils.translation import get_language
 from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
 
 from .models import *
 from apps_base.api.serializer_class import BaseModelSerializer, BaseTranslateModelSerializer
@@ -6,6 +15,9 @@ from django.utils.translation import gettext_lazy as _
 from apps_shared.customer.serializers import CustomerSerializer
 from apps_base.api import serializer_fields
 from apps_base._base.utils import safe_get
+from django.db import transaction
+from .cache import discount_labels
+from .coupon_guard import check_discount_code
 
 class ProductSerializer(BaseModelSerializer):
     class Meta:
@@ -17,18 +29,113 @@ class PriceGroupSerializer(BaseModelSerializer):
         model = PriceGroup
         fields = '__all__'
 
+DURATION_PRICING_TYPES = [PRICING_TYPE.PRICE_PER_HOUR, PRICING_TYPE.PRICE_PER_DAY]
+# plain value fields whose representation only needs the attribute itself
+SIMPLE_FIELD_TYPES = (
+    serializers.CharField, serializers.IntegerField, serializers.DecimalField, serializers.FloatField, serializers.BooleanField,
+    serializers.DateTimeField, serializers.DurationField, serializers.UUIDField, serializers.ChoiceField,
+)
+# only take the fast path while the base serializer uses the stock representation
+FAST_REPRESENTATION = BaseModelSerializer.to_representation is serializers.Serializer.to_representation
+FIELD_TEMPLATE_CACHE_SIZE = getattr(settings, 'PRODUCT_PRICE_FIELD_TEMPLATE_CACHE_SIZE', 64)
+# serializer kwargs that select fields; the other field arguments do not change get_fields()
+FIELD_SET_OPTIONS = ('fields', 'exclude')
+FIELD_ARGUMENTS = {
+    'instance', 'data', 'partial', 'many', 'context', 'read_only', 'write_only', 'required', 'default', 'initial', 'source',
+    'label', 'help_text', 'style', 'error_messages', 'validators', 'allow_null', 'allow_empty',
+}
+# context entries the field set may depend on through the request (user, language)
+CONTEXT_INPUTS = {'request', 'view', 'format'}
+
 class ProductPriceSerializer(BaseModelSerializer):
     price_group_object = PriceGroupSerializer(source='price_group', label=_('Price group'), read_only=True)
     product_object = ProductSerializer(source='product', label=_('Product'), read_only=True)
+    # most recently used last: field template key -> unbound field templates
+    _field_templates = OrderedDict()
+    _field_templates_lock = threading.Lock()
     class Meta:
         model = ProductPrice
         fields = '__all__'    
+
+    def _field_template_key(self, with_duration):
+        """
+        The cache key of this serializer's field set, or None when it depends on inputs that are not part of it.
+        Selected field names are reduced to known ones, so arbitrary ?fields= values share entries.
+        """
+        if set(self._kwargs) - FIELD_ARGUMENTS - set(FIELD_SET_OPTIONS) or set(self.context) - CONTEXT_INPUTS:
+            return None
+        known = set(self._declared_fields) | {field.name for field in self.Meta.model._meta.get_fields()}
+        selection = []
+        for option in FIELD_SET_OPTIONS:
+            names = self._kwargs.get(option)
+            if names is not None and not isinstance(names, str):
+                names = tuple(sorted(known.intersection(names)))
+            selection.append(names)
+        request = self.context.get('request')
+        user = getattr(request, 'user', None)
+        return (type(self), with_duration, *selection, get_language(), getattr(user, 'pk', None))
+
     def get_fields(self):
-        fields = super().get_fields()
-        if bool(self.instance and not isinstance(self.instance, list) and not self.instance.pricing_type in [PRICING_TYPE.PRICE_PER_HOUR, PRICING_TYPE.PRICE_PER_DAY]):
-            fields.pop('min_duration')
-            fields.pop('max_duration')
-        return fields
+        with_duration = not (self.instance and not isinstance(self.instance, list) and not self.instance.pricing_type in DURATION_PRICING_TYPES)
+        key = self._field_template_key(with_duration)
+        with self._field_templates_lock:
+            templates = self._field_templates.get(key) if key is not None else None
+            if templates is not None:
+                self._field_templates.move_to_end(key)
+        if templates is None:
+            templates = super().get_fields()
+            if not with_duration:
+                templates.pop('min_duration', None)
+                templates.pop('max_duration', None)
+            if key is not None:
+                with self._field_templates_lock:
+                    self._field_templates[key] = templates
+                    while len(self._field_templates) > FIELD_TEMPLATE_CACHE_SIZE:
+                        self._field_templates.popitem(last=False)
+        # copying the templates re-instantiates each field from its arguments, without model introspection
+        return {name: copy.deepcopy(field) for name, field in templates.items()}
+
+    @cached_property
+    def _representation_plan(self):
+        plan = []
+        for field in self._readable_fields:
+            simple = isinstance(field, SIMPLE_FIELD_TYPES) and len(field.source_attrs) == 1 and field.source != '*'
+            plan.append((field.field_name, field, field.source_attrs[0] if simple else None))
+        return plan
+
+    def to_representation(self, instance):
+        if not FAST_REPRESENTATION:
+            return super().to_representation(instance)
+        # a list serializer reuses one child for every row, so the plan is built once per list
+        ret = {}
+        for name, field, attr in self._representation_plan:
+            if attr is not None:
+                value = getattr(instance, attr, None)
+                ret[name] = None if value is None else field.to_representation(value)
+                continue
+            try:
+                attribute = field.get_attribute(instance)
+            except SkipField:
+                continue
+            check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+            ret[name] = None if check_for_none is None else field.to_representation(attribute)
+        return ret
+class ProductSlimSerializer(BaseModelSerializer):
+    name = serializers.SerializerMethodField(label=_('Name'))
+    class Meta:
+        model = Product
+        fields = ['id', 'product_number', 'name']
+
+    def get_name(self, product):
+        return product.safe_translation_getter('name', any_language=True)
+
+class ProductPriceListSerializer(ProductPriceSerializer):
+    """
+    Read serializer for price listings: the related product and price group are reduced to what a list shows.
+    """
+    price_group_object = PriceGroupSerializer(source='price_group', label=_('Price group'), read_only=True, fields=['id', 'description'])
+    product_object = ProductSlimSerializer(source='product', label=_('Product'), read_only=True)
+
 class ProductPriceGroupSerializer(BaseModelSerializer):
     product_price_objects = ProductPriceSerializer(source='productprice_set', label=_('Prices'), fields=['id', 'price', 'pricing_type', 'min_order_quantity', 'max_order_quantity', 'min_duration', 'max_duration', 'valid_from', 'valid_to'], read_only=True, many=True)
     duplicate_prices = serializer_fields.BooleanField(label=_('Duplicate prices'), write_only=True, initial=False)
@@ -72,8 +179,31 @@ class DiscountSerializer(BaseModelSerializer):
             raise serializers.ValidationError(_('A discount with this maximum order quantity already exists'))
         return max_order_quantity
     
+class DiscountLabelField(serializers.CharField):
+    """
+    Translated discount_label read from the shared discount_labels cache instead of the translation table;
+    written like any translated field.
+    """
+    def get_attribute(self, instance):
+        labels = getattr(self.parent, '_discount_labels', None)
+        if labels is not None and instance.pk in labels:
+            return labels[instance.pk]
+        return instance.get_discount_label()
+
+class DiscountLabelListSerializer(serializers.ListSerializer):
+    """
+    Looks up the discount labels of all listed objects with one cache round trip (and at most one query).
+    """
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        self.child._discount_labels = discount_labels.get_many(self.child.Meta.model, [item.pk for item in items])
+        try:
+            return super().to_representation(items)
+        finally:
+            del self.child._discount_labels
+
 class ProductDiscountGroupSerializer(BaseModelSerializer):
-    discount_label= serializers.CharField(label=_('discount label'))
+    discount_label= DiscountLabelField(label=_('discount label'))
     discount_objects = DiscountSerializer(
             source='discounts.all', 
             label=_('Discounts'),
@@ -90,6 +220,7 @@ class ProductDiscountGroupSerializer(BaseModelSerializer):
     class Meta:
         model = ProductDiscountGroup
         fields = '__all__'
+        list_serializer_class = DiscountLabelListSerializer
 
 class DiscountCouponTranslationSerializer(BaseTranslateModelSerializer):
     class Meta:
@@ -99,11 +230,12 @@ class DiscountCouponTranslationSerializer(BaseTranslateModelSerializer):
         ]
 
 class DiscountCouponSerializer(BaseTranslateModelSerializer):
-    discount_label= serializers.CharField(label=_('Discount label'))
+    discount_label= DiscountLabelField(label=_('Discount label'))
 
     class Meta:
         model = DiscountCoupon
         fields = '__all__'
+        list_serializer_class = DiscountLabelListSerializer
 
     def validate_discount_perc(self, value):
         """
@@ -114,14 +246,14 @@ class DiscountCouponSerializer(BaseTranslateModelSerializer):
         return value
 
 
-class DiscountCouponSerializer(BaseModelSerializer):
+class DiscountCouponCodeSerializer(BaseModelSerializer):
     discount_code = serializers.CharField(label=_('Discount code'))
     class Meta:
         model = DiscountCoupon
         fields = ['discount_code']
 
     def validate_discount_code(self, value):
-        if not DiscountCoupon.objects.filter(discount_code=value).exists():
+        if not check_discount_code(value, self.context.get('request')) or not DiscountCoupon.objects.filter(discount_code=value).exists():
             raise serializers.ValidationError(_('Invalid discount code'))
         return value
 
@@ -140,6 +272,8 @@ class DiscountCouponFieldMixin:
     def validate_discount_code(self, discount_code):
         if not discount_code:
             return None
+        if not check_discount_code(discount_code, self.context.get('request')):
+            raise serializer_fields.ValidationError(_('Invalid discount code'))
         coupon = DiscountCoupon.objects.filter(discount_code=discount_code).first()
         if not coupon:
             raise serializer_fields.ValidationError(_('Invalid discount code'))
@@ -154,7 +288,14 @@ class DiscountCouponFieldMixin:
 
     def save(self, **kwargs):
         discount_code = self.validated_data.pop('discount_code', None)
-        instance = super().save(**kwargs)
-        if discount_code: 
-            instance.add_discount_coupon(discount_code)
+        with transaction.atomic():
+            instance = super().save(**kwargs)
+            if discount_code: 
+                error = discount_code.redeem(
+                    email=instance.email or safe_get(instance, 'account', 'email'),
+                    reference=str(instance.pk),
+                )
+                if error:
+                    raise serializer_fields.ValidationError({'discount_code': error})
+                instance.add_discount_coupon(discount_code)
         return instance
\ No newline at end of file
@@ -0,0 +1,145 @@
+import threading
+
+from django.core.signals import request_started
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from apps_base.entity.models import Store
+from apps_shared.product.models import Product
+from apps_shared.vat.models import Country
+
+from django.db import connections, transaction
+
+from .cache import WARM_CACHES, default_lookups, coupon_products, discount_labels, price_cache
+from .coupon_guard import discount_codes
+from .models import CHANGE_OPERATION, PriceChangeEvent, ProductSearchText, PriceGroup, ProductPriceGroup, DiscountCoupon, ProductPrice, Discount, ProductDiscountGroup, CustomerDiscountGroup
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Store, dispatch_uid='product_price_store_default_saved')
+@receiver(post_delete, sender=Store, dispatch_uid='product_price_store_default_deleted')
+@receiver(post_save, sender=PriceGroup, dispatch_uid='product_price_price_group_default_saved')
+@receiver(post_delete, sender=PriceGroup, dispatch_uid='product_price_price_group_default_deleted')
+@receiver(post_save, sender=Country, dispatch_uid='product_price_country_default_saved')
+@receiver(post_delete, sender=Country, dispatch_uid='product_price_country_default_deleted')
+def invalidate_default_lookup(sender, instance, **kwargs):
+    default_lookups.invalidate(sender, instance)
+    # other processes drop theirs once the change is visible to them
+    transaction.on_commit(lambda: default_lookups.changed(sender, instance))
+
+
+@receiver(post_save, sender=Product, dispatch_uid='product_price_coupon_product_saved')
+@receiver(post_delete, sender=Product, dispatch_uid='product_price_coupon_product_deleted')
+def invalidate_coupon_product(sender, instance, **kwargs):
+    coupon_products.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=DiscountCoupon, dispatch_uid='product_price_discount_code_saved')
+@receiver(post_delete, sender=DiscountCoupon, dispatch_uid='product_price_discount_code_deleted')
+def discount_code_changed(sender, instance, **kwargs):
+    if kwargs.get('created'):
+        # a rolled back code only costs a false positive
+        discount_codes.add(instance.discount_code)
+    # other processes must not rebuild their filters before the change is visible to them
+    transaction.on_commit(discount_codes.changed)
+
+
+PRICE_MODELS = [ProductPrice, Discount, DiscountCoupon, PriceGroup, ProductDiscountGroup, CustomerDiscountGroup]
+
+
+def price_change_scopes(sender, instance):
+    # products whose resolved prices may change, before and after the save; None means any product
+    if sender not in (ProductPrice, Discount):
+        return None
+    # rows created in this process have no loaded scope
+    loaded = getattr(instance, '_loaded_scope', None)
+    if loaded is not None and 'product_id' not in loaded:
+        # loaded without its product: the old scope is unknown
+        return None
+    loaded = loaded or {}
+    if sender is Discount and (instance.product_discount_group_id or loaded.get('product_discount_group_id')):
+        return None
+    products = {instance.product_id, loaded.get('product_id')} - {None}
+    return sorted(products, key=str) or None
+
+
+def price_changed(sender, instance, **kwargs):
+    scopes = price_change_scopes(sender, instance)
+    if isinstance(instance, (ProductPrice, Discount)):
+        instance.remember_scope()
+    transaction.on_commit(lambda: price_cache.changed(scopes))
+
+
+for model in PRICE_MODELS:
+    post_save.connect(price_changed, sender=model, dispatch_uid=f'product_price_changed_saved_{model._meta.model_name}')
+    post_delete.connect(price_changed, sender=model, dispatch_uid=f'product_price_changed_deleted_{model._meta.model_name}')
+
+
+@receiver(post_delete, sender=ProductPrice, dispatch_uid='product_price_outbox_price_deleted')
+@receiver(post_delete, sender=Discount, dispatch_uid='product_price_outbox_discount_deleted')
+@receiver(post_delete, sender=DiscountCoupon, dispatch_uid='product_price_outbox_coupon_deleted')
+@receiver(post_delete, sender=PriceGroup, dispatch_uid='product_price_outbox_price_group_deleted')
+@receiver(post_delete, sender=ProductPriceGroup, dispatch_uid='product_price_outbox_product_price_group_deleted')
+def record_price_deleted(sender, instance, **kwargs):
+    # the deletion collector sends post_delete inside its transaction
+    PriceChangeEvent.record([instance], CHANGE_OPERATION.DELETE)
+
+
+ProductTranslation = Product._parler_meta.root_model
+
+
+@receiver(post_save, sender=Product, dispatch_uid='product_price_outbox_product_saved')
+@receiver(post_delete, sender=Product, dispatch_uid='product_price_outbox_product_deleted')
+@receiver(post_save, sender=ProductTranslation, dispatch_uid='product_price_outbox_product_translation_saved')
+@receiver(post_delete, sender=ProductTranslation, dispatch_uid='product_price_outbox_product_translation_deleted')
+def record_product_changed(sender, instance, **kwargs):
+    # products are nested in price responses; their ETags follow the outbox
+    if sender is ProductTranslation:
+        instance = Product(pk=instance.master_id)
+    deleted = sender is Product and 'created' not in kwargs
+    PriceChangeEvent.record([instance], CHANGE_OPERATION.DELETE if deleted else CHANGE_OPERATION.UPSERT)
+
+
+@receiver(post_save, sender=Product, dispatch_uid='product_price_search_product_saved')
+@receiver(post_delete, sender=Product, dispatch_uid='product_price_search_product_deleted')
+@receiver(post_save, sender=ProductTranslation, dispatch_uid='product_price_search_product_translation_saved')
+@receiver(post_delete, sender=ProductTranslation, dispatch_uid='product_price_search_product_translation_deleted')
+def sync_product_search(sender, instance, **kwargs):
+    # bulk updates of products are picked up by the rebuild_product_search command
+    ProductSearchText.sync([instance.master_id if sender is ProductTranslation else instance.pk])
+
+
+# translation model -> translated model
+LABEL_MODELS = {model._parler_meta.root_model: model for model in [DiscountCoupon, ProductDiscountGroup]}
+
+
+def discount_label_changed(sender, instance, **kwargs):
+    discount_labels.invalidate(LABEL_MODELS[sender], instance.master_id)
+
+
+for translation_model in LABEL_MODELS:
+    post_save.connect(discount_label_changed, sender=translation_model, dispatch_uid=f'product_price_label_saved_{translation_model._meta.model_name}')
+    post_delete.connect(discount_label_changed, sender=translation_model, dispatch_uid=f'product_price_label_deleted_{translation_model._meta.model_name}')
+
+
+def _warm_caches():
+    try:
+        discount_codes.may_exist('')
+        coupon_products.warm(Store.objects.values_list('pk', flat=True))
+    except Exception:
+        logger.exception('Warming product price caches failed')
+    finally:
+        connections.close_all()
+
+
+def warm_caches(sender, **kwargs):
+    # run once per process, on the first request rather than during app loading, and off the
+    # request thread; read only: coupon products are created when a coupon is first applied
+    request_started.disconnect(dispatch_uid='product_price_warm_caches')
+    threading.Thread(target=_warm_caches, name='product_price_warm_caches', daemon=True).start()
+
+
+if WARM_CACHES:
+    request_started.connect(warm_caches, dispatch_uid='product_price_warm_caches')
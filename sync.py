@@ -0,0 +1,102 @@
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Max, Q, Subquery
+
+from .models import CHANGE_OPERATION, PriceChangeEvent
+from .outbox import OUTBOX_RETENTION_DAYS
+
+CHANGES_PAGE_SIZE = getattr(settings, 'PRODUCT_PRICE_CHANGES_PAGE_SIZE', 5000)
+# the most recent outbox events are counted into the change marker, so a transaction that commits
+# after a later one (ids are assigned at insert, not at commit) still changes it
+CHANGE_MARKER_WINDOW = getattr(settings, 'PRODUCT_PRICE_CHANGE_MARKER_WINDOW', 1000)
+# cursors older than this may point at pruned outbox events; clients then download everything again
+CURSOR_MAX_AGE = (OUTBOX_RETENTION_DAYS - 1) * 86400
+LAST_EVENT = 2 ** 63 - 1
+
+
+class CursorExpired(Exception):
+    pass
+
+
+def encode_cursor(transaction_id, event_id):
+    return f'{transaction_id}.{event_id}.{int(time.time())}'
+
+
+def decode_cursor(cursor):
+    try:
+        transaction_id, event_id, issued = (int(part) for part in cursor.split('.'))
+    except (AttributeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if issued < time.time() - CURSOR_MAX_AGE:
+        raise CursorExpired
+    return transaction_id, event_id
+
+
+def committed_horizon():
+    """
+    Transactions below this id are finished, so their outbox events can no longer appear or change.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT txid_snapshot_xmin(txid_current_snapshot())')
+        return cursor.fetchone()[0]
+
+
+def change_marker(models=None):
+    """
+    (last event id, recent event count, last event time) of the outbox events of models (model names;
+    all events without). Changes whenever a change of one of them commits, bulk updates included.
+    Two queries: the last id of each model (a backward scan of the (model, id) index) and the count of
+    the recent events on the primary key.
+    """
+    events = PriceChangeEvent.objects.all()
+    if models:
+        events = events.filter(model__in=models)
+        heads = [PriceChangeEvent.objects.filter(model=model).order_by('-id').values_list('id', flat=True)[:1] for model in models]
+    else:
+        heads = [events.order_by('-id').values_list('id', flat=True)[:1]]
+    last = max(heads[0].union(*heads[1:], all=True), default=None)
+    newest = PriceChangeEvent.objects.order_by('-id').values('id')[:1]
+    marker = events.filter(id__gt=Subquery(newest) - CHANGE_MARKER_WINDOW).aggregate(
+        recent=Count('id'), modified=Max('created_time'),
+    )
+    return last, marker['recent'], marker['modified']
+
+
+def read_changes(queryset, fields, since=None, limit=CHANGES_PAGE_SIZE):
+    """
+    Changes of the rows of queryset after the since cursor, read from the outbox.
+
+    Returns {'cursor', 'has_more', 'upserts', 'deletes'}: upserts are dicts of fields of rows that
+    currently match queryset, deletes the ids of rows that were deleted or no longer match it.
+    Without since only the cursor of the current position is returned, for clients that start from
+    a full download.
+    """
+    horizon = committed_horizon()
+    if since is None:
+        return {'cursor': encode_cursor(horizon - 1, LAST_EVENT), 'has_more': False, 'upserts': [], 'deletes': []}
+    transaction_id, event_id = decode_cursor(since)
+    events = list(
+        PriceChangeEvent.objects.filter(model=queryset.model._meta.model_name, transaction_id__lt=horizon)
+        .filter(Q(transaction_id__gt=transaction_id) | Q(transaction_id=transaction_id, id__gt=event_id))
+        .order_by('transaction_id', 'id')
+        .values_list('transaction_id', 'id', 'object_id', 'operation')[:limit + 1]
+    )
+    has_more = len(events) > limit
+    events = events[:limit]
+    if events:
+        transaction_id, event_id = events[-1][:2]
+    elif transaction_id < horizon - 1:
+        # nothing changed: move the cursor up to the horizon
+        transaction_id, event_id = horizon - 1, LAST_EVENT
+    operations = {object_id: operation for _, _, object_id, operation in events}
+    upserted = [object_id for object_id, operation in operations.items() if operation == CHANGE_OPERATION.UPSERT]
+    upserts = list(queryset.prefetch_related(None).filter(pk__in=upserted).values(*fields)) if upserted else []
+    found = {row['id'] for row in upserts}
+    return {
+        'cursor': encode_cursor(transaction_id, event_id),
+        'has_more': has_more,
+        'upserts': upserts,
+        'deletes': [object_id for object_id in operations if object_id not in found],
+    }
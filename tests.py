@@ -1,3 +1,632 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import decimal
+import threading
+import time
+import uuid
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone, translation
+from rest_framework.exceptions import Throttled
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from apps_base.entity.models import Store
+from apps_shared.product.choices import PRICING_TYPE
+from apps_shared.product.utils import get_create_product
+
+from .cache import PRICE_CACHE_STALE, CouponProductCache, DefaultLookupCache, PriceCache, discount_labels
+from .coupon_generation import bulk_create_coupons
+from .coupon_guard import CODE_FILTER_GENERATION_KEY, BloomFilter, DiscountCodeFilter, DiscountCodeThrottle, check_discount_code
+from .models import COUPON_SLOTS, CUSTOMER_PRICE_GROUP_FIELD, OPEN_ENDED, VERSION_STATUS, Discount, DiscountCoupon, DiscountCouponRedemption, PriceGroup, PriceListVersion, ProductPrice, ProductSearchText
+from .price_import import import_price_list
+from .search import ProductSearchFilter
+from .serializers import ProductPriceSerializer
+from .price_grid import price_grid
+from .pricing import bulk_quote, quote
+from .signals import price_change_scopes
+from .sync import change_marker
+from .viewsets import DiscountCoupoonViewSet, PriceGroupViewSet, ProductPriceViewSet
+from .views import price_cache_stats
+
+
+def create_product(number, pricing_type=PRICING_TYPE.PRICE):
+    return get_create_product(number, {'name': number, 'pricing_type': pricing_type, 'default_price': 0}, Store.get_default())[0]
+
+
+class DefaultLookupCacheTests(TestCase):
+
+    def test_get_returns_copies_of_one_row(self):
+        lookups = DefaultLookupCache(poll_interval=0)
+        first, second = lookups.get(Store), lookups.get(Store)
+        self.assertEqual(first.pk, second.pk)
+        self.assertIsNot(first, second)
+        self.assertEqual(lookups.get_pk(Store), first.pk)
+
+    def test_change_in_other_process_drops_entries(self):
+        lookups = DefaultLookupCache(poll_interval=0)
+        lookups.get_pk(Store)
+        DefaultLookupCache().changed(Store)
+        lookups._sync()
+        self.assertEqual(lookups._entries, {})
+
+
+class CouponProductCacheTests(TestCase):
+
+    def test_get_returns_copies_without_queries(self):
+        products = CouponProductCache()
+        store = Store.get_default()
+        first = products.get('DISCOUNT_COUPON_ABS', store)
+        with self.assertNumQueries(0):
+            second = products.get('DISCOUNT_COUPON_ABS', store)
+        self.assertEqual(first.pk, second.pk)
+        self.assertIsNot(first, second)
+
+    def test_warm_loads_products_resolved_elsewhere(self):
+        store = Store.get_default()
+        pk = CouponProductCache().get_pk('DISCOUNT_COUPON_PERC', store)
+        products = CouponProductCache()
+        with self.assertNumQueries(1):
+            products.warm([store.pk])
+        with self.assertNumQueries(0):
+            self.assertEqual(products.get('DISCOUNT_COUPON_PERC', store).pk, pk)
+        # products nobody resolved yet are not created by warming
+        self.assertNotIn(('DISCOUNT_COUPON_ABS', store.pk), products._entries)
+
+    def test_saving_the_product_drops_the_entry(self):
+        products = CouponProductCache()
+        store = Store.get_default()
+        product = products.get('DISCOUNT_COUPON_ABS', store)
+        with mock.patch('apps_shared.product_price.signals.coupon_products', products):
+            product.save()
+        self.assertEqual(products._entries, {})
+
+
+class BloomFilterTests(SimpleTestCase):
+
+    def test_no_false_negatives(self):
+        codes = [f'CODE-{number:06d}' for number in range(20000)]
+        bloom = BloomFilter(len(codes))
+        for code in codes:
+            bloom.add(code)
+        self.assertTrue(all(code in bloom for code in codes))
+
+    def test_false_positive_rate_near_target(self):
+        bloom = BloomFilter(10000, error_rate=0.01)
+        for number in range(10000):
+            bloom.add(f'IN-{number}')
+        false_positives = sum(f'OUT-{number}' in bloom for number in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class DiscountCodeFilterTests(TestCase):
+
+    def test_generation_bumped_on_commit(self):
+        cache.delete(CODE_FILTER_GENERATION_KEY)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            DiscountCoupon.objects.create(discount_code='WELCOME10', discount_perc=10)
+            self.assertIsNone(cache.get(CODE_FILTER_GENERATION_KEY))
+        self.assertTrue(callbacks)
+        self.assertIsNotNone(cache.get(CODE_FILTER_GENERATION_KEY))
+
+
+class DiscountCodeGuardTests(SimpleTestCase):
+
+    def test_answers_maybe_until_the_background_rebuild_is_done(self):
+        codes = DiscountCodeFilter()
+        started, finish = threading.Event(), threading.Event()
+
+        def rebuild(generation=None):
+            started.set()
+            finish.wait(10)
+            bloom = BloomFilter(10)
+            bloom.add('KNOWN')
+            codes._filter, codes._generation, codes._built = bloom, generation, time.monotonic()
+
+        with mock.patch.object(codes, 'rebuild', rebuild), mock.patch('apps_shared.product_price.coupon_guard.connections'):
+            self.assertTrue(codes.may_exist('UNKNOWN'))
+            self.assertTrue(started.wait(10))
+            self.assertTrue(codes.may_exist('UNKNOWN'))
+            finish.set()
+            while codes._lock.locked():
+                time.sleep(0.01)
+        self.assertFalse(codes.may_exist('UNKNOWN'))
+        self.assertTrue(codes.may_exist('KNOWN'))
+
+    def test_throttle_is_shared_through_the_cache(self):
+        cache.clear()
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.1')
+        request.user = AnonymousUser()
+        with mock.patch.object(DiscountCodeThrottle, 'THROTTLE_RATES', {'discount_code': '2/min'}), \
+                mock.patch('apps_shared.product_price.coupon_guard.discount_codes') as discount_codes:
+            check_discount_code('A', request)
+            check_discount_code('B', request)
+            with self.assertRaises(Throttled):
+                check_discount_code('C', request)
+        self.assertEqual(discount_codes.may_exist.call_count, 2)
+
+
+class CouponRedemptionTests(TransactionTestCase):
+
+    def test_redeem_skips_slot_locked_by_other_transaction(self):
+        coupon = DiscountCoupon.objects.create(discount_code='TWICE', discount_perc=10, max_uses=2)
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_first_slot():
+            try:
+                with transaction.atomic():
+                    DiscountCouponRedemption.objects.select_for_update().get(discount_coupon=coupon, slot=0)
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        holder = threading.Thread(target=hold_first_slot)
+        holder.start()
+        try:
+            self.assertTrue(locked.wait(10))
+            self.assertIs(coupon.redeem(email='a@example.com'), False)
+            remaining = dict(coupon.redemptions.filter(slot__isnull=False).values_list('slot', 'remaining'))
+            self.assertEqual(remaining, {0: 1, 1: 0})
+        finally:
+            release.set()
+            holder.join()
+        self.assertIs(coupon.redeem(email='b@example.com'), False)
+        self.assertTrue(coupon.redeem(email='c@example.com'))
+
+    def test_concurrent_redemptions_never_exceed_max_uses(self):
+        coupon = DiscountCoupon.objects.create(discount_code='THREE', discount_perc=10, max_uses=3)
+        barrier = threading.Barrier(6)
+        results = []
+
+        def redeem(number):
+            try:
+                barrier.wait(10)
+                results.append(DiscountCoupon.objects.get(pk=coupon.pk).redeem(email=f'user{number}@example.com'))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=redeem, args=(number,)) for number in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(False), 3)
+        self.assertEqual(coupon.redemptions.filter(redeemed_time__isnull=False).count(), 3)
+        self.assertFalse(coupon.redemptions.filter(remaining__gt=0).exists())
+
+    def test_large_max_uses_keeps_a_fixed_slot_pool(self):
+        coupon = DiscountCoupon.objects.create(discount_code='MANY', discount_perc=10, max_uses=1000000)
+        slots = coupon.redemptions.filter(slot__isnull=False)
+        self.assertEqual(slots.count(), COUPON_SLOTS)
+        self.assertEqual(sum(slots.values_list('remaining', flat=True)), 1000000)
+        self.assertIs(coupon.redeem(email='a@example.com'), False)
+        coupon.max_uses = 10
+        coupon.save()
+        self.assertEqual(sum(slots.values_list('remaining', flat=True)), 9)
+
+    def test_per_customer_limit_ignores_email_case(self):
+        coupon = DiscountCoupon.objects.create(discount_code='ONCE', discount_perc=10, max_uses_per_customer=1)
+        self.assertIs(coupon.redeem(email='Jane@Example.com'), False)
+        self.assertTrue(coupon.redeem(email='jane@example.com'))
+        self.assertEqual(coupon.used_by(['JANE@EXAMPLE.COM']), 1)
+
+
+class DiscountWindowTests(TestCase):
+
+    def setUp(self):
+        self.product = create_product('DISCOUNT-TIERS')
+        self.start = timezone.now() - datetime.timedelta(days=10)
+
+    def discount(self, perc, **fields):
+        fields.setdefault('valid_from', self.start)
+        discount = Discount(product=self.product, discount_perc=decimal.Decimal(perc), **fields)
+        discount.save()
+        return discount
+
+    def test_quantity_tiers_stay_open_side_by_side(self):
+        self.discount('0.05', min_order_quantity=0, max_order_quantity=9)
+        self.discount('0.10', min_order_quantity=10, max_order_quantity=99)
+        open_windows = Discount.objects.filter(product=self.product, valid_to__gte=OPEN_ENDED)
+        self.assertEqual(sorted(open_windows.values_list('discount_perc', flat=True)), [decimal.Decimal('0.05'), decimal.Decimal('0.10')])
+
+    def test_new_amount_closes_the_open_window_of_its_tier(self):
+        old = self.discount('0.05')
+        changed = timezone.now()
+        self.discount('0.07', valid_from=changed)
+        old.refresh_from_db()
+        self.assertEqual(old.valid_to, changed)
+        self.assertEqual(Discount.objects.filter(product=self.product, valid_to__gte=OPEN_ENDED).get().discount_perc, decimal.Decimal('0.07'))
+
+    def test_same_amounts_in_overlapping_window_are_not_duplicated(self):
+        self.discount('0.05')
+        self.discount('0.05', valid_from=self.start + datetime.timedelta(days=1))
+        self.assertEqual(Discount.objects.filter(product=self.product).count(), 1)
+
+    def test_same_amounts_after_an_expired_window_are_saved(self):
+        self.discount('0.05', valid_to=self.start + datetime.timedelta(days=2))
+        self.discount('0.05', valid_from=self.start + datetime.timedelta(days=5))
+        self.assertEqual(Discount.objects.filter(product=self.product).count(), 2)
+
+    def test_absolute_discount_is_part_of_the_duplicate_check(self):
+        self.discount('0', discount_abs=decimal.Decimal('5'))
+        self.discount('0', discount_abs=decimal.Decimal('7.5'), valid_from=timezone.now())
+        self.assertEqual(Discount.objects.filter(product=self.product).count(), 2)
+
+    def test_bulk_save_follows_the_rules_of_save(self):
+        old = self.discount('0.05')
+        changed = timezone.now()
+        created = Discount.bulk_save([
+            Discount(product=self.product, discount_perc=decimal.Decimal('0.05'), valid_from=self.start + datetime.timedelta(days=1)),
+            Discount(product=self.product, discount_perc=decimal.Decimal('7'), valid_from=changed),
+            Discount(product=self.product, discount_perc=decimal.Decimal('0.10'), valid_from=self.start, min_order_quantity=10, max_order_quantity=99),
+        ])
+        self.assertEqual(len(created), 2)
+        old.refresh_from_db()
+        self.assertEqual(old.valid_to, changed)
+        open_windows = Discount.objects.filter(product=self.product, valid_to__gte=OPEN_ENDED)
+        self.assertEqual(sorted(open_windows.values_list('discount_perc', flat=True)), [decimal.Decimal('0.07'), decimal.Decimal('0.10')])
+
+    def test_bulk_save_queries_do_not_grow_with_the_rows(self):
+        products = [create_product(f'DISCOUNT-BULK-{number}') for number in range(20)]
+        for product in products[:10]:
+            Discount(product=product, discount_perc=decimal.Decimal('0.05'), valid_from=self.start).save()
+        discounts = [Discount(product=product, discount_perc=decimal.Decimal('0.06')) for product in products]
+        # savepoint, lock, read, outbox and close the overlapped windows, insert, outbox, release
+        with self.assertNumQueries(8):
+            Discount.bulk_save(discounts)
+        self.assertEqual(Discount.objects.filter(product__in=products, valid_to__gte=OPEN_ENDED, discount_perc=decimal.Decimal('0.06')).count(), 20)
+
+
+class PriceListVersionTests(TestCase):
+
+    def setUp(self):
+        self.price_group = PriceGroup.objects.get(pk=PriceGroup.get_default_pk())
+        self.first, self.second = create_product('VERSION-A'), create_product('VERSION-B')
+        for product in (self.first, self.second):
+            ProductPrice.objects.create(product=product, price_group=self.price_group, price=decimal.Decimal('10'))
+
+    def test_publication_replaces_only_the_products_of_the_version(self):
+        version = PriceListVersion.objects.create(price_group=self.price_group, description='A only')
+        version.stage([ProductPrice(product=self.first, price=decimal.Decimal('12'))])
+        version.publish()
+        live = dict(ProductPrice.objects.filter_live().filter(price_group=self.price_group).values_list('product_id', 'price'))
+        self.assertEqual(live, {self.first.pk: decimal.Decimal('12'), self.second.pk: decimal.Decimal('10')})
+
+        version.rollback()
+        live = dict(ProductPrice.objects.filter_live().filter(price_group=self.price_group).values_list('product_id', 'price'))
+        self.assertEqual(live, {self.first.pk: decimal.Decimal('10'), self.second.pk: decimal.Decimal('10')})
+
+    def test_import_refuses_published_versions(self):
+        version = PriceListVersion.objects.create(price_group=self.price_group, description='Live', status=VERSION_STATUS.PUBLISHED)
+        with self.assertRaises(ValidationError):
+            import_price_list('/nonexistent.csv', version=version)
+
+
+class PriceCacheLifetimeTests(SimpleTestCase):
+
+    def setUp(self):
+        self.price_cache = PriceCache(max_timeout=3600)
+
+    def test_entry_expiring_at_a_boundary_is_never_stale(self):
+        timeout, stale = self.price_cache.lifetime(timezone.now() + datetime.timedelta(minutes=10))
+        self.assertLessEqual(timeout, 600)
+        self.assertEqual(stale, 0)
+
+    def test_entry_cut_off_by_the_cap_may_be_stale(self):
+        timeout, stale = self.price_cache.lifetime(timezone.now() + datetime.timedelta(days=2))
+        self.assertEqual(timeout, 3600)
+        self.assertEqual(stale, PRICE_CACHE_STALE)
+
+    def test_stale_window_ends_at_the_boundary(self):
+        timeout, stale = self.price_cache.lifetime(timezone.now() + datetime.timedelta(seconds=3610))
+        self.assertLessEqual(timeout + stale, 3610)
+
+
+class PriceCacheRefreshTests(SimpleTestCase):
+
+    def setUp(self):
+        self.price_cache = PriceCache(max_timeout=3600)
+        self.price_cache.cache.set(self.price_cache.BOUNDARY_KEY, timezone.now() + datetime.timedelta(days=1), 3600)
+        self.key = f'refresh:{uuid.uuid4()}'
+        self.calls = []
+
+    def compute(self):
+        self.calls.append(1)
+        return decimal.Decimal('1')
+
+    def test_entry_refreshed_by_another_process_is_adopted(self):
+        full_key = self.price_cache.make_key(self.key, 'refresh')
+        fresh_until = time.time() + 60
+        self.price_cache.cache.set(full_key, (decimal.Decimal('2'), fresh_until, fresh_until), 60)
+        self.price_cache.refresh(self.key, self.compute, 'refresh')
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.price_cache.get_or_compute(self.key, self.compute, 'refresh'), decimal.Decimal('2'))
+
+    def test_key_locked_by_another_process_is_not_recomputed(self):
+        full_key = self.price_cache.make_key(self.key, 'refresh')
+        self.price_cache.cache.add(full_key + ':lock', 1, 60)
+        self.price_cache.refresh(self.key, self.compute, 'refresh')
+        self.assertEqual(self.calls, [])
+
+    def test_stale_key_is_recomputed_once(self):
+        self.price_cache.refresh(self.key, self.compute, 'refresh')
+        self.price_cache.refresh(self.key, self.compute, 'refresh')
+        self.assertEqual(len(self.calls), 1)
+
+
+class PriceChangeScopeTests(TestCase):
+
+    def test_moving_a_price_invalidates_old_and_new_product(self):
+        old, new = create_product('SCOPE-OLD'), create_product('SCOPE-NEW')
+        ProductPrice.objects.create(product=old, price=decimal.Decimal('5'))
+        price = ProductPrice.objects.get(product=old)
+        price.product = new
+        self.assertEqual(set(price_change_scopes(ProductPrice, price)), {old.pk, new.pk})
+
+    def test_new_price_invalidates_its_product_only(self):
+        product = create_product('SCOPE-ONE')
+        price = ProductPrice(product=product, price=decimal.Decimal('5'))
+        self.assertEqual(price_change_scopes(ProductPrice, price), [product.pk])
+
+
+class PriceCacheStatsViewTests(SimpleTestCase):
+
+    def test_refuses_non_staff_with_json_403(self):
+        request = RequestFactory().get('/product-price/cache-stats/')
+        request.user = AnonymousUser()
+        response = price_cache_stats(request)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        self.product = create_product('ETAG')
+        self.price_group = PriceGroup.objects.get(pk=PriceGroup.get_default_pk())
+        ProductPrice.objects.create(product=self.product, price_group=self.price_group, price=decimal.Decimal('10'))
+        self.request = RequestFactory().get('/product/price/')
+        self.request.user = AnonymousUser()
+
+    def etag(self, viewset=ProductPriceViewSet):
+        return viewset()._validators(self.request)[0]
+
+    def test_etag_is_stable_without_changes(self):
+        self.assertEqual(self.etag(), self.etag())
+
+    def test_etag_changes_when_nested_product_is_renamed(self):
+        before = self.etag()
+        self.product.name = 'Renamed'
+        self.product.save()
+        self.assertNotEqual(self.etag(), before)
+
+    def test_etag_changes_when_price_group_changes(self):
+        before = self.etag()
+        self.price_group.description = 'Renamed default'
+        self.price_group.save()
+        self.assertNotEqual(self.etag(), before)
+
+    def test_discount_marker_changes_on_bulk_window_close(self):
+        Discount(product=self.product, discount_perc=decimal.Decimal('0.05'), valid_from=timezone.now() - datetime.timedelta(days=1)).save()
+        before = change_marker(['discount'])
+        # closes the open window with an update(), recorded in the outbox
+        Discount(product=self.product, discount_perc=decimal.Decimal('0.10')).save()
+        self.assertNotEqual(change_marker(['discount']), before)
+
+    def test_etag_ignores_changes_outside_its_models(self):
+        before, groups_before = self.etag(), self.etag(PriceGroupViewSet)
+        DiscountCoupon.objects.create(discount_code='ETAGSCOPE', discount_perc=decimal.Decimal('0.1'))
+        self.assertEqual(self.etag(), before)
+        ProductPrice.objects.create(product=self.product, price_group=self.price_group, price=decimal.Decimal('12'))
+        self.assertNotEqual(self.etag(), before)
+        self.assertEqual(self.etag(PriceGroupViewSet), groups_before)
+
+
+class ProductSearchTests(TestCase):
+
+    def setUp(self):
+        self.product = create_product('SEARCH-1')
+        ProductPrice.objects.create(product=self.product, price=decimal.Decimal('10'))
+
+    def search(self, term):
+        request = RequestFactory().get('/product/price/', {'search': term})
+        return ProductSearchFilter().filter_queryset(request, ProductPrice.objects.all(), None)
+
+    def test_matches_number_and_name_case_insensitively(self):
+        self.assertTrue(self.search('search-1').exists())
+        self.product.name = 'Cordless drill'
+        self.product.save()
+        self.assertTrue(self.search('DRILL').exists())
+        self.assertFalse(self.search('ladder').exists())
+
+    def test_search_texts_follow_product_deletes(self):
+        product_id = self.product.pk
+        ProductPrice.objects.filter(product=self.product).delete()
+        self.product.delete()
+        self.assertFalse(ProductSearchText.objects.filter(product_id=product_id).exists())
+
+
+class FieldTemplateCacheTests(SimpleTestCase):
+
+    def key(self, **kwargs):
+        return ProductPriceSerializer(**kwargs)._field_template_key(True)
+
+    def test_unknown_field_names_share_a_key(self):
+        self.assertEqual(self.key(fields=['id', 'price', 'nonsense']), self.key(fields=['price', 'id']))
+
+    def test_language_is_part_of_the_key(self):
+        with translation.override('en'):
+            english = self.key()
+        with translation.override('nl'):
+            self.assertNotEqual(self.key(), english)
+
+    def test_unknown_context_is_not_cached(self):
+        self.assertIsNone(self.key(context={'price_group': 'wholesale'}))
+
+
+class DiscountLabelTests(TestCase):
+
+    def test_labels_of_many_coupons_in_one_query(self):
+        coupons = [DiscountCoupon.objects.create(discount_code=f'LABEL{number}', discount_perc=10, discount_label=f'Label {number}') for number in range(3)]
+        cache.delete_many([discount_labels.make_key(DiscountCoupon, coupon.pk, translation.get_language()) for coupon in coupons])
+        with self.assertNumQueries(1):
+            labels = discount_labels.get_many(DiscountCoupon, [coupon.pk for coupon in coupons])
+        self.assertEqual(labels, {coupon.pk: f'Label {number}' for number, coupon in enumerate(coupons)})
+        with self.assertNumQueries(0):
+            discount_labels.get_many(DiscountCoupon, [coupon.pk for coupon in coupons])
+
+    def test_coupon_list_renders_labels_from_the_cache(self):
+        for number in range(3):
+            DiscountCoupon.objects.create(discount_code=f'LISTED{number}', discount_perc=10, discount_label=f'Listed {number}')
+        request = APIRequestFactory().get('/product/discount-coupon/')
+        force_authenticate(request, user=get_user_model().objects.create_superuser('coupon-admin', 'admin@example.com', 'secret'))
+        with mock.patch.object(discount_labels, 'get_many', wraps=discount_labels.get_many) as get_many:
+            response = DiscountCoupoonViewSet.as_view({'get': 'list'})(request)
+        self.assertEqual(response.status_code, 200)
+        rows = response.data['results'] if isinstance(response.data, dict) else response.data
+        self.assertEqual({row['discount_label'] for row in rows}, {f'Listed {number}' for number in range(3)})
+        get_many.assert_called_once()
+
+    def test_translation_save_drops_the_cached_label(self):
+        coupon = DiscountCoupon.objects.create(discount_code='RELABEL', discount_perc=10, discount_label='Before')
+        self.assertEqual(coupon.get_discount_label(), 'Before')
+        coupon.discount_label = 'After'
+        coupon.save()
+        self.assertEqual(DiscountCoupon.objects.get(pk=coupon.pk).get_discount_label(), 'After')
+
+
+class AsyncPriceCacheTests(SimpleTestCase):
+
+    async def test_concurrent_misses_compute_once(self):
+        price_cache = PriceCache(max_timeout=3600)
+        await price_cache.cache.aset(price_cache.BOUNDARY_KEY, timezone.now() + datetime.timedelta(days=1), 3600)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.2)
+            return decimal.Decimal('42')
+
+        key = f'stampede:{uuid.uuid4()}'
+        results = await asyncio.gather(*(price_cache.aget_or_compute(key, compute, scope='stampede') for _ in range(5)))
+        self.assertEqual(results, [decimal.Decimal('42')] * 5)
+        self.assertEqual(len(calls), 1)
+
+
+class CouponRulesTests(TestCase):
+
+    def setUp(self):
+        self.product = create_product('COUPON-RULES')
+        ProductPrice.objects.create(product=self.product, price=decimal.Decimal('100'))
+
+    def test_email_bound_coupon_compares_case_insensitively(self):
+        coupon = DiscountCoupon.objects.create(discount_code='PERSONAL', discount_perc=decimal.Decimal('0.1'), email='Jane@Example.com')
+        self.assertFalse(coupon.validate_order(['jane@example.com'], decimal.Decimal('10'), {}))
+        self.assertTrue(coupon.validate_order(['john@example.com'], decimal.Decimal('10'), {}))
+
+    def test_distinct_products_needed(self):
+        other = create_product('COUPON-RULES-2')
+        coupon = DiscountCoupon.objects.create(discount_code='BUNDLE', discount_perc=decimal.Decimal('0.1'), needs_products=-2)
+        coupon.products.set([self.product, other])
+        self.assertTrue(coupon.validate_order([], decimal.Decimal('10'), {self.product.pk: 5}))
+        self.assertFalse(coupon.validate_order([], decimal.Decimal('10'), {self.product.pk: 1, other.pk: 1}))
+
+    def test_quote_applies_the_same_rules(self):
+        DiscountCoupon.objects.create(discount_code='ONLYJANE', discount_perc=decimal.Decimal('0.1'), email='jane@example.com')
+        self.assertTrue(quote(self.product, discount_code='ONLYJANE')['coupon_error'])
+        self.assertIsNone(quote(self.product, discount_code='ONLYJANE', emails=['JANE@example.com'])['coupon_error'])
+
+    def test_quote_respects_the_per_customer_limit(self):
+        coupon = DiscountCoupon.objects.create(discount_code='ONCEONLY', discount_perc=decimal.Decimal('0.1'), max_uses_per_customer=1)
+        coupon.redeem(email='jane@example.com')
+        self.assertTrue(quote(self.product, discount_code='ONCEONLY', emails=['jane@example.com'])['coupon_error'])
+
+
+class BulkQuoteTests(TestCase):
+
+    def setUp(self):
+        self.first, self.second = create_product('BULK-A'), create_product('BULK-B')
+        for product in (self.first, self.second):
+            ProductPrice.objects.create(product=product, price=decimal.Decimal('100'))
+
+    def test_product_coupon_discounts_only_its_products(self):
+        coupon = DiscountCoupon.objects.create(discount_code='ONLYA', discount_perc=decimal.Decimal('0.1'), needs_products=1)
+        coupon.products.set([self.first])
+        items = [{'product': str(self.first.pk), 'quantity': 1}, {'product': str(self.second.pk), 'quantity': 1}]
+        result = bulk_quote(items, discount_code='ONLYA')
+        self.assertIsNone(result['coupon_error'])
+        first, second = result['lines']
+        self.assertEqual(result['coupon_discount'], (first['amount'] * decimal.Decimal('0.1')).quantize(decimal.Decimal('0.01')))
+        self.assertEqual(first['coupon_discount'], result['coupon_discount'])
+        self.assertEqual(second['coupon_discount'], decimal.Decimal('0.00'))
+        self.assertEqual(result['total_in_vat'], first['total_in_vat'] + second['total_in_vat'])
+
+
+    def test_option_lines_use_the_customers_price_group_like_product_lines(self):
+        from apps_shared.customer.models import Customer
+        from apps_shared.product.models import ProductOption
+        wholesale = PriceGroup.objects.create(description='Wholesale')
+        customer = Customer.objects.create(company='Wholesale customer', **{CUSTOMER_PRICE_GROUP_FIELD: wholesale})
+        option = ProductOption.objects.create(product=self.first)
+        ProductPrice.objects.create(product=self.first, price_group=wholesale, price=decimal.Decimal('80'))
+        ProductPrice.objects.create(product=self.first, option=option, price=decimal.Decimal('10'))
+        ProductPrice.objects.create(product=self.first, option=option, price_group=wholesale, price=decimal.Decimal('8'))
+        items = [{'product': str(self.first.pk), 'quantity': 1}, {'product': str(self.first.pk), 'option': option.pk, 'quantity': 1}]
+        product_line, option_line = bulk_quote(items, customer=customer)['lines']
+        self.assertEqual(product_line['amount'], quote(self.first, customer=customer)['amount'])
+        self.assertEqual(product_line['amount'], decimal.Decimal('80.00'))
+        self.assertEqual(option_line['price'], decimal.Decimal('8'))
+        self.assertEqual(bulk_quote(items[1:])['lines'][0]['price'], decimal.Decimal('10'))
+
+
+class PriceGridTests(TestCase):
+
+    def setUp(self):
+        self.yesterday = timezone.now() - datetime.timedelta(days=1)
+
+    def price(self, product, price, pricing_type, **fields):
+        ProductPrice.objects.create(product=product, price=decimal.Decimal(price), pricing_type=pricing_type, valid_from=self.yesterday, **fields)
+
+    def assertGridMatchesQuotes(self, product, durations):
+        grid = price_grid(product, [timezone.now()], durations)['grid'][0]
+        for duration, amount in zip(durations, grid):
+            self.assertEqual(amount, quote(product, duration=duration)['amount'], duration)
+        return grid
+
+    def test_day_prices_with_discount(self):
+        product = create_product('GRID-DAY', PRICING_TYPE.PRICE_PER_DAY)
+        self.price(product, '20', PRICING_TYPE.PRICE_PER_DAY)
+        Discount(product=product, discount_perc=decimal.Decimal('0.1'), valid_from=self.yesterday).save()
+        self.assertGridMatchesQuotes(product, [datetime.timedelta(days=days) for days in (1, 2, 5)])
+
+    def test_hour_price_charges_the_hours_not_the_rounded_day(self):
+        product = create_product('GRID-HOUR', PRICING_TYPE.PRICE_PER_HOUR)
+        self.price(product, '5', PRICING_TYPE.PRICE_PER_HOUR)
+        grid = self.assertGridMatchesQuotes(product, [datetime.timedelta(hours=8)])
+        self.assertEqual(grid, [decimal.Decimal('40.00')])
+
+    def test_duration_bands(self):
+        product = create_product('GRID-BANDS', PRICING_TYPE.PRICE_PER_DAY)
+        self.price(product, '20', PRICING_TYPE.PRICE_PER_DAY, min_duration=datetime.timedelta(0), max_duration=datetime.timedelta(days=2))
+        self.price(product, '15', PRICING_TYPE.PRICE_PER_DAY, min_duration=datetime.timedelta(days=3), max_duration=datetime.timedelta(days=100))
+        grid = self.assertGridMatchesQuotes(product, [datetime.timedelta(days=2), datetime.timedelta(days=5)])
+        self.assertEqual(grid, [decimal.Decimal('40.00'), decimal.Decimal('75.00')])
+
+
+class CouponGenerationTests(TestCase):
+
+    def test_email_count_must_match(self):
+        for emails in (['a@example.com'], ['a@example.com', 'b@example.com', 'c@example.com']):
+            with self.assertRaises(ValueError):
+                bulk_create_coupons(2, 'Campaign', emails=emails, discount_perc=decimal.Decimal('0.1'))
+        self.assertFalse(DiscountCoupon.objects.exists())
+
+    def test_one_coupon_per_email(self):
+        bulk_create_coupons(2, 'Campaign', emails=['a@example.com', 'b@example.com'], discount_perc=decimal.Decimal('0.1'))
+        self.assertEqual(sorted(DiscountCoupon.objects.values_list('email', flat=True)), ['a@example.com', 'b@example.com'])
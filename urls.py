@@ -0,0 +1,17 @@
+"""
+Plain Django views of the app (cache statistics, quotes). The portal only routes the viewsets
+declared in the models' BritgePortal classes, so the project urlconf has to include these:
+
+    path('product-price/', include('apps_shared.product_price.urls')),
+"""
+from django.urls import path
+
+from . import views
+
+app_name = 'product_price'
+
+urlpatterns = [
+    path('cache-stats/', views.price_cache_stats, name='price_cache_stats'),
+    path('quote/', views.quote_view, name='quote'),
+    path('quote/bulk/', views.bulk_quote_view, name='bulk_quote'),
+]
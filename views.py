@@ -1,3 +1,123 @@
-from django.shortcuts import render
+import json
+import os
 
-# Create your views here.
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.http import JsonResponse
+from django.utils.dateparse import parse_duration
+from django.utils.translation import gettext as _
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.exceptions import Throttled
+
+from .cache import price_cache
+from .coupon_guard import check_discount_code
+from .pricing import MAX_BULK_QUOTE_ITEMS, aquote, bulk_quote
+
+
+def price_cache_stats(request):
+    # a JSON endpoint: refuse with 403 rather than redirecting to the admin login
+    if not (request.user.is_active and request.user.is_staff):
+        return JsonResponse({'detail': _('You do not have permission to perform this action.')}, status=403)
+    return JsonResponse({'pid': os.getpid(), **price_cache.stats()})
+
+
+async def _get(model, pk):
+    return await model.objects.aget(pk=pk) if pk else None
+
+
+async def _context(params, user):
+    # store, country and (for staff only) customer of a quote request
+    from apps_base.entity.models import Store
+    from apps_shared.customer.models import Customer
+    from apps_shared.vat.models import Country
+    store = await _get(Store, params.get('store'))
+    country = await _get(Country, params.get('country'))
+    customer = await _get(Customer, params.get('customer')) if user.is_staff else None
+    return customer, country, store
+
+
+def _emails(user, customer):
+    # who the quote is for, for email bound coupons and per customer limits
+    return [getattr(user, 'email', None), getattr(customer, 'email', None)]
+
+
+async def _discount_code(code, request):
+    # None when the code certainly does not exist; raises Throttled for clients guessing codes
+    if code and not await sync_to_async(check_discount_code)(code, request):
+        return None
+    return code
+
+
+async def quote_view(request):
+    """
+    GET ?product=<id>&quantity=&duration=&store=&country=&customer=&discount_code=
+    Runs on the async ORM, so one process serves many concurrent quotes.
+    Customer specific prices are only quoted for staff.
+    """
+    params = request.GET
+    user = await request.auser()
+    try:
+        quantity = int(params.get('quantity') or 1)
+        duration = parse_duration(params['duration']) if params.get('duration') else None
+        if quantity < 1 or (params.get('duration') and duration is None):
+            raise ValueError
+        customer, country, store = await _context(params, user)
+        discount_code = await _discount_code(params.get('discount_code'), request)
+    except (ValueError, ValidationError):
+        return JsonResponse({'detail': _('Invalid quote parameters')}, status=400)
+    except ObjectDoesNotExist:
+        return JsonResponse({'detail': _('Not found')}, status=404)
+    except Throttled as e:
+        return JsonResponse({'detail': str(e.detail)}, status=429)
+    try:
+        result = await aquote(
+            params.get('product'), customer=customer, country=country, store=store,
+            quantity=quantity, duration=duration, discount_code=discount_code, emails=_emails(user, customer),
+        )
+    except (ObjectDoesNotExist, ValidationError, ValueError):
+        return JsonResponse({'detail': _('Not found')}, status=404)
+    if params.get('discount_code') and not discount_code:
+        result['coupon_error'] = _('Invalid discount code')
+    return JsonResponse(result)
+
+
+def _quote_items(items):
+    if not isinstance(items, list) or not 0 < len(items) <= MAX_BULK_QUOTE_ITEMS:
+        raise ValueError
+    parsed = []
+    for item in items:
+        quantity = int(item.get('quantity') or 1)
+        duration = parse_duration(str(item['duration'])) if item.get('duration') else None
+        if not item.get('product') or quantity < 1 or (item.get('duration') and duration is None):
+            raise ValueError
+        parsed.append({'product': str(item['product']), 'option': item.get('option'), 'quantity': quantity, 'duration': duration})
+    return parsed
+
+
+# read only, so no CSRF token is needed
+@csrf_exempt
+@require_POST
+async def bulk_quote_view(request):
+    """
+    POST {"items": [{"product", "option", "quantity", "duration"}, ...], "store", "country", "customer", "discount_code"}
+    Quotes all lines with a fixed number of queries; see pricing.bulk_quote.
+    """
+    user = await request.auser()
+    try:
+        body = json.loads(request.body or b'{}')
+        items = _quote_items(body.get('items'))
+        customer, country, store = await _context(body, user)
+        discount_code = await _discount_code(body.get('discount_code'), request)
+    except (ValueError, TypeError, AttributeError, KeyError, ValidationError):
+        return JsonResponse({'detail': _('Invalid quote parameters')}, status=400)
+    except ObjectDoesNotExist:
+        return JsonResponse({'detail': _('Not found')}, status=404)
+    except Throttled as e:
+        return JsonResponse({'detail': str(e.detail)}, status=429)
+    result = await sync_to_async(bulk_quote)(
+        items, customer=customer, country=country, store=store, discount_code=discount_code, emails=_emails(user, customer),
+    )
+    if body.get('discount_code') and not discount_code:
+        result['coupon_error'] = _('Invalid discount code')
+    return JsonResponse(result)
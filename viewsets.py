@@ -2,17 +2,152 @@
 from apps_base.api.viewset_class import TranslateMixin, ModelViewSetForm, britge_action_detail, britge_action_detail_multiple
 from .models import DiscountCoupon
 from .serializers import *
+from .export import export_rows
+from .pagination import KeysetPaginationMixin
+from .price_grid import month_starts, price_grid
+from .search import with_product_search
+from .sync import CHANGES_PAGE_SIZE, CursorExpired, change_marker, read_changes
 
-from django.utils.translation import gettext_lazy as _
+import hashlib
 
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_duration, parse_time
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from django.utils.translation import get_language, gettext_lazy as _
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.response import Response
 
-class PriceGroupViewSet(ModelViewSetForm):
+
+class ConditionalGetMixin:
+    """
+    ETag and Last-Modified for list and retrieve, derived from the price change outbox (sync.change_marker),
+    so unchanged responses are answered with 304 before querying or serializing anything.
+
+    The marker only follows the outbox events of etag_models: the viewset's model and the models nested
+    in its responses (defaults to the viewset's model). Prices, discounts, coupons, price groups and
+    products record outbox events on every change, bulk updates included, so any change that can alter
+    a response moves the marker, and changes of other models leave it alone.
+    """
+    etag_models = None
+
+    def get_etag_models(self):
+        return self.etag_models or [self.queryset.model._meta.model_name]
+
+    def _validators(self, request):
+        last, recent, modified = change_marker(self.get_etag_models())
+        key = f'{last}:{recent}:{request.get_full_path()}:{get_language()}:{request.user.pk}'
+        return quote_etag(hashlib.md5(key.encode()).hexdigest()), modified
+
+    def _not_modified(self, request, etag, modified):
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            return etag in parse_etags(if_none_match) or if_none_match.strip() == '*'
+        if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since') or '')
+        return bool(modified and if_modified_since and int(modified.timestamp()) <= if_modified_since)
+
+    def _conditional(self, request, validators, respond):
+        etag, modified = validators
+        if self._not_modified(request, etag, modified):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = respond()
+        response['ETag'] = etag
+        if modified:
+            response['Last-Modified'] = http_date(modified.timestamp())
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional(request, self._validators(request), lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._conditional(request, self._validators(request), lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs))
+
+
+class SparseFieldsetMixin:
+    """
+    ?fields=id,price,... on list requests selects the serialized fields and loads only their columns.
+    sparse_related maps nested serializer fields to the relation they need joined.
+    """
+    sparse_related = {}
+    sparse_always = ['id']
+
+    def get_sparse_fields(self):
+        fields = self.request.query_params.get('fields') if self.request and self.action == 'list' else None
+        if not fields:
+            return None
+        # only names the serializer can render; anything else in the query string is dropped
+        serializer_class = self.get_serializer_class()
+        known = set(serializer_class._declared_fields) | {field.name for field in serializer_class.Meta.model._meta.get_fields()}
+        return [field for field in dict.fromkeys(self.sparse_always + fields.split(',')) if field in known]
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_sparse_fields()
+        if fields:
+            kwargs.setdefault('fields', fields)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.get_sparse_fields()
+        if not fields:
+            return queryset
+        concrete = {field.name: field for field in queryset.model._meta.concrete_fields}
+        related = [self.sparse_related[field] for field in fields if field in self.sparse_related]
+        columns = [field for field in fields if field in concrete] + related
+        # ordering fields stay loaded for the (keyset) paginator
+        columns += [field.lstrip('-') for field in queryset.query.order_by if field.lstrip('-') in concrete]
+        return queryset.select_related(None).select_related(*related).only(*dict.fromkeys(columns))
+
+
+class ExportMixin:
+    """
+    Adds export/?export_format=csv|jsonl, streaming every (filtered) row with constant memory.
+    """
+    EXPORT_CONTENT_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        format = request.query_params.get('export_format', 'csv')
+        if format not in self.EXPORT_CONTENT_TYPES:
+            return Response({'detail': _('Unknown export format')}, status=status.HTTP_400_BAD_REQUEST)
+        queryset = self.filter_queryset(self.get_queryset())
+        response = StreamingHttpResponse(export_rows(queryset, format), content_type=self.EXPORT_CONTENT_TYPES[format])
+        response['Content-Disposition'] = f'attachment; filename="{queryset.model._meta.model_name}.{format}"'
+        return response
+
+
+class ChangesMixin:
+    """
+    Adds changes/?since=<cursor>: upserts and tombstones since the cursor, from the price change outbox.
+    Clients keep the returned cursor and call again while has_more is set.
+    """
+    changes_fields = ['id']
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        try:
+            limit = min(int(request.query_params.get('limit') or CHANGES_PAGE_SIZE), CHANGES_PAGE_SIZE)
+            changes = read_changes(self.get_queryset().order_by(), self.changes_fields, request.query_params.get('since'), limit)
+        except CursorExpired:
+            return Response({'detail': _('The cursor has expired, download all rows again')}, status=status.HTTP_410_GONE)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(changes)
+
+
+class PriceGroupViewSet(ConditionalGetMixin, ModelViewSetForm):
     queryset = PriceGroup.objects.all()
+    etag_models = ['pricegroup']
     serializer_class = PriceGroupSerializer
     admin_roles = ['Admin']
 
-class ProductPriceGroupViewSet(ModelViewSetForm):
+class ProductPriceGroupViewSet(ConditionalGetMixin, ModelViewSetForm):
     queryset = ProductPriceGroup.objects.all()
+    # with its nested prices
+    etag_models = ['productpricegroup', 'productprice']
     serializer_class = ProductPriceGroupSerializer
     admin_roles = ['Admin']
     serializer_exclude = ['duplicate_prices']
@@ -54,10 +189,51 @@ class ProductPriceGroupViewSet(ModelViewSetForm):
 
 
 from apps_base._base.utils import duplicate_instance_related_uuid, duplicate_instance
-class ProductPriceViewSet(TranslateMixin, ModelViewSetForm):
-    queryset = ProductPrice.objects.all().order_by('-created_time').select_related('product', 'price_group')
+class ProductPriceViewSet(ExportMixin, SparseFieldsetMixin, KeysetPaginationMixin, ConditionalGetMixin, ChangesMixin, TranslateMixin, ModelViewSetForm):
+    queryset = ProductPrice.objects.filter_live().order_by('-created_time', '-id').select_related('product', 'price_group', 'option', 'product_price_group')
     serializer_class = ProductPriceSerializer
+    etag_models = ['productprice', 'product', 'pricegroup', 'productpricegroup']
+    sparse_related = {'product_object': 'product', 'price_group_object': 'price_group', 'option': 'option', 'product_price_group': 'product_price_group'}
+    changes_fields = [
+        'id', 'product_id', 'option_id', 'price_group_id', 'product_price_group_id', 'price', 'pricing_type',
+        'min_order_quantity', 'max_order_quantity', 'min_duration', 'max_duration', 'valid_from', 'valid_to',
+    ]
     search_fields = ['product__translations__name', 'product__product_number', ]
+    filter_backends = with_product_search(ModelViewSetForm.filter_backends)
+
+    @action(detail=False, methods=['get'])
+    def calendar(self, request):
+        """
+        ?product=<id>&month=YYYY-MM[&durations=4:00:00,1 00:00:00][&quantity=][&price_group=][&start_time=HH:MM]
+        Rental amounts for every start day of the month and every duration, computed in one pass.
+        """
+        params = request.query_params
+        try:
+            year, month = (int(part) for part in (params.get('month') or timezone.now().strftime('%Y-%m')).split('-'))
+            start_time = parse_time(params.get('start_time') or '00:00')
+            durations = [parse_duration(value) for value in params['durations'].split(',')] if params.get('durations') else None
+            quantity = int(params.get('quantity') or 1)
+            if not params.get('product') or start_time is None or (durations and None in durations) or quantity < 1:
+                raise ValueError
+            starts = month_starts(year, month, start_time)
+        except ValueError:
+            return Response({'detail': _('Invalid calendar parameters')}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            grid = price_grid(params['product'], starts, durations, quantity=quantity, price_group=params.get('price_group'))
+        except DjangoValidationError:
+            return Response({'detail': _('Invalid calendar parameters')}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(grid)
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return ProductPriceListSerializer
+        return super().get_serializer_class()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list' and not self.get_sparse_fields():
+            queryset = queryset.prefetch_related('product__translations')
+        return queryset
     admin_roles = ['Admin']
 
 class ProductDiscountGroupViewSet(TranslateMixin, ModelViewSetForm):
@@ -83,13 +259,21 @@ class CustomerDiscountGroupViewSet(TranslateMixin, ModelViewSetForm):
     serializer_class = CustomerDiscountGroupSerializer
     admin_roles = ['Admin']
     
-class DiscountViewSet( ModelViewSetForm):
-    queryset = Discount.objects.all()
+class DiscountViewSet(ExportMixin, ChangesMixin, ModelViewSetForm):
+    queryset = Discount.objects.all().select_related('product', 'product_discount_group', 'customer', 'customer_discount_group')
     serializer_class = DiscountSerializer
+    changes_fields = [
+        'id', 'product_discount_group_id', 'product_id', 'option_id', 'customer_discount_group_id', 'customer_id', 'discount_abs', 'discount_perc',
+        'min_order_quantity', 'max_order_quantity', 'min_duration', 'max_duration', 'valid_from', 'valid_to',
+    ]
     admin_roles = ['Admin']
              
-class DiscountCoupoonViewSet(TranslateMixin, ModelViewSetForm):
+class DiscountCoupoonViewSet(ChangesMixin, TranslateMixin, ModelViewSetForm):
     queryset = DiscountCoupon.objects.all()
     serializer_class = DiscountCouponSerializer
+    changes_fields = [
+        'id', 'discount_code', 'email', 'discount_abs', 'discount_perc', 'minimal_order_amount', 'needs_products',
+        'max_uses', 'max_uses_per_customer', 'valid_from', 'valid_to',
+    ]
 
     admin_roles = ['Admin']